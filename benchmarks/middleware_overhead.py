@@ -0,0 +1,113 @@
+"""
+Measures the per-request overhead of `RateLimitingMiddleware` against the previous
+    `BaseHTTPMiddleware` based implementation.
+
+The apps are driven in-process through ASGI, so no network or server is involved.
+
+    python -m benchmarks.middleware_overhead --requests 5000
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Type
+
+from fastapi import FastAPI, Request, Response
+from limits.aio.storage import MemoryStorage
+from limits.aio.strategies import FixedWindowRateLimiter, RateLimiter
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp, Message
+
+from fastlimits import RateLimitingMiddleware, limit
+
+
+class LegacyRateLimitingMiddleware(BaseHTTPMiddleware):
+    """
+    Runs the limiter through `BaseHTTPMiddleware`, the way `RateLimitingMiddleware` did before it became
+        a pure ASGI middleware. only the transport differs, the limiting logic is the same.
+    """
+
+    def __init__(self, app: ASGIApp, strategy: RateLimiter) -> None:
+        self.limiter = RateLimitingMiddleware(app, strategy=strategy)
+        super().__init__(app)
+
+    async def dispatch(
+        self, request: Request, call_next: Callable[[Request], Awaitable[Response]]
+    ) -> Response:
+        request.state.limiter = self.limiter
+        response = await call_next(request)
+        await self.limiter.hit(request.scope["state"], response.status_code)
+        return response
+
+
+def build_app(middleware: Type[Any]) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(
+        middleware, strategy=FixedWindowRateLimiter(storage=MemoryStorage())
+    )
+
+    # a limit that is never reached, so every request runs through the whole path
+    @limit(app, "1000000/minute")
+    @app.get("/")
+    async def _get() -> None:
+        return
+
+    return app
+
+
+async def drive(app: FastAPI, requests: int, path: str = "/") -> float:
+    """Send `requests` GET requests to `path` through the app and return the elapsed seconds"""
+    scope: Dict[str, Any] = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"host", b"testserver")],
+        "client": ("127.0.0.1", 12345),
+        "server": ("testserver", 80),
+    }
+
+    async def receive() -> Message:
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    statuses: List[int] = []
+
+    async def send(message: Message) -> None:
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app(dict(scope), receive, send)
+    elapsed = time.perf_counter() - start
+    assert all(s == 200 for s in statuses), "unexpected status code"
+    return elapsed
+
+
+async def main(requests: int) -> None:
+    results = {}
+    for name, middleware in (
+        ("BaseHTTPMiddleware", LegacyRateLimitingMiddleware),
+        ("pure ASGI", RateLimitingMiddleware),
+    ):
+        app = build_app(middleware)
+        await drive(app, min(requests, 500))  # warm up
+        results[name] = await drive(app, requests)
+
+    for name, elapsed in results.items():
+        print(
+            f"{name:<20} {requests / elapsed:>10.0f} req/s"
+            f" {elapsed / requests * 1e6:>8.1f} us/req"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(main(args.requests))
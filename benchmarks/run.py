@@ -0,0 +1,228 @@
+"""
+Per-request overhead of the limiter, for every kind of limited route, strategy and storage.
+
+The apps are built like the `build_app()` test fixture and driven in-process through ASGI. each case reports
+    requests per second, the latency per request and the latency added over a route without any limiter.
+    the results are written as JSON, pass a previous result file with `--compare` to see the difference.
+
+    python -m benchmarks.run --requests 2000 --output results.json
+    python -m benchmarks.run --compare results.json
+
+Cases:
+
+- `no_limiter`: no middleware and no limit
+- `dependency`: a limit with static keys only
+- `keys`: a limit with a key function
+- `filters`: a limit with a filter, resolved lazily by `LazyFilters`
+- `multi_key`: a limit with static keys and several key functions
+
+Storages:
+
+- `memory`: `MemoryStorage`
+- `remote`: a local stand-in for Redis, `MemoryStorage` with `--rtt` seconds of latency on every call
+- `redis`: a real Redis server, only if `--redis-url` is passed
+"""
+
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import time
+from importlib.metadata import version
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from limits.aio import strategies
+from limits.aio.storage import MemoryStorage, Storage
+from limits.storage import storage_from_string
+
+import fastlimits
+from fastlimits import RateLimitingMiddleware, limit_routes
+
+from .middleware_overhead import drive
+
+LIMIT = "1000000/minute"  # never reached, so every request runs through the whole path
+
+STRATEGIES: Dict[str, Optional[Callable[..., strategies.RateLimiter]]] = {
+    "fixed_window": strategies.FixedWindowRateLimiter,
+    "moving_window": strategies.MovingWindowRateLimiter,
+    # added to `limits` after 3.13, skipped when it's not available
+    "sliding_window": getattr(strategies, "SlidingWindowCounterRateLimiter", None),
+}
+
+
+class LatencyStorage(MemoryStorage):
+    """`MemoryStorage` that waits `rtt` seconds on every call, like a storage across the network"""
+
+    def __init__(self, rtt: float) -> None:
+        super().__init__()
+        self.rtt = rtt
+
+    async def incr(self, *args: Any, **kwargs: Any) -> int:
+        await asyncio.sleep(self.rtt)
+        return await super().incr(*args, **kwargs)
+
+    async def get(self, *args: Any, **kwargs: Any) -> int:
+        await asyncio.sleep(self.rtt)
+        return await super().get(*args, **kwargs)
+
+    async def get_expiry(self, *args: Any, **kwargs: Any) -> int:
+        await asyncio.sleep(self.rtt)
+        return await super().get_expiry(*args, **kwargs)
+
+    async def acquire_entry(self, *args: Any, **kwargs: Any) -> bool:
+        await asyncio.sleep(self.rtt)
+        return await super().acquire_entry(*args, **kwargs)
+
+    async def get_moving_window(self, *args: Any, **kwargs: Any) -> Any:
+        await asyncio.sleep(self.rtt)
+        return await super().get_moving_window(*args, **kwargs)
+
+
+def client_id(request: Request) -> str:
+    return request.headers.get("host", "")
+
+
+def tenant_id(request: Request) -> str:
+    return request.url.path
+
+
+def always() -> bool:
+    return True
+
+
+def build_app(case: str, strategy: Optional[strategies.RateLimiter]) -> FastAPI:
+    app = FastAPI()
+    if strategy is not None:
+        app.add_middleware(RateLimitingMiddleware, strategy=strategy)
+
+    async def _get() -> None:
+        return
+
+    app.get("/")(_get)
+    if case == "dependency":
+        limit_routes(app, LIMIT, keys="bench")
+    elif case == "keys":
+        limit_routes(app, LIMIT, keys=client_id)
+    elif case == "filters":
+        limit_routes(app, LIMIT, keys="bench", filters=always)
+    elif case == "multi_key":
+        limit_routes(app, LIMIT, keys=["bench", client_id, "v1", tenant_id])
+    return app
+
+
+async def bench(app: FastAPI, requests: int) -> Dict[str, float]:
+    await drive(app, min(requests, 200))  # warm up
+    elapsed = await drive(app, requests)
+    return {
+        "rps": round(requests / elapsed, 1),
+        "latency_us": round(elapsed / requests * 1e6, 2),
+    }
+
+
+def storages(args: argparse.Namespace) -> Dict[str, Callable[[], Storage]]:
+    result: Dict[str, Callable[[], Storage]] = {
+        "memory": MemoryStorage,
+        "remote": lambda: LatencyStorage(args.rtt),
+    }
+    if args.redis_url:
+        result["redis"] = lambda: storage_from_string(f"async+{args.redis_url}")  # type: ignore[return-value]
+    return result
+
+
+async def main(args: argparse.Namespace) -> Dict[str, Any]:
+    baseline = await bench(build_app("no_limiter", None), args.requests)
+    results: List[Dict[str, Any]] = [
+        {"case": "no_limiter", "strategy": None, "storage": None, **baseline}
+    ]
+    skipped = []
+    for strategy_name, strategy_class in STRATEGIES.items():
+        if strategy_class is None:
+            skipped.append(strategy_name)
+            continue
+        for storage_name, storage in storages(args).items():
+            for case in ("dependency", "keys", "filters", "multi_key"):
+                strategy = strategy_class(storage())
+                result = await bench(build_app(case, strategy), args.requests)
+                result["added_latency_us"] = round(
+                    result["latency_us"] - baseline["latency_us"], 2
+                )
+                results.append(
+                    {
+                        "case": case,
+                        "strategy": strategy_name,
+                        "storage": storage_name,
+                        **result,
+                    }
+                )
+                print(
+                    f"{case:<12} {strategy_name:<16} {storage_name:<8}"
+                    f" {result['rps']:>10.0f} req/s {result['added_latency_us']:>8.1f} us added",
+                    file=sys.stderr,
+                )
+    return {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "versions": {
+                "fastlimits": fastlimits.__version__,
+                **{
+                    package: version(package)
+                    for package in ("fastapi", "starlette", "limits")
+                },
+            },
+            "requests": args.requests,
+            "rtt": args.rtt,
+            "skipped_strategies": skipped,
+        },
+        "results": results,
+    }
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any]) -> None:
+    """Print the change of the latency of every case that is in both results"""
+
+    def key(result: Dict[str, Any]) -> Any:
+        return result["case"], result["strategy"], result["storage"]
+
+    previous = {key(r): r for r in old["results"]}
+    for result in new["results"]:
+        before = previous.get(key(result))
+        if before is None:
+            continue
+        change = (result["latency_us"] / before["latency_us"] - 1) * 100
+        case, strategy, storage = key(result)
+        print(
+            f"{case:<12} {strategy or '-':<16} {storage or '-':<8}"
+            f" {before['latency_us']:>8.1f} -> {result['latency_us']:>8.1f} us/req ({change:+.1f}%)"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument(
+        "--rtt",
+        type=float,
+        default=0.0002,
+        help="latency of the remote storage stand-in, in seconds",
+    )
+    parser.add_argument("--redis-url", help="for example redis://localhost:6379")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="a previous JSON result file")
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
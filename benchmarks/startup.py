@@ -0,0 +1,124 @@
+"""
+Measures the startup cost of applying limits to thousands of routes.
+
+Each variant builds an app with `--routes` routes and applies a limit to every one of them:
+
+- `legacy limit`: `limit` as it was, inspecting the whole stack and scanning the routes on every call
+- `limit`: decorator syntax detected from the line of the call, routes found through the route index
+- `limit_route`: the explicit decorator, no detection at all
+- `limit_routes`: a single bulk call after all the routes are defined
+
+    python -m benchmarks.startup --routes 2000
+"""
+
+import argparse
+import inspect
+import time
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import FastAPI
+from limits import parse
+
+from fastlimits import BaseLimiterDependency, limit, limit_route, limit_routes
+from fastlimits.exceptions import _default_429_response
+from fastlimits.limiter import apply_limit
+from fastlimits.utils import get_api_routes
+
+
+def legacy_limit(
+    router: FastAPI, limit_string: str
+) -> Optional[Callable[[Callable[..., Any]], Callable[..., Any]]]:
+    """`limit` with the stack inspection and the linear route scan it used before, with the default options"""
+    options: Dict[str, Any] = dict(
+        keys=None,
+        filters=None,
+        no_hit_status_codes=None,
+        default_response_model=_default_429_response,
+        show_limit_in_response_model=True,
+        override_default_keys=False,
+    )
+
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        for route in get_api_routes(router):
+            if route.endpoint == func:
+                apply_limit(route=route, item=parse(limit_string), **options)
+                break
+        return func
+
+    if ctx := inspect.stack()[1].code_context:
+        if not ctx[0].strip().startswith("@"):
+            for route in get_api_routes(router):
+                apply_limit(route=route, item=parse(limit_string), **options)
+            return None
+    return decorator
+
+
+def build_decorated(routes: int, decorator: Callable[..., Any]) -> FastAPI:
+    app = FastAPI()
+    for i in range(routes):
+
+        @decorator(app, "5/minute")
+        @app.get(f"/items/{i}")
+        async def _get() -> None:
+            return
+
+    return app
+
+
+def build_bulk(routes: int) -> FastAPI:
+    app = FastAPI()
+    for i in range(routes):
+
+        @app.get(f"/items/{i}")
+        async def _get() -> None:
+            return
+
+    limit_routes(app, "5/minute")
+    return app
+
+
+def build_plain(routes: int) -> FastAPI:
+    app = FastAPI()
+    for i in range(routes):
+
+        @app.get(f"/items/{i}")
+        async def _get() -> None:
+            return
+
+    return app
+
+
+def measure(build: Callable[[], FastAPI], limited: bool = True) -> float:
+    """Build the app and return the elapsed seconds"""
+    start = time.perf_counter()
+    app = build()
+    elapsed = time.perf_counter() - start
+    if limited:
+        assert all(
+            isinstance(route.dependant.dependencies[0].call, BaseLimiterDependency)
+            for route in get_api_routes(app)
+        ), "a route was not limited"
+    return elapsed
+
+
+def main(routes: int) -> None:
+    baseline = measure(lambda: build_plain(routes), limited=False)
+    print(f"{'routes only':<16} {baseline:>8.3f} s")
+    for name, build in (
+        ("legacy limit", lambda: build_decorated(routes, legacy_limit)),
+        ("limit", lambda: build_decorated(routes, limit)),
+        ("limit_route", lambda: build_decorated(routes, limit_route)),
+        ("limit_routes", lambda: build_bulk(routes)),
+    ):
+        elapsed = measure(build)
+        print(
+            f"{name:<16} {elapsed:>8.3f} s"
+            f" {(elapsed - baseline) / routes * 1e6:>8.1f} us/route over the routes only"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--routes", type=int, default=2000)
+    args = parser.parse_args()
+    main(args.routes)
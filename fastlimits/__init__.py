@@ -2,13 +2,19 @@ __version__ = "0.0.1"
 
 
 from .dependencies import BaseLimiterDependency
-from .exceptions import RateLimitExceeded
-from .limiter import limit
-from .middleware import RateLimitingMiddleware
+from .exceptions import ConcurrencyLimitExceeded, RateLimitExceeded
+from .limiter import limit, limit_concurrency, limit_route, limit_routes
+from .middleware import GlobalLimit, RateLimitingMiddleware, WebSocketLimit
 
 __all__ = [
     "RateLimitingMiddleware",
+    "GlobalLimit",
+    "WebSocketLimit",
     "BaseLimiterDependency",
     "RateLimitExceeded",
+    "ConcurrencyLimitExceeded",
     "limit",
+    "limit_route",
+    "limit_routes",
+    "limit_concurrency",
 ]
@@ -0,0 +1,173 @@
+import asyncio
+import math
+from typing import TYPE_CHECKING, Any, Callable, Dict, Optional, Tuple, Type
+
+from limits import RateLimitItem
+
+if TYPE_CHECKING:
+    from .metrics import LimiterMetrics
+
+MultiplierChangeCallback = Callable[[float, float], None]
+
+_SCALED_CLASSES: Dict[Type[RateLimitItem], Type[RateLimitItem]] = {}
+
+
+def _original_key_for(self: Any, *identifiers: str) -> str:
+    return self.original.key_for(*identifiers)  # type: ignore[no-any-return]
+
+
+def scaled_item(item: RateLimitItem, amount: int) -> RateLimitItem:
+    """A copy of a limit item with another amount, that keeps the storage key of the original item
+
+    Args:
+        item (RateLimitItem): the rate limit item
+        amount (int): the amount of the copy
+
+    Returns:
+        RateLimitItem: an instance of a subclass of the class of `item`
+    """
+    cls = _SCALED_CLASSES.get(type(item))
+    if cls is None:
+        cls = _SCALED_CLASSES[type(item)] = type(
+            f"Scaled{type(item).__name__}",
+            (type(item),),
+            {"__slots__": ["original"], "key_for": _original_key_for},
+        )
+    scaled = cls(amount, item.multiples, item.namespace)
+    scaled.original = item  # type: ignore[attr-defined]
+    return scaled
+
+
+class AdaptiveLimits:
+    """
+    Scales the amount of every limit down while the process is saturated, and back up once it recovers.
+
+    Every `interval` seconds the lag of the event loop (how late a sleep wakes up) and the mean latency of the
+        responses started since the last sample are compared to their targets. when either one is over its target
+        the multiplier is multiplied by `decrease`, otherwise `increase` is added to it, up to 1 (AIMD).
+        the limits are checked against `amount * multiplier`, their counters in the storage stay the same.
+    """
+
+    def __init__(
+        self,
+        target_lag: float = 0.05,
+        target_latency: Optional[float] = None,
+        interval: float = 0.5,
+        decrease: float = 0.5,
+        increase: float = 0.05,
+        min_multiplier: float = 0.1,
+        on_change: Optional[MultiplierChangeCallback] = None,
+    ) -> None:
+        """AdaptiveLimits
+
+        Args:
+            target_lag (float): event loop lag (seconds) over which the process is considered saturated
+            target_latency (Optional[float]): mean response latency (seconds, until the response starts) over which the process is considered saturated, `None` to only use the lag
+            interval (float): seconds between two samples
+            decrease (float): the multiplier is multiplied by this ratio on every saturated sample
+            increase (float): the multiplier is increased by this much on every other sample
+            min_multiplier (float): the multiplier never goes below this ratio
+            on_change (Optional[MultiplierChangeCallback]): called with the old and the new multiplier whenever it changes
+        """
+        if not 0 < decrease < 1:
+            raise ValueError("decrease must be a ratio between 0 and 1")
+        if not 0 < min_multiplier <= 1:
+            raise ValueError("min_multiplier must be a ratio between 0 and 1")
+        self.target_lag = target_lag
+        self.target_latency = target_latency
+        self.interval = interval
+        self.decrease = decrease
+        self.increase = increase
+        self.min_multiplier = min_multiplier
+        self.on_change = on_change
+        #: set by `RateLimitingMiddleware`, its `multiplier` hook is called on every change
+        self.metrics: Optional["LimiterMetrics"] = None
+        self.multiplier = 1.0
+        self.lag = 0.0
+        self._latency_sum = 0.0
+        self._latency_count = 0
+        self._scaled: Dict[RateLimitItem, Tuple[int, RateLimitItem]] = {}
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    def start(self) -> None:
+        """Start sampling the event loop lag on the running loop, if it's not sampled already"""
+        if self._task is not None and not self._task.done():
+            if self._task.get_loop() is asyncio.get_running_loop():
+                return
+            self._task.cancel()
+        self._task = asyncio.ensure_future(self._sample())
+
+    async def close(self) -> None:
+        """Stop sampling"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def observe_latency(self, seconds: float) -> None:
+        """Record the latency of a response, until its status is sent"""
+        self._latency_sum += seconds
+        self._latency_count += 1
+
+    def update(self, lag: float) -> float:
+        """Take a sample and adjust the multiplier
+
+        Args:
+            lag (float): the event loop lag measured for this sample
+
+        Returns:
+            float: the new multiplier
+        """
+        self.lag = lag
+        saturated = lag > self.target_lag
+        if self.target_latency is not None and self._latency_count:
+            saturated = (
+                saturated
+                or self._latency_sum / self._latency_count > self.target_latency
+            )
+        self._latency_sum = 0.0
+        self._latency_count = 0
+
+        old = self.multiplier
+        if saturated:
+            new = max(self.min_multiplier, old * self.decrease)
+        else:
+            new = min(1.0, old + self.increase)
+        if new != old:
+            self.multiplier = new
+            if self.on_change is not None:
+                self.on_change(old, new)
+            if self.metrics is not None:
+                self.metrics.multiplier(new)
+        return new
+
+    def scale(self, item: RateLimitItem) -> RateLimitItem:
+        """The limit item with its amount scaled by the current multiplier
+
+        The scaled item keeps the storage key of `item`, so the hits counted before the change still count.
+
+        Args:
+            item (RateLimitItem): the rate limit item
+
+        Returns:
+            RateLimitItem: `item` itself when the multiplier is 1
+        """
+        if self.multiplier >= 1:
+            return item
+        amount = max(1, math.floor(item.amount * self.multiplier))
+        cached = self._scaled.get(item)
+        if cached is not None and cached[0] == amount:
+            return cached[1]
+        scaled = scaled_item(item, amount)
+        self._scaled[item] = (amount, scaled)
+        return scaled
+
+    async def _sample(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.update(max(0.0, loop.time() - start - self.interval))
@@ -0,0 +1,252 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from limits import RateLimitItem
+from limits.aio.strategies import RateLimiter
+
+from .strategies import LimitAndKeys, WindowState, batch_hit, hit_window
+
+PendingKey = Tuple[RateLimiter, RateLimitItem, Tuple[str, ...]]
+StorageCall = Callable[..., Awaitable[Any]]
+
+#: the hits that don't fit in a full `HitQueue` are sent by the request itself
+OVERFLOW_SYNC = "sync"
+#: the hits that don't fit in a full `HitQueue` are not counted
+OVERFLOW_DROP = "drop"
+
+
+class PendingHit:
+    """
+    The hits of a limit item and its keys that are waiting for the next flush, merged into a single cost.
+    """
+
+    __slots__ = ("strategy", "item", "keys", "cost", "waiters")
+
+    def __init__(
+        self, strategy: RateLimiter, item: RateLimitItem, keys: Sequence[str]
+    ) -> None:
+        self.strategy = strategy
+        self.item = item
+        self.keys = keys
+        self.cost = 0
+        self.waiters: List["asyncio.Future[WindowState]"] = []
+
+
+class HitBatcher:
+    """
+    Merges the hits of concurrent requests and sends them to the storage together.
+
+    The hits are collected until the end of the current event loop iteration (`window=0`) or for `window` seconds,
+        the hits of the same limit item and keys are merged into a single call with their total cost, and all
+        the calls of a batch are issued at once. every waiting request gets the state of the window after the whole batch.
+
+    A drop-in replacement of `fastlimits.strategies.batch_hit`, only used for the hits counted after the response,
+        the checks before the endpoint are never delayed.
+    """
+
+    def __init__(self, window: float = 0.0, max_pending: int = 10_000) -> None:
+        """HitBatcher
+
+        Args:
+            window (float): seconds to collect the hits for, `0` to only merge the hits of the same event loop iteration
+            max_pending (int): flush right away once this many distinct keys are waiting
+        """
+        if max_pending <= 0:
+            raise ValueError("max_pending must be a positive number")
+        self.window = window
+        self.max_pending = max_pending
+        self._pending: Dict[PendingKey, PendingHit] = {}
+        self._handle: Optional[asyncio.Handle] = None
+        self._tasks: Set["asyncio.Future[None]"] = set()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def hit(
+        self,
+        strategy: RateLimiter,
+        limits: Sequence[LimitAndKeys],
+        costs: Optional[Sequence[int]] = None,
+    ) -> List[WindowState]:
+        """Hit several limits in the next batch, see `batch_hit`
+
+        Args:
+            strategy (RateLimiter): the strategy to hit the limits with
+            limits (Sequence[LimitAndKeys]): pairs of rate limit item and its keys
+            costs (Optional[Sequence[int]]): the cost of each limit, 1 for all of them by default
+
+        Returns:
+            List[WindowState]: the state of the window of each limit after the batch, in order
+        """
+        loop = asyncio.get_running_loop()
+        if costs is None:
+            costs = [1] * len(limits)
+        waiters = []
+        for (item, keys), cost in zip(limits, costs):
+            key = (strategy, item, tuple(keys))
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = PendingHit(strategy, item, keys)
+            pending.cost += cost
+            waiter: "asyncio.Future[WindowState]" = loop.create_future()
+            pending.waiters.append(waiter)
+            waiters.append(waiter)
+        if len(self._pending) >= self.max_pending:
+            self._flush()
+        elif self._handle is None:
+            if self.window > 0:
+                self._handle = loop.call_later(self.window, self._flush)
+            else:
+                self._handle = loop.call_soon(self._flush)
+        return list(await asyncio.gather(*waiters))
+
+    async def flush(self) -> None:
+        """Send the pending hits right away and wait for all the batches in flight"""
+        self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def _flush(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        if not self._pending:
+            return
+        batch, self._pending = list(self._pending.values()), {}
+        task = asyncio.ensure_future(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _send(batch: List[PendingHit]) -> None:
+        results: List[Any] = await asyncio.gather(
+            *(
+                hit_window(
+                    pending.strategy, pending.item, *pending.keys, cost=pending.cost
+                )
+                for pending in batch
+            ),
+            return_exceptions=True,
+        )
+        for pending, result in zip(batch, results):
+            for waiter in pending.waiters:
+                if waiter.done():  # the request was cancelled
+                    continue
+                if isinstance(result, BaseException):
+                    waiter.set_exception(result)
+                else:
+                    waiter.set_result(result)
+
+
+class HitQueue:
+    """
+    Counts the hits in the background, so the responses don't wait for the storage.
+
+    The hits are put in a bounded queue, where the hits of the same limit item and keys are merged into a single cost,
+        and a worker task sends them to the storage in batches. the hits that arrive while a batch is in flight are
+        merged into the next one. when `max_size` distinct keys are waiting, the hits of new keys are either sent by the
+        request itself (`overflow="sync"`, the request waits like without a queue) or not counted at all (`overflow="drop"`).
+
+    The state of the window is not known when the response starts, the rate limit headers show the state read by the check.
+        `RateLimitingMiddleware` sends the hits that are still waiting when the app shuts down, see `RateLimitingMiddleware.close`.
+    """
+
+    def __init__(self, max_size: int = 10_000, overflow: str = OVERFLOW_SYNC) -> None:
+        """HitQueue
+
+        Args:
+            max_size (int): maximum number of distinct limit items and keys waiting in the queue
+            overflow (str): what to do with the hits of new keys when the queue is full, `"sync"` or `"drop"`
+        """
+        if max_size <= 0:
+            raise ValueError("max_size must be a positive number")
+        if overflow not in (OVERFLOW_SYNC, OVERFLOW_DROP):
+            raise ValueError("overflow must be 'sync' or 'drop'")
+        self.max_size = max_size
+        self.overflow = overflow
+        #: set by `RateLimitingMiddleware`, the batches go through its circuit breaker and metrics
+        self.storage_call: Optional[StorageCall] = None
+        #: number of hits that were not counted because the queue was full
+        self.dropped = 0
+        #: number of hits that were not counted because the storage failed
+        self.failed = 0
+        self._pending: Dict[PendingKey, int] = {}
+        self._worker: Optional["asyncio.Future[None]"] = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    async def put(
+        self,
+        strategy: RateLimiter,
+        limits: Sequence[LimitAndKeys],
+        costs: Optional[Sequence[int]] = None,
+    ) -> None:
+        """Queue the hits of several limits, returns right away unless the queue is full
+
+        Args:
+            strategy (RateLimiter): the strategy to hit the limits with
+            limits (Sequence[LimitAndKeys]): pairs of rate limit item and its keys
+            costs (Optional[Sequence[int]]): the cost of each limit, 1 for all of them by default
+        """
+        if costs is None:
+            costs = [1] * len(limits)
+        overflow: Dict[PendingKey, int] = {}
+        for (item, keys), cost in zip(limits, costs):
+            key = (strategy, item, tuple(keys))
+            if key in self._pending:
+                self._pending[key] += cost
+            elif len(self._pending) < self.max_size:
+                self._pending[key] = cost
+            else:
+                overflow[key] = overflow.get(key, 0) + cost
+        if self._pending:
+            self._start()
+        if overflow:
+            if self.overflow == OVERFLOW_DROP:
+                self.dropped += sum(overflow.values())
+            else:
+                await self._send(overflow)
+
+    async def flush(self) -> None:
+        """Wait until all the queued hits are sent"""
+        worker = self._worker
+        if (
+            worker is not None
+            and not worker.done()
+            and worker.get_loop() is asyncio.get_running_loop()
+        ):
+            await worker
+        if self._pending:  # left by a worker of an event loop that is gone
+            batch, self._pending = self._pending, {}
+            await self._send(batch)
+
+    def _start(self) -> None:
+        worker = self._worker
+        if (
+            worker is None
+            or worker.done()
+            or worker.get_loop() is not asyncio.get_running_loop()
+        ):
+            self._worker = asyncio.ensure_future(self._drain())
+
+    async def _drain(self) -> None:
+        while self._pending:
+            batch, self._pending = self._pending, {}
+            await self._send(batch)
+
+    async def _send(self, batch: Dict[PendingKey, int]) -> None:
+        by_strategy: Dict[RateLimiter, List[Tuple[LimitAndKeys, int]]] = {}
+        for (strategy, item, keys), cost in batch.items():
+            by_strategy.setdefault(strategy, []).append(((item, keys), cost))
+        for strategy, hits in by_strategy.items():
+            pairs = [pair for pair, _ in hits]
+            costs = [cost for _, cost in hits]
+            try:
+                if self.storage_call is None:
+                    await batch_hit(strategy, pairs, costs)
+                else:
+                    await self.storage_call("hit", batch_hit, strategy, pairs, costs)
+            except Exception:
+                # the responses are already sent, the hits are lost
+                self.failed += sum(costs)
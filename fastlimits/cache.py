@@ -0,0 +1,76 @@
+import time
+from collections import OrderedDict
+from typing import Optional, Sequence, Tuple
+
+from limits import RateLimitItem
+
+CacheKey = Tuple[RateLimitItem, Tuple[str, ...]]
+
+
+class ExceededCache:
+    """
+    An in-process cache of limit items that are known to be exceeded.
+
+    When a limit is exceeded, the middleware remembers when its window resets and rejects the following
+        requests for the same item and keys locally, without a call to the storage, until then.
+    """
+
+    def __init__(self, maxsize: int = 10_000, ttl: float = 60) -> None:
+        """ExceededCache
+
+        Args:
+            maxsize (int): maximum number of entries, the least recently used ones are evicted first
+            ttl (float): maximum number of seconds to keep an entry, even if its window resets later
+        """
+        if maxsize <= 0:
+            raise ValueError("maxsize must be a positive number")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[CacheKey, float]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, item: RateLimitItem, keys: Sequence[str]) -> Optional[float]:
+        """Check if a limit item is known to be exceeded
+
+        Args:
+            item (RateLimitItem): the rate limit item
+            keys (Sequence[str]): keys of the limit item
+
+        Returns:
+            Optional[float]: the time (seconds since the epoch) the entry expires at, `None` if not exceeded
+        """
+        if not self._entries:
+            return None
+        key = (item, tuple(keys))
+        expires_at = self._entries.get(key)
+        if expires_at is None:
+            return None
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return expires_at
+
+    def add(self, item: RateLimitItem, keys: Sequence[str], reset_time: float) -> None:
+        """Remember that a limit item is exceeded until `reset_time`
+
+        Args:
+            item (RateLimitItem): the rate limit item
+            keys (Sequence[str]): keys of the limit item
+            reset_time (float): the time (seconds since the epoch) the window of the limit resets at
+        """
+        now = time.time()
+        expires_at = min(reset_time, now + self.ttl)
+        if expires_at <= now:
+            return
+        key = (item, tuple(keys))
+        self._entries[key] = expires_at
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Remove all the entries"""
+        self._entries.clear()
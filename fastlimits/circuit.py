@@ -0,0 +1,115 @@
+import asyncio
+import enum
+import time
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+from .exceptions import StorageUnavailable
+
+T = TypeVar("T")
+
+
+class CircuitState(str, enum.Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+StateChangeCallback = Callable[[CircuitState, CircuitState], None]
+
+
+class CircuitBreaker:
+    """
+    Puts a time budget on the storage calls of the limiter and stops calling a storage that keeps failing.
+
+    The circuit opens after `failure_threshold` consecutive failures (errors or timeouts). while it's open
+        the storage is not called at all, the limiter is skipped (`fail_open=True`) or the requests are rejected
+        (`fail_open=False`). after `recovery_time` seconds a single probe call is let through (half-open),
+        the circuit closes if it succeeds and opens again otherwise.
+    """
+
+    def __init__(
+        self,
+        timeout: Optional[float] = 0.05,
+        failure_threshold: int = 5,
+        recovery_time: float = 30,
+        fail_open: bool = True,
+        on_state_change: Optional[StateChangeCallback] = None,
+    ) -> None:
+        """CircuitBreaker
+
+        Args:
+            timeout (Optional[float]): maximum number of seconds a storage call can take, `None` for no limit
+            failure_threshold (int): number of consecutive failures that open the circuit
+            recovery_time (float): number of seconds the circuit stays open before a probe call is let through
+            fail_open (bool): allow the requests while the storage is unavailable, otherwise they are rejected with a `503` response
+            on_state_change (Optional[StateChangeCallback]): called with the old and the new state whenever the state changes
+        """
+        if failure_threshold <= 0:
+            raise ValueError("failure_threshold must be a positive number")
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.fail_open = fail_open
+        self.on_state_change = on_state_change
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    @property
+    def retry_after(self) -> float:
+        """Number of seconds until the next probe call"""
+        if self.state is CircuitState.CLOSED:
+            return 0
+        return max(0.0, self.opened_at + self.recovery_time - time.monotonic())
+
+    async def call(self, func: Callable[..., Awaitable[T]], *args: Any) -> T:
+        """Call the storage through the circuit
+
+        Args:
+            func (Callable[..., Awaitable[T]]): an async function that calls the storage
+            *args (Any): arguments of `func`
+
+        Raises:
+            StorageUnavailable: if the circuit is open, or the call failed or timed out
+
+        Returns:
+            T: the result of `func`
+        """
+        if self.state is not CircuitState.CLOSED:
+            if self._probing or self.retry_after > 0:
+                raise StorageUnavailable("circuit is open")
+            self._set_state(CircuitState.HALF_OPEN)
+            self._probing = True
+        try:
+            if self.timeout is None:
+                result = await func(*args)
+            else:
+                result = await asyncio.wait_for(func(*args), self.timeout)
+        except Exception as e:
+            self._failure()
+            raise StorageUnavailable(f"storage call failed: {e!r}") from e
+        finally:
+            self._probing = False
+        self._success()
+        return result
+
+    def _success(self) -> None:
+        self.failures = 0
+        if self.state is not CircuitState.CLOSED:
+            self._set_state(CircuitState.CLOSED)
+
+    def _failure(self) -> None:
+        self.failures += 1
+        if (
+            self.state is CircuitState.HALF_OPEN
+            or self.failures >= self.failure_threshold
+        ):
+            self.opened_at = time.monotonic()
+            if self.state is not CircuitState.OPEN:
+                self._set_state(CircuitState.OPEN)
+
+    def _set_state(self, state: CircuitState) -> None:
+        old, self.state = self.state, state
+        if self.on_state_change is not None:
+            self.on_state_change(old, state)
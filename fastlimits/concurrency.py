@@ -0,0 +1,181 @@
+import os
+from typing import TYPE_CHECKING, Dict, List, Optional, Union
+
+from fastapi import Request
+from limits.aio.storage import RedisStorage
+
+from .keys import KeyTemplate, compile_key_builder
+from .types import CallableMiddlewareKey
+
+if TYPE_CHECKING:
+    from .middleware import RateLimitingMiddleware
+
+
+class ConcurrencyBackend:
+    """
+    Counts the requests that are in flight for each key, the base class of the concurrency backends.
+    """
+
+    #: the calls of remote backends go through the circuit breaker of the middleware
+    remote = True
+
+    async def acquire(self, key: str, limit: int) -> Optional[str]:
+        """Take a slot of a key, if one is free
+
+        Args:
+            key (str): the concurrency key
+            limit (int): number of slots of the key
+
+        Returns:
+            Optional[str]: a token to release the slot with, `None` if all the slots are taken
+        """
+        raise NotImplementedError
+
+    async def release(self, key: str, token: str) -> None:
+        """Give back a slot taken with `acquire`
+
+        Args:
+            key (str): the concurrency key
+            token (str): the token returned by `acquire`
+        """
+        raise NotImplementedError
+
+
+class MemoryConcurrency(ConcurrencyBackend):
+    """
+    In-process counters, each process enforces the limit on its own requests.
+    """
+
+    remote = False
+
+    def __init__(self) -> None:
+        self._counts: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def in_flight(self, key: str) -> int:
+        """Number of slots of a key that are taken"""
+        return self._counts.get(key, 0)
+
+    async def acquire(self, key: str, limit: int) -> Optional[str]:
+        count = self._counts.get(key, 0)
+        if count >= limit:
+            return None
+        self._counts[key] = count + 1
+        return key
+
+    async def release(self, key: str, token: str) -> None:
+        count = self._counts.get(key, 0) - 1
+        if count > 0:
+            self._counts[key] = count
+        else:
+            self._counts.pop(key, None)
+
+
+class RedisConcurrency(ConcurrencyBackend):
+    """
+    Counters shared by all the processes through Redis.
+
+    Each slot is a member of a sorted set scored by the time its lease expires, so the slots of a worker that crashed
+        before releasing them are freed after `ttl` seconds. the clock of the Redis server is used, not the clocks of
+        the workers. `ttl` has to be longer than the slowest request, a slot is taken over after it either way.
+
+    ```py
+    from limits.storage import storage_from_string
+
+    storage = storage_from_string("async+redis://localhost:6379")
+    app.add_middleware(RateLimitingMiddleware, strategy=..., concurrency=RedisConcurrency(storage))
+    ```
+    """
+
+    SCRIPT_ACQUIRE = """
+    local now = redis.call('TIME')
+    now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+    if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[1]) then
+        return 0
+    end
+    local expires_at = now + tonumber(ARGV[2])
+    redis.call('ZADD', KEYS[1], expires_at, ARGV[3])
+    redis.call('PEXPIRE', KEYS[1], math.ceil(tonumber(ARGV[2]) * 1000))
+    return 1
+    """
+
+    def __init__(
+        self, storage: RedisStorage, ttl: float = 60.0, prefix: str = "CONCURRENCY"
+    ) -> None:
+        """RedisConcurrency
+
+        Args:
+            storage (RedisStorage): the async Redis storage of `limits`, its connection is reused
+            ttl (float): seconds after which a slot that was not released is freed
+            prefix (str): prefix of the Redis keys
+        """
+        self.storage = storage
+        self.ttl = ttl
+        self.prefix = prefix
+        self.lua_acquire = storage.storage.register_script(self.SCRIPT_ACQUIRE)
+
+    def _key(self, key: str) -> str:
+        return self.storage.prefixed_key(f"{self.prefix}/{key}")
+
+    async def acquire(self, key: str, limit: int) -> Optional[str]:
+        token = os.urandom(8).hex()
+        acquired = await self.lua_acquire.execute(
+            [self._key(key)], [limit, self.ttl, token]
+        )
+        return token if acquired else None
+
+    async def release(self, key: str, token: str) -> None:
+        await self.storage.storage.zrem(self._key(key), [token])
+
+
+class ConcurrencyLimitDependency:
+    """
+    This dependency is injected into the `APIRoute` by `limit_concurrency`, it takes a slot of its key
+        before the endpoint is called. the middleware gives it back once the response is sent or the request fails.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int,
+        keys: Optional[List[Union[str, CallableMiddlewareKey]]] = None,
+    ) -> None:
+        """ConcurrencyLimitDependency
+
+        Args:
+            max_concurrent (int): number of requests of a key that can be in flight at once
+            keys (Optional[List[Union[str, CallableMiddlewareKey]]]): static keys and key functions that get the request, appended to the middleware keys
+        """
+        if max_concurrent < 1:
+            raise ValueError("max_concurrent must be at least 1")
+        self.max_concurrent = max_concurrent
+        keys = keys or []
+        self.key_template = KeyTemplate(["concurrency", *keys])
+        self.build_key_values = compile_key_builder(
+            [k for k in keys if not isinstance(k, str)]
+        )
+
+    async def __call__(self, request: Request) -> None:
+        """Take a slot for the request
+
+        Args:
+            request (Request): request object from FastAPI
+
+        Raises:
+            ConcurrencyLimitExceeded: when all the slots of the key are taken
+        """
+        try:
+            limiter: "RateLimitingMiddleware" = request.state.limiter
+        except AttributeError:
+            return
+        values = (
+            await self.build_key_values(request)
+            if self.key_template.static is None
+            else None
+        )
+        key = "/".join(
+            [*await limiter.build_keys(request), *self.key_template.format(values)]
+        )
+        await limiter.acquire(request.scope["state"], key, self.max_concurrent)
@@ -1,16 +1,61 @@
-import asyncio
+import functools
 import inspect
-from typing import TYPE_CHECKING, Any, Dict, List, Optional, Type, Union
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    Union,
+    cast,
+)
 
 from fastapi import Depends, Request, Response
 from limits import RateLimitItem, parse
 
-from .exceptions import RateLimitExceeded
-from .types import CallableFilter, CallableMiddlewareKey, StrOrCallableKey
+from .filters import LazyFilters
+from .keys import KeyCompactor, KeyTemplate
+from .types import CallableCost, StrOrCallableKey
 from .utils import ensure_list, fncopy
 
 if TYPE_CHECKING:
-    from .middleware import RateLimitingMiddleware
+    from .middleware import GlobalLimit, RateLimitingMiddleware
+
+
+class AppliedLimit(NamedTuple):
+    """A limit that applies to the current request, along with the keys that were built for it"""
+
+    dependency: Union["BaseLimiterDependency", "LimitTier", "GlobalLimit"]
+    keys: List[str]
+    #: number of hits the request costs, or the part of it that is known before the response
+    cost: int = 1
+    #: returns the final cost once the response is known, for cost functions that take the response
+    response_cost: Optional[Callable[[Response], Awaitable[int]]] = None
+
+
+class LimitTier:
+    """
+    A tier of a limit, its value applies instead of the limit's own value when its filter accepts the request.
+    """
+
+    __slots__ = ("item", "filters", "no_hit_status_codes", "lease")
+
+    def __init__(
+        self,
+        limit_value: Union[str, RateLimitItem],
+        filters: LazyFilters,
+        no_hit_status_codes: List[int],
+        lease: Optional[float],
+    ) -> None:
+        self.item = parse(limit_value) if isinstance(limit_value, str) else limit_value
+        self.filters = filters
+        self.no_hit_status_codes = no_hit_status_codes
+        self.lease = lease
 
 
 # FastAPI dependency
@@ -23,112 +68,195 @@ class BaseLimiterDependency:
         self,
         limit_value: Union[str, RateLimitItem],
         no_hit_status_codes: Optional[List[int]] = None,
+        lease: Optional[float] = None,
+        keys: Optional[List[StrOrCallableKey]] = None,
+        filters: Optional[LazyFilters] = None,
+        tiers: Optional[Sequence[Tuple[LazyFilters, Union[str, RateLimitItem]]]] = None,
+        cost: Union[int, CallableCost] = 1,
+        key_compactor: Optional[KeyCompactor] = None,
     ) -> None:
         """BaseLimiterDependency
 
         Args:
             limit_value (Union[str, RateLimitItem]): a string like "5/minute" or a `RateLimitItem` object
             no_hit_status_codes (Optional[List[int]]): the response statuses that won't be count as a hit on the limiter.
+            lease (Optional[float]): lease this ratio of the limit amount from the storage at once and count the hits locally, see `LeaseManager`
+            keys (Optional[List[StrOrCallableKey]]): endpoint level keys, the values of the key functions are passed to `__call__` in order
+            filters (Optional[LazyFilters]): filters that all have to accept the request for this limit to apply
+            tiers (Optional[Sequence[Tuple[LazyFilters, Union[str, RateLimitItem]]]]): `(filters, limit value)` pairs, the first one that accepts the request applies instead of `limit_value`
+            cost (Union[int, CallableCost]): hits a request costs, or a function of the request (and the response if it takes a second argument) that returns them
+            key_compactor (Optional[KeyCompactor]): replace the keys with a fixed length digest, instead of the `key_compactor` of the middleware
         """
         if isinstance(limit_value, str):
             self.item = parse(limit_value)
         else:
             self.item = limit_value
         self.no_hit_status_codes = no_hit_status_codes if no_hit_status_codes else []
+        if lease is not None and not 0 < lease <= 1:
+            raise ValueError("lease must be a ratio between 0 and 1")
+        self.lease = lease
+        self.key_template = KeyTemplate(keys or [])
+        self.key_compactor = key_compactor
+        self.filters = filters if filters else None
+        self.tiers = [
+            LimitTier(value, tier_filters, self.no_hit_status_codes, lease)
+            for tier_filters, value in tiers or []
+        ]
+        self.cost_function: Optional[CallableCost] = None
+        self.cost_after_response = False
+        if isinstance(cost, int):
+            if cost < 0:
+                raise ValueError("cost can't be negative")
+            self.cost = cost
+        else:
+            self.cost = 1  # consumed before the response when the cost depends on it
+            self.cost_function = cost
+            self.cost_after_response = len(inspect.signature(cost).parameters) > 1
 
-    async def __call__(
-        self,
-        request: Request,
-        response: Response,
-        keys: Optional[List[str]] = None,
-    ) -> None:
-        """The actual callable that FastAPI call and checks for rate-limiting
+    async def __call__(self, request: Request, response: Response) -> None:
+        """The actual callable that FastAPI call, used when the limit has no key functions
 
         Args:
             request (Request): request object from FastAPI
             response (Response): response object from FastAPI
-            keys (Optional[List[str]]): extra keys other than those provided by the middleware as identifiers for a rate-limit item
+        """
+        await self.register(request)
 
-        Raises:
-            RateLimitExceeded: when the rate limit exceeds the allowed value
+    async def register(
+        self, request: Request, keys: Optional[List[str]] = None
+    ) -> None:
+        """Run the filters, build the keys and register this limit on the request.
+
+        All the limits registered on a request are checked together by `LimitsEvaluatorDependency`.
+
+        Args:
+            request (Request): request object from FastAPI
+            keys (Optional[List[str]]): values of the endpoint level key functions
         """
-        # TODO: do not check other filters if one accepted
         try:
             limiter: "RateLimitingMiddleware" = request.state.limiter
         except AttributeError:
             return
+        applied = await self.select(request)
+        if applied is None:
+            return
         built_keys = await self._build_key(
-            limiter.keys, request, keys
+            limiter, request, keys
         )  # resolve middleware level keys and append endpoint level keys
-        if not await limiter.strategy.test(self.item, *built_keys):
-            raise RateLimitExceeded(
-                limit=self.item, detail=f"Rate limit exceeded: {self.item}"
-            )
-        request.state.limit = self
-        request.state.limit_keys = built_keys
+        try:
+            limits: List[AppliedLimit] = request.state.limits
+        except AttributeError:
+            limits = request.state.limits = []
+        cost = self.cost
+        response_cost = None
+        if self.cost_function is not None:
+            if self.cost_after_response:
+                response_cost = functools.partial(self._call_cost, request)
+            else:
+                cost = await self._call_cost(request)
+        limits.append(AppliedLimit(applied, built_keys, cost, response_cost))
+
+    async def _call_cost(self, *args: Any) -> int:
+        assert self.cost_function is not None
+        result = self.cost_function(*args)
+        if inspect.isawaitable(result):
+            result = await result
+        return max(0, int(result))
+
+    async def select(
+        self, request: Request
+    ) -> Optional[Union["BaseLimiterDependency", LimitTier]]:
+        """Choose the limit that applies to the request, only the chosen one goes to the storage
+
+        Args:
+            request (Request): request object from FastAPI
+
+        Returns:
+            Optional[Union[BaseLimiterDependency, LimitTier]]: the first tier that accepts the request, this object if none does, `None` if the filters reject it
+        """
+        if self.filters is not None and not await self.filters(request):
+            return None
+        for tier in self.tiers:
+            if await tier.filters(request):
+                return tier
+        return self
 
     async def _build_key(
         self,
-        keys: List[CallableMiddlewareKey],
+        limiter: "RateLimitingMiddleware",
         request: Request,
         extra_keys: Optional[List[str]] = None,
     ) -> List[str]:
         """Build an identifier for a rate-limit item
 
         Args:
-            key_funcs (Sequence[CallableOrAwaitableCallable]): a list of keys passed to the `RateLimitingMiddleware` and the dependency itself. these keys will form a identifier for a limit item.
-            request (Request): this has to be changed so keys will also work with Depends
-            extra_keys (Optional[ist[str]]): endpoint level keys resolved as strings
+            limiter (RateLimitingMiddleware): the middleware that holds the compiled middleware level keys
+            request (Request): request object from FastAPI
+            extra_keys (Optional[List[str]]): values of the endpoint level key functions
 
         Returns:
-            List[str]: a list containing string keys from the provided callables
+            List[str]: middleware level keys followed by the endpoint level keys, or their compacted key
         """
-        _keys = [
-            f(request) if not asyncio.iscoroutinefunction(f) else await f(request)
-            for f in keys
+        keys = [
+            *await limiter.build_keys(request),
+            *self.key_template.format(extra_keys),
         ]
-        if extra_keys:
-            _keys.extend(extra_keys)
-        return _keys  # type: ignore
+        compactor = self.key_compactor or limiter.key_compactor
+        return compactor(keys) if compactor is not None else keys
 
 
-def filters_resolver(**filters: bool) -> Dict[str, bool]:
-    return filters
+class LimitsEvaluatorDependency:
+    """
+    This dependency is injected once into every limited `APIRoute`, after all of its `BaseLimiterDependency` objects.
+        it checks all the limits registered on the request together, with concurrent storage calls.
+    """
 
+    async def __call__(self, request: Request) -> None:
+        """Check the limits registered on the request
 
-def keys_resolver(**keys: str) -> List[str]:
+        Args:
+            request (Request): request object from FastAPI
+
+        Raises:
+            RateLimitExceeded: when any of the limits exceeds the allowed value, the first one is reported
+        """
+        try:
+            limiter: "RateLimitingMiddleware" = request.state.limiter
+        except AttributeError:
+            return
+        await limiter.check(request.scope["state"])
+
+
+async def keys_resolver(**keys: str) -> List[str]:
     return list(keys.values())
 
 
 class _InjectedLimiterDependency(BaseLimiterDependency):
     """
     A modified version of this class will be injected into the
-        `APIRoute` dependencies to trick FastAPI to resolve the dependencies inside of the functions passed from
-        filter argument of `limit` decorator.
+        `APIRoute` dependencies to trick FastAPI to resolve the key functions passed from
+        keys argument of `limit` decorator. the filters are resolved lazily by `LazyFilters` instead.
     """
 
-    async def __call__(
+    async def __call__(  # type: ignore[override]
         self,
         request: Request,
         response: Response,
         keys: List[str],
-        filters: Dict[str, bool],
     ) -> Any:
-        if all(filters.values()):
-            return await super(type(self), self).__call__(request, response, keys)
+        return await self.register(request, keys)
 
     @classmethod
     def apply_dependencies(
         cls,
         keys: Optional[Union[StrOrCallableKey, List[StrOrCallableKey]]],
-        filters: Optional[Union[CallableFilter, List[CallableFilter]]],
     ) -> Type["_InjectedLimiterDependency"]:
-        """Applies the filters and keys provided by the caller to a modified version of this class and returns it
+        """Applies the key functions provided by the caller to a modified version of this class and returns it
 
         Returns:
             Type[_injectedLimiterDependency]:
         """
-        if not keys and not filters:
+        if not keys:
             return cls  # do not change anything
 
         dep_class = type(
@@ -137,47 +265,26 @@ class _InjectedLimiterDependency(BaseLimiterDependency):
             dict(cls.__dict__),
         )
 
-        # create a copy of resovler functions and change their signature to add keys and filters as dependencies for FastAPI to pick up
-        _keys_resolver = keys_resolver
-        _filters_resolver = filters_resolver
-        keys = ensure_list(keys)
-        filters = ensure_list(filters)
+        # create a copy of the resovler function and change its signature to add the key functions as dependencies for FastAPI to pick up
         _keys_resolver = fncopy(
             keys_resolver,
             sig=tuple(
                 inspect.Parameter(
                     k.__name__, inspect.Parameter.KEYWORD_ONLY, default=Depends(k)
                 )
-                if not isinstance(k, str)
-                else inspect.Parameter(k, inspect.Parameter.KEYWORD_ONLY, default=k)
-                for k in keys
-            ),
-        )
-        _filters_resolver = fncopy(
-            filters_resolver,
-            sig=tuple(
-                inspect.Parameter(
-                    f.__name__, inspect.Parameter.KEYWORD_ONLY, default=Depends(f)
-                )
-                for f in filters
+                for k in cast(List[StrOrCallableKey], ensure_list(keys))
+                if not isinstance(k, str)  # static keys are compiled into `KeyTemplate`
             ),
         )
 
         sig = inspect.signature(dep_class.__call__)
 
-        sig_params = tuple(sig.parameters.values())[:-2] + tuple(
-            (
-                inspect.Parameter(
-                    "keys",
-                    inspect.Parameter.KEYWORD_ONLY,
-                    default=Depends(_keys_resolver),
-                ),
-                inspect.Parameter(
-                    "filters",
-                    inspect.Parameter.KEYWORD_ONLY,
-                    default=Depends(_filters_resolver),
-                ),
-            )
+        sig_params = tuple(sig.parameters.values())[:-1] + (
+            inspect.Parameter(
+                "keys",
+                inspect.Parameter.KEYWORD_ONLY,
+                default=Depends(_keys_resolver),
+            ),
         )
         dep_class.__call__.__signature__ = sig.replace(parameters=sig_params)
         return dep_class  # type: ignore
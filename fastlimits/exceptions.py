@@ -1,3 +1,5 @@
+import math
+import time
 from typing import Dict, Optional
 
 from fastapi import HTTPException, status
@@ -18,9 +20,26 @@ class RateLimitExceeded(HTTPException):
         status_code: int = status.HTTP_429_TOO_MANY_REQUESTS,
         detail: Optional[str] = None,
         headers: Optional[Dict[str, str]] = None,
+        reset_time: Optional[float] = None,
     ) -> None:
+        """RateLimitExceeded
+
+        Args:
+            limit (RateLimitItem): the limit that was exceeded
+            status_code (int): response status code
+            detail (Optional[str]): response detail, defaults to the limit
+            headers (Optional[Dict[str, str]]): extra response headers
+            reset_time (Optional[float]): time (seconds since the epoch) the window of the limit resets at, used for the `Retry-After` header. if `None` a whole window is assumed
+        """
         self.limit = limit
-        # TODO: calculate retry_after and add it to the headers
+        self.reset_time = reset_time
+        retry_after = (
+            reset_time - time.time() if reset_time is not None else limit.get_expiry()
+        )
+        headers = {
+            "Retry-After": str(max(0, math.ceil(retry_after))),
+            **(headers or {}),
+        }
         super().__init__(
             status_code=status_code,
             detail=detail if detail else str(limit),
@@ -28,6 +47,73 @@ class RateLimitExceeded(HTTPException):
         )
 
 
+class ConcurrencyLimitExceeded(HTTPException):
+    """
+    exception raised when all the concurrency slots of a key are taken.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int,
+        status_code: int = status.HTTP_429_TOO_MANY_REQUESTS,
+        detail: Optional[str] = None,
+        retry_after: float = 1,
+    ) -> None:
+        """ConcurrencyLimitExceeded
+
+        Args:
+            max_concurrent (int): number of requests of the key that can be in flight at once
+            status_code (int): response status code
+            detail (Optional[str]): response detail
+            retry_after (float): number of seconds for the `Retry-After` header
+        """
+        self.max_concurrent = max_concurrent
+        super().__init__(
+            status_code=status_code,
+            detail=(
+                detail
+                if detail
+                else f"Concurrency limit exceeded: {max_concurrent} requests in flight"
+            ),
+            headers={"Retry-After": str(max(0, math.ceil(retry_after)))},
+        )
+
+
+class RateLimiterUnavailable(HTTPException):
+    """
+    exception raised when the storage is unavailable and the limiter fails closed.
+    """
+
+    def __init__(
+        self,
+        status_code: int = status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail: str = "Rate limiter unavailable",
+        retry_after: Optional[float] = None,
+    ) -> None:
+        """RateLimiterUnavailable
+
+        Args:
+            status_code (int): response status code
+            detail (str): response detail
+            retry_after (Optional[float]): number of seconds until the storage is called again, used for the `Retry-After` header
+        """
+        super().__init__(
+            status_code=status_code,
+            detail=detail,
+            headers=(
+                {"Retry-After": str(max(0, math.ceil(retry_after)))}
+                if retry_after is not None
+                else None
+            ),
+        )
+
+
+class StorageUnavailable(Exception):
+    """
+    exception raised by `CircuitBreaker` when a storage call fails, times out or is not made because the circuit is open.
+    """
+
+
 class TooManyRequests(BaseModel):
     detail: str = "Rate limit exceeded: {x} per {y} {granularity}"
 
@@ -35,6 +121,6 @@ class TooManyRequests(BaseModel):
 _default_429_response = {
     "model": TooManyRequests,
     "headers": {
-        "retry_after": {"description": "Retry after n seconds", "type": "integer"}
+        "Retry-After": {"description": "Retry after n seconds", "type": "integer"}
     },
 }
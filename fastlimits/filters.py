@@ -0,0 +1,229 @@
+import copy
+import inspect
+from contextlib import AsyncExitStack
+from typing import Any, AsyncIterator, Dict, Iterator, List, Sequence, Tuple
+
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.dependencies.models import Dependant
+from fastapi.dependencies.utils import (
+    get_dependant,
+    get_flat_dependant,
+    is_async_gen_callable,
+    is_gen_callable,
+    solve_dependencies,
+)
+from fastapi.exceptions import RequestValidationError
+
+from .keys import is_async_callable
+from .types import CallableFilter
+
+try:
+    from fastapi._compat import _normalize_errors
+except ImportError:  # pragma: no cover
+    # private to FastAPI, the errors of pydantic 2 don't need to be normalized
+
+    def _normalize_errors(errors: Sequence[Any]) -> List[Dict[str, Any]]:
+        return list(errors)
+
+
+CacheKey = Tuple[Any, Tuple[str, ...]]
+
+# `solve_dependencies` is internal to FastAPI, only the keywords of the installed release are passed
+_SOLVE_OPTIONS: Dict[str, Any] = (
+    {"embed_body_fields": False}
+    if "embed_body_fields" in inspect.signature(solve_dependencies).parameters
+    else {}
+)
+
+
+def _sub_dependants(dependant: Dependant) -> Iterator[Dependant]:
+    for sub_dependant in dependant.dependencies:
+        yield sub_dependant
+        yield from _sub_dependants(sub_dependant)
+
+
+class LazyFilters:
+    """
+    The filters of a limit, called in order until one of them rejects the request.
+
+    FastAPI resolves every `Depends` of a route before the endpoint is called, so a filter that is injected as a
+        dependency costs its sub dependencies on every request, even when an earlier filter already decided.
+        here the parameters of a filter are only resolved right before it is called, and a filter without
+        parameters is called directly.
+
+    The sub dependencies are cached for the whole request like FastAPI does, `SharedDependencies` resolves the ones
+        the route depends on as well, so they are not called twice. the filters are resolved without the body
+        of the request, so they can't have body parameters. the sub dependencies with `yield` are closed with the
+        exit stack of `request_exit_stack`, after the endpoint like the ones of the route.
+    """
+
+    def __init__(self, filters: Sequence[CallableFilter], path: str = "") -> None:
+        """LazyFilters
+
+        Args:
+            filters (Sequence[CallableFilter]): filter functions, cheapest first
+            path (str): path format of the route, for the path parameters of the filters
+        """
+        self.path = path
+        self.filters: List[Tuple[CallableFilter, Dependant, bool, bool]] = [
+            (
+                f,
+                get_dependant(path=path, call=f),
+                bool(inspect.signature(f).parameters),
+                is_async_callable(f),
+            )
+            for f in filters
+        ]
+        for f, dependant, *_ in self.filters:
+            if get_flat_dependant(dependant).body_params:
+                raise ValueError(
+                    f"The filter {getattr(f, '__name__', f)!r} has body parameters, filters can't read the body"
+                )
+        #: some sub dependencies have `yield`, they need `request_exit_stack` on the route
+        self.needs_exit_stack = any(
+            sub_dependant.call is not None
+            and (
+                is_gen_callable(sub_dependant.call)
+                or is_async_gen_callable(sub_dependant.call)
+            )
+            for _, dependant, *_ in self.filters
+            for sub_dependant in _sub_dependants(dependant)
+        )
+
+    def __len__(self) -> int:
+        return len(self.filters)
+
+    def shared_with(self, dependant: Dependant) -> List[Dependant]:
+        """The sub dependencies of the filters that a route depends on as well
+
+        Args:
+            dependant (Dependant): the dependant of the route
+
+        Returns:
+            List[Dependant]: cached sub dependencies of the filters, in the order they are resolved
+        """
+        route_keys = {
+            sub_dependant.cache_key for sub_dependant in _sub_dependants(dependant)
+        }
+        shared: Dict[CacheKey, Dependant] = {}
+        for _, filter_dependant, *_ in self.filters:
+            for sub_dependant in _sub_dependants(filter_dependant):
+                if sub_dependant.use_cache and sub_dependant.cache_key in route_keys:
+                    shared.setdefault(sub_dependant.cache_key, sub_dependant)
+        return list(shared.values())
+
+    async def __call__(self, request: Request) -> bool:
+        """Call the filters in order
+
+        Args:
+            request (Request): request object from FastAPI
+
+        Raises:
+            RequestValidationError: when the parameters of a filter are not valid
+
+        Returns:
+            bool: `False` as soon as a filter returns a falsy value, the rest are not resolved
+        """
+        overrides = getattr(request.scope.get("app"), "dependency_overrides", None)
+        for f, dependant, has_params, is_async in self.filters:
+            if overrides and f in overrides:
+                call = overrides[f]
+                dependant = get_dependant(path=self.path, call=call)
+                has_params = bool(inspect.signature(call).parameters)
+                is_async = is_async_callable(call)
+            if not await self._call(request, dependant, has_params, is_async):
+                return False
+        return True
+
+    async def _call(
+        self, request: Request, dependant: Dependant, has_params: bool, is_async: bool
+    ) -> Any:
+        call = dependant.call
+        assert call is not None
+        if not has_params:
+            return await call() if is_async else await run_in_threadpool(call)
+        stack = getattr(request.state, "exit_stack", None)
+        if stack is not None:
+            return await self._solve(request, dependant, is_async, stack)
+        async with AsyncExitStack() as stack:
+            return await self._solve(request, dependant, is_async, stack)
+
+    async def _solve(
+        self,
+        request: Request,
+        dependant: Dependant,
+        is_async: bool,
+        stack: AsyncExitStack,
+    ) -> Any:
+        call = dependant.call
+        assert call is not None
+        solved = await solve_dependencies(
+            request=request,
+            dependant=dependant,
+            dependency_overrides_provider=request.scope.get("app"),
+            dependency_cache=getattr(request.state, "dependency_cache", None),
+            async_exit_stack=stack,
+            **_SOLVE_OPTIONS,
+        )
+        request.state.dependency_cache = solved.dependency_cache
+        if solved.errors:
+            raise RequestValidationError(_normalize_errors(solved.errors))
+        if is_async:
+            return await call(**solved.values)
+        return await run_in_threadpool(call, **solved.values)
+
+
+async def request_exit_stack(request: Request) -> AsyncIterator[None]:
+    """Keeps an exit stack open on the request until the endpoint is done, for the `yield` dependencies of the filters
+
+    It's injected into a limited `APIRoute` before its `BaseLimiterDependency`, when its filters need it.
+
+    Args:
+        request (Request): request object from FastAPI
+    """
+    async with AsyncExitStack() as stack:
+        request.state.exit_stack = stack
+        yield
+
+
+class SharedDependencies:
+    """
+    This dependency is injected into a limited `APIRoute` before its `BaseLimiterDependency` when its filters share
+        sub dependencies with the route. FastAPI resolves them once for both, and their values are kept on the
+        request for `LazyFilters`.
+    """
+
+    def __init__(self, dependants: Sequence[Dependant], path: str = "") -> None:
+        """SharedDependencies
+
+        Args:
+            dependants (Sequence[Dependant]): the sub dependencies shared by the filters and the route
+            path (str): path format of the route
+        """
+        self.cache_keys: Dict[str, CacheKey] = {}
+        self.dependant = Dependant(
+            call=self,
+            request_param_name="request",
+            path=path,
+        )
+        for i, dependant in enumerate(dependants):
+            name = f"shared_{i}"
+            self.cache_keys[name] = dependant.cache_key
+            dependant = copy.copy(dependant)
+            dependant.name = name  # the names of the parameters could collide
+            self.dependant.dependencies.append(dependant)
+
+    async def __call__(self, request: Request, **values: Any) -> None:
+        """Keep the resolved sub dependencies on the request
+
+        Args:
+            request (Request): request object from FastAPI
+            values (Any): the resolved sub dependencies
+        """
+        try:
+            cache: Dict[CacheKey, Any] = request.state.dependency_cache
+        except AttributeError:
+            cache = request.state.dependency_cache = {}
+        for name, value in values.items():
+            cache[self.cache_keys[name]] = value
@@ -0,0 +1,171 @@
+import base64
+import hashlib
+import inspect
+from typing import Any, Awaitable, Callable, List, Optional, Sequence, Tuple
+
+from fastapi import Request
+
+from .types import CallableMiddlewareKey, StrOrCallableKey
+
+KeyBuilder = Callable[[Request], Awaitable[List[str]]]
+KeyMappingHook = Callable[[str, Tuple[str, ...]], None]
+
+
+def is_async_callable(func: Any) -> bool:
+    """Check if calling `func` returns an awaitable, works for async callable objects as well"""
+    return inspect.iscoroutinefunction(func) or inspect.iscoroutinefunction(
+        getattr(func, "__call__", None)
+    )
+
+
+def compile_key_builder(keys: Sequence[CallableMiddlewareKey]) -> KeyBuilder:
+    """Compile middleware level key functions into a single callable
+
+    The sync and async functions are told apart once, so building the keys of a request
+        does no introspection at all.
+
+    Args:
+        keys (Sequence[CallableMiddlewareKey]): key functions that get the request and return a string
+
+    Returns:
+        KeyBuilder: an async callable that returns the keys of a request, in order
+    """
+    funcs = tuple(keys)
+    flagged = tuple((f, is_async_callable(f)) for f in funcs)
+
+    if not any(is_async for _, is_async in flagged):
+        if len(funcs) == 1:
+            (func,) = funcs
+
+            async def build_single(request: Request) -> List[str]:
+                return [func(request)]  # type: ignore[list-item]
+
+            return build_single
+
+        async def build_sync(request: Request) -> List[str]:
+            return [f(request) for f in funcs]  # type: ignore[misc]
+
+        return build_sync
+
+    async def build(request: Request) -> List[str]:
+        return [
+            await f(request) if is_async else f(request)  # type: ignore[misc]
+            for f, is_async in flagged
+        ]
+
+    return build
+
+
+class KeyTemplate:
+    """
+    Endpoint level keys compiled ahead of time.
+
+    Consecutive static strings are joined into a single part, the same way `limits` joins the identifiers
+        of a limit item, so only the values of the key functions are filled in for each request.
+    """
+
+    __slots__ = ("parts", "static")
+
+    def __init__(self, keys: Sequence[StrOrCallableKey]) -> None:
+        """KeyTemplate
+
+        Args:
+            keys (Sequence[StrOrCallableKey]): endpoint level keys, static strings and key functions
+        """
+        parts: List[Optional[str]] = []  # `None` is a placeholder for a key function
+        run: List[str] = []
+        for key in keys:
+            if isinstance(key, str):
+                run.append(key)
+                continue
+            if run:
+                parts.append("/".join(run))
+                run = []
+            parts.append(None)
+        if run:
+            parts.append("/".join(run))
+        self.parts: Tuple[Optional[str], ...] = tuple(parts)
+        self.static: Optional[Tuple[str, ...]] = (
+            tuple(p for p in parts if p is not None) if None not in parts else None
+        )
+
+    def format(self, values: Optional[Sequence[str]] = None) -> Sequence[str]:
+        """Fill in the values of the key functions
+
+        Args:
+            values (Optional[Sequence[str]]): values of the key functions, in order
+
+        Returns:
+            Sequence[str]: the endpoint level keys
+        """
+        if self.static is not None:
+            return self.static
+        it = iter(values or ())
+        return [part if part is not None else next(it) for part in self.parts]
+
+
+class KeyCompactor:
+    """
+    Replaces the keys of a limit with a short digest of all of them, so the storage keys have a fixed length.
+
+    The keys are hashed with BLAKE2b into `digest_size` bytes, encoded in url safe base64 and prefixed with
+        `namespace`, for example `k:Xq3t9Lw0bVsmyn8C`. the digest doesn't depend on the process, so every worker
+        builds the same key. `limits` still appends the amount and the period of the limit item to it.
+
+    ```py
+    compactor = KeyCompactor(on_compact=lambda key, parts: logger.debug("%s = %s", key, parts))
+    app.add_middleware(RateLimitingMiddleware, strategy=..., key_compactor=compactor)
+    ```
+    """
+
+    __slots__ = ("namespace", "digest_size", "on_compact")
+
+    def __init__(
+        self,
+        namespace: str = "k",
+        digest_size: int = 12,
+        on_compact: Optional[KeyMappingHook] = None,
+    ) -> None:
+        """KeyCompactor
+
+        Args:
+            namespace (str): prefix of the compacted keys, change it to start over with new counters
+            digest_size (int): bytes of the digest, from 8 to 64. 12 bytes make 16 characters
+            on_compact (Optional[KeyMappingHook]): called with every compacted key and the keys it replaces, to trace a key back to its parts
+        """
+        if not 8 <= digest_size <= 64:
+            raise ValueError("digest_size must be between 8 and 64 bytes")
+        self.namespace = namespace
+        self.digest_size = digest_size
+        self.on_compact = on_compact
+
+    def compact(self, keys: Sequence[str]) -> str:
+        """The compacted key of a sequence of keys
+
+        Args:
+            keys (Sequence[str]): the keys of a limit, in order
+
+        Returns:
+            str: `namespace:digest`
+        """
+        digest = hashlib.blake2b(digest_size=self.digest_size)
+        # length prefixed, so the boundaries of the keys are part of the digest
+        for key in keys:
+            data = key.encode()
+            digest.update(len(data).to_bytes(4, "little"))
+            digest.update(data)
+        compacted = f"{self.namespace}:{base64.urlsafe_b64encode(digest.digest()).rstrip(b'=').decode()}"
+        if self.on_compact is not None:
+            self.on_compact(compacted, tuple(keys))
+        return compacted
+
+    def __call__(self, keys: Sequence[str]) -> List[str]:
+        """Replace the keys of a limit with their compacted key
+
+        Args:
+            keys (Sequence[str]): the keys of a limit, in order
+
+        Returns:
+            List[str]: a list with the compacted key only
+        """
+        return [self.compact(keys)]
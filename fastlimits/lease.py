@@ -0,0 +1,226 @@
+import asyncio
+import functools
+import math
+import time
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Dict,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+from limits import RateLimitItem
+from limits.aio.strategies import FixedWindowRateLimiter, RateLimiter
+
+from .strategies import refund, supports_refund
+
+T = TypeVar("T")
+
+LeaseKey = Tuple[RateLimitItem, Tuple[str, ...]]
+StorageCall = Callable[..., Awaitable[Any]]
+
+
+class TokenLease:
+    """
+    A block of hits that was consumed from the storage in advance and is handed out locally.
+    """
+
+    __slots__ = ("tokens", "block", "expires_at", "reset_time", "refill")
+
+    def __init__(self, block: int) -> None:
+        self.tokens = 0
+        self.block = block
+        self.expires_at = math.inf
+        self.reset_time: Optional[float] = None
+        self.refill: Optional["asyncio.Future[bool]"] = None
+
+
+class LeaseManager:
+    """
+    Hands out hits of leased limit items without a call to the storage.
+
+    Each process leases a block of hits (a `ratio` of the limit amount) from the storage, consumes it locally
+        and tops it up in the background when it runs low. a lease expires after `ttl` seconds or when the window
+        of the limit resets, whichever comes first. unused hits of a lease that expires before its window resets
+        are given back to the storage.
+
+    This is an approximation, a process can hold up to a block of hits that other processes can't use.
+    """
+
+    def __init__(
+        self,
+        strategy: RateLimiter,
+        ttl: float = 1.0,
+        low_water: float = 0.2,
+        storage_call: Optional[StorageCall] = None,
+    ) -> None:
+        """LeaseManager
+
+        Args:
+            strategy (RateLimiter): the strategy to lease the hits from
+            ttl (float): maximum number of seconds a lease is kept
+            low_water (float): the lease is topped up when the remaining hits fall below this ratio of a block
+            storage_call (Optional[StorageCall]): calls the storage with `(operation, func, *args)`, `RateLimitingMiddleware` passes its circuit breaker and metrics wrapper
+        """
+        self.strategy = strategy
+        self.ttl = ttl
+        self.low_water = low_water
+        self.storage_call = storage_call
+        self._leases: Dict[LeaseKey, TokenLease] = {}
+        self._tasks: Set["asyncio.Future[Any]"] = set()
+        self._next_sweep = time.time() + ttl
+
+    async def consume(
+        self, item: RateLimitItem, keys: Sequence[str], ratio: float, cost: int = 1
+    ) -> bool:
+        """Consume hits of a leased limit item
+
+        The storage is only called when there is no lease for the item or it's exhausted. the callers that wait for
+            the same refill and find it already taken by the others refill the lease again, the limit is only
+            exceeded when the storage denies a refill.
+
+        Args:
+            item (RateLimitItem): the rate limit item
+            keys (Sequence[str]): keys of the limit item
+            ratio (float): the ratio of `item.amount` to lease at once
+            cost (int): number of hits to consume, the block is never smaller than this
+
+        Raises:
+            StorageUnavailable: if the lease had to be refilled and the storage is unavailable, with a `storage_call` that raises it
+
+        Returns:
+            bool: `False` if the limit is exceeded
+        """
+        now = time.time()
+        if now >= self._next_sweep:
+            self._sweep(now)
+        key = (item, tuple(keys))
+        lease = self._leases.get(key)
+        if lease is not None and lease.expires_at <= now:
+            self._expire(key, lease)
+            lease = None
+        if lease is None:
+            lease = self._leases[key] = TokenLease(max(1, int(item.amount * ratio)))
+        if lease.block < cost:
+            lease.block = cost
+
+        while lease.tokens < cost:
+            if not await asyncio.shield(self._start_refill(item, keys, lease)):
+                return False
+        lease.tokens -= cost
+        if lease.tokens < lease.block * self.low_water and lease.refill is None:
+            self._start_refill(item, keys, lease)
+        return True
+
+    def release(self, item: RateLimitItem, keys: Sequence[str], cost: int = 1) -> None:
+        """Give consumed hits back to the local lease"""
+        lease = self._leases.get((item, tuple(keys)))
+        if lease is not None and lease.expires_at > time.time():
+            lease.tokens += cost
+
+    async def close(self) -> None:
+        """Wait for the pending refills and give all the unused hits back to the storage"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        for key, lease in list(self._leases.items()):
+            self._expire(key, lease)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def __len__(self) -> int:
+        return len(self._leases)
+
+    def _sweep(self, now: float) -> None:
+        """Expire the leases whose time is up, so the keys that are not used anymore don't stay around"""
+        self._next_sweep = now + self.ttl
+        for key, lease in list(self._leases.items()):
+            if lease.expires_at <= now and lease.refill is None:
+                self._expire(key, lease)
+
+    async def _call(
+        self, operation: str, func: Callable[..., Awaitable[T]], *args: Any
+    ) -> T:
+        if self.storage_call is None:
+            return await func(*args)
+        return await self.storage_call(operation, func, *args)  # type: ignore[no-any-return]
+
+    def _start_refill(
+        self, item: RateLimitItem, keys: Sequence[str], lease: TokenLease
+    ) -> "asyncio.Future[bool]":
+        if lease.refill is None:
+            lease.refill = self._track(self._refill(item, keys, lease))
+        return lease.refill
+
+    def _track(self, coro: Coroutine[Any, Any, T]) -> "asyncio.Future[T]":
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._done)
+        return task
+
+    def _done(self, task: "asyncio.Future[Any]") -> None:
+        self._tasks.discard(task)
+        if not task.cancelled():
+            task.exception()  # a failed refill is raised by the `consume` that waits for it, if any
+
+    async def _refill(
+        self, item: RateLimitItem, keys: Sequence[str], lease: TokenLease
+    ) -> bool:
+        """Lease another block from the storage, returns `False` if the storage denied every hit"""
+        try:
+            granted = 0
+            hit = functools.partial(self.strategy.hit, cost=lease.block)
+            if await self._call("hit", hit, item, *keys):
+                granted = lease.block
+            elif lease.block > 1:
+                # not enough room for a whole block, hand the hits out one by one until the window resets
+                if isinstance(self.strategy, FixedWindowRateLimiter):
+                    await self._call(
+                        "refund",
+                        functools.partial(refund, cost=lease.block),
+                        self.strategy,
+                        item,
+                        *keys,
+                    )
+                lease.block = 1
+                if await self._call("hit", self.strategy.hit, item, *keys):
+                    granted = 1
+            if lease.reset_time is None:
+                stats = await self._call(
+                    "window_stats", self.strategy.get_window_stats, item, *keys
+                )
+                lease.reset_time = stats.reset_time
+                lease.expires_at = min(stats.reset_time, time.time() + self.ttl)
+            lease.tokens += granted
+            return granted > 0
+        finally:
+            lease.refill = None
+            if lease.reset_time is None:
+                # failed, the lease is replaced by the next `consume`
+                lease.expires_at = time.time()
+
+    def _expire(self, key: LeaseKey, lease: TokenLease) -> None:
+        if self._leases.get(key) is lease:
+            del self._leases[key]
+        if (
+            lease.tokens > 0
+            and lease.reset_time is not None
+            and lease.reset_time > time.time()
+            and supports_refund(self.strategy)
+        ):
+            # the window is still open, other processes can use the hits that were left
+            self._track(
+                self._call(
+                    "refund",
+                    functools.partial(refund, cost=lease.tokens),
+                    self.strategy,
+                    key[0],
+                    *key[1],
+                )
+            )
+        lease.tokens = 0
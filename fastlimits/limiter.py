@@ -1,22 +1,50 @@
-import inspect
-from typing import Any, Callable, Dict, List, Optional, TypeVar, Union
+import linecache
+import sys
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type, TypeVar, Union
 
 from fastapi import Depends
+from fastapi._compat import ModelField
 from fastapi.dependencies.utils import get_parameterless_sub_dependant
 from fastapi.routing import APIRoute
 from fastapi.utils import create_model_field
 from limits import RateLimitItem, parse
 from typing_extensions import ParamSpec
 
-from .dependencies import BaseLimiterDependency, _InjectedLimiterDependency
+from .concurrency import ConcurrencyLimitDependency
+from .dependencies import (
+    BaseLimiterDependency,
+    LimitsEvaluatorDependency,
+    _InjectedLimiterDependency,
+)
 from .exceptions import _default_429_response
-from .types import CallableFilter, StrOrCallableKey, SupportsRoutes
+from .filters import LazyFilters, SharedDependencies, request_exit_stack
+from .keys import KeyCompactor
+from .types import (
+    CallableCost,
+    CallableFilter,
+    CallableMiddlewareKey,
+    StrOrCallableKey,
+    SupportsRoutes,
+)
 from .utils import create_response_model, ensure_list, find_api_route, get_api_routes
 
 P = ParamSpec("P")
 R = TypeVar("R")
 
 
+_RESPONSE_FIELDS: Dict[Type[Any], ModelField] = {}
+
+
+def _create_429_response_field(type_: Type[Any]) -> ModelField:
+    """The 429 response field of a response model, shared by all the routes that use the model"""
+    field = _RESPONSE_FIELDS.get(type_)
+    if field is None:
+        field = _RESPONSE_FIELDS[type_] = create_model_field(
+            name=f"Response_429_{type_.__name__}", type_=type_
+        )
+    return field
+
+
 def apply_limit(
     route: APIRoute,
     item: RateLimitItem,
@@ -26,6 +54,10 @@ def apply_limit(
     default_response_model: Optional[Dict[str, Any]],
     show_limit_in_response_model: bool,
     override_default_keys: bool,
+    lease: Optional[float] = None,
+    tiers: Optional[List[Tuple[CallableFilter, RateLimitItem]]] = None,
+    cost: Union[int, CallableCost] = 1,
+    key_compactor: Optional[KeyCompactor] = None,
 ) -> None:
     """Apply the limit to an `APIRoute` object
 
@@ -38,14 +70,17 @@ def apply_limit(
         default_response_model (Optional[Dict[str, Any]]): default response model schema to show in docs
         show_limit_in_response_model (bool): should the value of rate limit be shown on the docs or not
         override_default_keys (bool): wether to override default keys or extend them
+        lease (Optional[float]): ratio of the limit amount to lease from the storage at once, `None` to count every hit in the storage
+        tiers (Optional[List[Tuple[CallableFilter, RateLimitItem]]]): `(filter, rate limit value)` pairs, the first tier whose filter accepts the request applies instead of `item`
+        cost (Union[int, CallableCost]): hits a request costs, or a function that returns them
+        key_compactor (Optional[KeyCompactor]): replace the keys with a fixed length digest, defaults to the `key_compactor` of the middleware
 
     """
     if default_response_model is not None:
         route.responses[429] = default_response_model
         if (model := route.responses[429].get("model", None)) is not None:
-            route.response_fields[429] = create_model_field(
-                name=f"Response_429_{route.unique_id}",
-                type_=create_response_model(model, item, show_limit_in_response_model),
+            route.response_fields[429] = _create_429_response_field(
+                create_response_model(model, item, show_limit_in_response_model)
             )
     keys = ensure_list(keys)
     if override_default_keys:
@@ -56,14 +91,46 @@ def apply_limit(
             0, route.endpoint.__name__
         )  # add endpoint's funtion name as the first element of the key by default
 
-    # TODO: check if other limits were added previously
-    dep_class = BaseLimiterDependency
-    if filters or keys:
-        dep_class = _InjectedLimiterDependency.apply_dependencies(keys, filters)
+    # all the limits of a route are checked together by a single evaluator that runs after them
+    if not any(
+        isinstance(dep.call, LimitsEvaluatorDependency)
+        for dep in route.dependant.dependencies
+    ):
+        route.dependant.dependencies.insert(
+            0,
+            get_parameterless_sub_dependant(
+                depends=Depends(LimitsEvaluatorDependency()),
+                path=route.path_format,
+            ),
+        )
+    # only key functions are left to FastAPI, static keys are compiled and filters are resolved lazily
+    dep_class: Type[BaseLimiterDependency] = BaseLimiterDependency
+    if any(not isinstance(k, str) for k in keys):
+        dep_class = _InjectedLimiterDependency.apply_dependencies(keys)
+    lazy_filters = LazyFilters(ensure_list(filters), route.path_format)
+    lazy_tiers = [
+        (LazyFilters([tier_filter], route.path_format), tier_item)
+        for tier_filter, tier_item in tiers or []
+    ]
+    # the sub dependencies that the route needs anyway are resolved by FastAPI, once for the filters and the route
+    shared = [
+        *lazy_filters.shared_with(route.dependant),
+        *(
+            dependant
+            for tier_filters, _ in lazy_tiers
+            for dependant in tier_filters.shared_with(route.dependant)
+        ),
+    ]
     limit_dependency = Depends(
         dep_class(
             limit_value=item,
             no_hit_status_codes=no_hit_status_codes,
+            lease=lease,
+            keys=keys,
+            filters=lazy_filters,
+            tiers=lazy_tiers,
+            cost=cost,
+            key_compactor=key_compactor,
         )
     )
     route.dependant.dependencies.insert(
@@ -73,6 +140,140 @@ def apply_limit(
             path=route.path_format,
         ),
     )
+    if shared:
+        route.dependant.dependencies.insert(
+            0, SharedDependencies(shared, route.path_format).dependant
+        )
+    # the `yield` sub dependencies of the filters are closed after the endpoint, it has to be open before any limit
+    if lazy_filters.needs_exit_stack or any(
+        tier_filters.needs_exit_stack for tier_filters, _ in lazy_tiers
+    ):
+        route.dependant.dependencies[:] = [
+            dep
+            for dep in route.dependant.dependencies
+            if dep.call is not request_exit_stack
+        ]
+        route.dependant.dependencies.insert(
+            0,
+            get_parameterless_sub_dependant(
+                depends=Depends(request_exit_stack), path=route.path_format
+            ),
+        )
+
+
+def limit_route(
+    router: SupportsRoutes,
+    limit_string: str,
+    keys: Optional[Union[StrOrCallableKey, List[StrOrCallableKey]]] = None,
+    filters: Optional[Union[CallableFilter, List[CallableFilter]]] = None,
+    no_hit_status_codes: Optional[List[int]] = None,
+    default_response_model: Optional[Dict[str, Any]] = _default_429_response,
+    show_limit_in_response_model: bool = True,
+    override_default_keys: bool = False,
+    lease: Optional[float] = None,
+    tiers: Optional[List[Tuple[CallableFilter, str]]] = None,
+    cost: Union[int, CallableCost] = 1,
+    key_compactor: Optional[KeyCompactor] = None,
+) -> Callable[[Callable[P, R]], Callable[P, R]]:
+    """A decorator to apply a limit to the route of the decorated endpoint.
+
+    ```py
+    @limit_route(app, "5/minute")
+    @app.get("/")
+    def show_items(...):
+        ...
+    ```
+
+    The arguments are the same as `limit`.
+
+    Returns:
+        Callable[[Callable[P, R]], Callable[P, R]]: the decorator, it returns the endpoint unchanged
+    """
+    item = parse(limit_string)
+    parsed_tiers = _parse_tiers(tiers)
+
+    def decorator(func: Callable[P, R]) -> Callable[P, R]:
+        route = find_api_route(router, func)
+        if route:
+            apply_limit(
+                route=route,
+                item=item,
+                keys=keys,
+                filters=filters,
+                no_hit_status_codes=no_hit_status_codes,
+                default_response_model=default_response_model,
+                show_limit_in_response_model=show_limit_in_response_model,
+                override_default_keys=override_default_keys,
+                lease=lease,
+                tiers=parsed_tiers,
+                cost=cost,
+                key_compactor=key_compactor,
+            )
+        return func
+
+    return decorator
+
+
+def limit_routes(
+    router: SupportsRoutes,
+    limit_string: str,
+    keys: Optional[Union[StrOrCallableKey, List[StrOrCallableKey]]] = None,
+    filters: Optional[Union[CallableFilter, List[CallableFilter]]] = None,
+    no_hit_status_codes: Optional[List[int]] = None,
+    default_response_model: Optional[Dict[str, Any]] = _default_429_response,
+    show_limit_in_response_model: bool = True,
+    override_default_keys: bool = False,
+    lease: Optional[float] = None,
+    tiers: Optional[List[Tuple[CallableFilter, str]]] = None,
+    cost: Union[int, CallableCost] = 1,
+    key_compactor: Optional[KeyCompactor] = None,
+) -> None:
+    """Apply a limit to every route of an `APIRouter` or `FastAPI` object.
+
+    ```py
+    router = APIRouter(prefix="/items")
+    ...
+    limit_routes(router, "5/minute")
+    ```
+
+    The arguments are the same as `limit`.
+    """
+    item = parse(limit_string)
+    parsed_tiers = _parse_tiers(tiers)
+    for route in get_api_routes(router):
+        apply_limit(
+            route=route,
+            item=item,
+            keys=keys,
+            filters=filters,
+            no_hit_status_codes=no_hit_status_codes,
+            default_response_model=default_response_model,
+            show_limit_in_response_model=show_limit_in_response_model,
+            override_default_keys=override_default_keys,
+            lease=lease,
+            tiers=parsed_tiers,
+            cost=cost,
+            key_compactor=key_compactor,
+        )
+
+
+def _parse_tiers(
+    tiers: Optional[List[Tuple[CallableFilter, str]]],
+) -> List[Tuple[CallableFilter, RateLimitItem]]:
+    return [
+        (tier_filter, parse(limit_string)) for tier_filter, limit_string in tiers or []
+    ]
+
+
+def _called_as_decorator(depth: int) -> bool:
+    """Check if the call `depth` frames up the stack is a decorator ('@' syntax)
+
+    Only the line of the call is read, unlike `inspect.stack` that reads the source of every frame.
+        the call is assumed to be a decorator if its source is not available.
+    """
+    frame = sys._getframe(depth + 1)
+    line = linecache.getline(frame.f_code.co_filename, frame.f_lineno, frame.f_globals)
+    return not line or line.strip().startswith("@")
 
 
 def limit(
@@ -84,6 +285,10 @@ def limit(
     default_response_model: Optional[Dict[str, Any]] = _default_429_response,
     show_limit_in_response_model: bool = True,
     override_default_keys: bool = False,
+    lease: Optional[float] = None,
+    tiers: Optional[List[Tuple[CallableFilter, str]]] = None,
+    cost: Union[int, CallableCost] = 1,
+    key_compactor: Optional[KeyCompactor] = None,
 ) -> Callable[[Callable[P, R]], Callable[P, R]]:
     """A decorator function to apply limits to any route definition or group of routes.
 
@@ -121,49 +326,125 @@ def limit(
         router (SupportsRoutes): An object that has `routes` attribute available with `router.routes` which ther routes are `APIRoute` objects. for example: `APIRouter` or `FastAPI` instances.
         limit_string (str): limit string in the format of {x}/{granularity}. for example: "5/minute" or "1/hour"
         keys (Optional[Union[StrOrCallableKey, List[StrOrCallableKey]]]): the unique keys to be used for this route. you can apply limits to routes using a shared key, all these routes limits will be calculated together. for example if you use the same keys for 'POST /items' and 'GET /items', rate limit will hit on that key with calling any of them.
-        filters (Optional[Union[CallableFilter, List[CallableFilter]]]): Filters to check before counting a hit. It has to be a function or async function that returns a bool. a hit will be count if all of the filters return True. you can use Depends for filters and they will be resolved by FastAPI automatically.
+        filters (Optional[Union[CallableFilter, List[CallableFilter]]]): Filters to check before counting a hit. It has to be a function or async function that returns a bool. a hit will be count if all of the filters return True. you can use Depends for filters, they are resolved in order and only until one of them returns False.
         no_hit_status_codes (Optional[List[int]]): a list of status codes to not count a hit when they are returned. for example if you pass `[400, 404]`, if the response status code was in the list, a hit will not be counted.
         default_response_model (Optional[Dict[str, Any]]): default response model to use for 429 responses in the autogenerated docs. if `None` was passed, nothing will be shown in the docs about this response.
         show_limit_in_response_model (bool, optional): Should the values for rate-limit be shown in the response model?
         override_default_keys (bool, optional): provided 'keys' should be added to default keys or override default keys
+        lease (Optional[float], optional): approximate mode for very hot limits. each process leases this ratio of the limit amount (for example `0.01`) from the storage at once and counts the hits locally. a higher ratio means less storage calls but a less accurate limit.
+        tiers (Optional[List[Tuple[CallableFilter, str]]], optional): `(filter, limit string)` pairs checked in order, the first tier whose filter returns True applies instead of `limit_string`, and only its counter is checked and hit. filters of the later tiers are not called at all.
+        cost (Union[int, CallableCost], optional): the number of hits a request costs, for endpoints that are more expensive than others. it can also be a function (or async function) that gets the `Request` and returns the cost, which is checked and counted before the endpoint runs. if the function takes a second argument it gets the `Response` too (its status code and headers, before the body is sent): the request is checked with a cost of 1 and the final cost is counted after the response.
+        key_compactor (Optional[KeyCompactor], optional): store the counters of this limit under a fixed length digest of its keys instead of the keys themselves, see `KeyCompactor`. defaults to the `key_compactor` of the middleware.
 
     Returns:
         Optional[Callable[[Callable[P, R]], Callable[P, R]]]
 
     Note:
         This function returns a `Callable` if it was used as a decorator ('@' syntax) otherwise `None`.
+            the syntax is detected from the source line of the call, use `limit_route` or `limit_routes` to skip the detection.
 
     """
+    options: Dict[str, Any] = {
+        "keys": keys,
+        "filters": filters,
+        "no_hit_status_codes": no_hit_status_codes,
+        "default_response_model": default_response_model,
+        "show_limit_in_response_model": show_limit_in_response_model,
+        "override_default_keys": override_default_keys,
+        "lease": lease,
+        "tiers": tiers,
+        "cost": cost,
+        "key_compactor": key_compactor,
+    }
+    # check to see if this function was used as a decorator or not
+    if _called_as_decorator(1):
+        return limit_route(router, limit_string, **options)
+    limit_routes(router, limit_string, **options)
+    return  # type: ignore
+
+
+def apply_concurrency_limit(
+    route: APIRoute,
+    max_concurrent: int,
+    keys: Optional[
+        Union[str, CallableMiddlewareKey, List[Union[str, CallableMiddlewareKey]]]
+    ],
+    override_default_keys: bool,
+) -> None:
+    """Apply a concurrency limit to an `APIRoute` object
+
+    The dependency is placed right after the limits evaluator, so a request that is rejected by a rate limit doesn't take a slot.
+
+    Args:
+        route (APIRoute): route to apply the limit to
+        max_concurrent (int): number of requests that can be in flight at once for each key
+        keys (Optional[Union[str, CallableMiddlewareKey, List[Union[str, CallableMiddlewareKey]]]]): static keys and key functions that get the request
+        override_default_keys (bool): wether to override default keys or extend them
+    """
+    keys = ensure_list(keys)
+    if override_default_keys:
+        if not keys:
+            raise ValueError("Can't override default keys when no key is supplied")
+    else:
+        keys.insert(0, route.endpoint.__name__)
+    position = next(
+        (
+            i + 1
+            for i, dep in enumerate(route.dependant.dependencies)
+            if isinstance(dep.call, LimitsEvaluatorDependency)
+        ),
+        0,
+    )
+    route.dependant.dependencies.insert(
+        position,
+        get_parameterless_sub_dependant(
+            depends=Depends(ConcurrencyLimitDependency(max_concurrent, keys)),
+            path=route.path_format,
+        ),
+    )
+
+
+def limit_concurrency(
+    router: SupportsRoutes,
+    max_concurrent: int,
+    keys: Optional[
+        Union[str, CallableMiddlewareKey, List[Union[str, CallableMiddlewareKey]]]
+    ] = None,
+    override_default_keys: bool = False,
+) -> Callable[[Callable[P, R]], Callable[P, R]]:
+    """Cap the number of requests that are in flight at once, for each key.
+
+    A slot is taken before the endpoint is called and given back when the response is sent, or the request fails.
+        the slots are counted by the `concurrency` backend of `RateLimitingMiddleware`.
+
+    ```py
+    @limit_concurrency(app, 10)
+    @app.get("/report")
+    async def build_report(...):
+        ...
+
+
+    limit_concurrency(router, 50)  # every route of the router
+    ```
+
+    Args:
+        router (SupportsRoutes): An object that has `routes` attribute available with `router.routes` which ther routes are `APIRoute` objects. for example: `APIRouter` or `FastAPI` instances.
+        max_concurrent (int): number of requests of each key (by default each client of each endpoint) that can be in flight at once
+        keys (Optional[Union[str, CallableMiddlewareKey, List[Union[str, CallableMiddlewareKey]]]]): static keys and key functions that get the request, unlike the keys of `limit` they are not resolved as dependencies
+        override_default_keys (bool, optional): provided 'keys' should be added to default keys or override default keys
+
+    Returns:
+        Optional[Callable[[Callable[P, R]], Callable[P, R]]]: a decorator if it was used as a decorator ('@' syntax) otherwise `None`
+    """
 
     def decorator(func: Callable[P, R]) -> Callable[P, R]:
         route = find_api_route(router, func)
         if route:
-            apply_limit(
-                route=route,
-                item=parse(limit_string),
-                keys=keys,
-                filters=filters,
-                no_hit_status_codes=no_hit_status_codes,
-                default_response_model=default_response_model,
-                show_limit_in_response_model=show_limit_in_response_model,
-                override_default_keys=override_default_keys,
-            )
+            apply_concurrency_limit(route, max_concurrent, keys, override_default_keys)
         return func
 
-    # check to see if this function was used as a decorator or not
-    if ctx := inspect.stack()[1].code_context:
-        if not ctx[0].strip().startswith("@"):
-            item = parse(limit_string)
-            for route in get_api_routes(router):
-                apply_limit(
-                    route=route,
-                    item=item,
-                    keys=keys,
-                    filters=filters,
-                    no_hit_status_codes=no_hit_status_codes,
-                    default_response_model=default_response_model,
-                    show_limit_in_response_model=show_limit_in_response_model,
-                    override_default_keys=override_default_keys,
-                )
-            return  # type: ignore
-    return decorator
+    if _called_as_decorator(1):
+        return decorator
+    for route in get_api_routes(router):
+        apply_concurrency_limit(route, max_concurrent, keys, override_default_keys)
+    return  # type: ignore
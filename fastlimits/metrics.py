@@ -0,0 +1,213 @@
+import bisect
+import math
+from collections import defaultdict
+from typing import Dict, List, Sequence, Tuple
+
+from limits import RateLimitItem
+
+ALLOWED = "allowed"
+DENIED = "denied"
+EXCLUDED = "excluded"
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+)
+
+
+class LimiterMetrics:
+    """
+    Instrumentation hooks of `RateLimitingMiddleware`, the methods of this class do nothing.
+
+    Subclass it to send the decisions and the storage latencies anywhere. the middleware doesn't call the hooks
+        at all when no metrics object is passed to it.
+    """
+
+    def decision(self, item: RateLimitItem, keys: Sequence[str], outcome: str) -> None:
+        """Called for every limit of a request once its outcome is known
+
+        Args:
+            item (RateLimitItem): the rate limit item
+            keys (Sequence[str]): keys of the limit item
+            outcome (str): `"allowed"`, `"denied"` or `"excluded"` (the response status code was in `no_hit_status_codes`)
+        """
+
+    def storage_call(self, operation: str, seconds: float) -> None:
+        """Called after every storage call of the middleware
+
+        Args:
+            operation (str): `"test"`, `"hit"`, `"refund"`, `"window_stats"`, `"acquire"` or `"release"`
+            seconds (float): time the call took, failed calls included
+        """
+
+    def multiplier(self, value: float) -> None:
+        """Called whenever the multiplier of `AdaptiveLimits` changes
+
+        Args:
+            value (float): the new multiplier, between `min_multiplier` and 1
+        """
+
+
+class Cardinality:
+    """
+    A HyperLogLog estimate of the number of distinct keys, in `2 ** precision` bytes of registers.
+    """
+
+    __slots__ = ("precision", "registers")
+
+    def __init__(self, precision: int = 10) -> None:
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be between 4 and 16")
+        self.precision = precision
+        self.registers = bytearray(1 << precision)
+
+    def add(self, value: object) -> None:
+        """Add a hashable value to the set"""
+        h = hash(value) & 0xFFFFFFFFFFFFFFFF
+        index = h >> (64 - self.precision)
+        rest = (h << self.precision) & 0xFFFFFFFFFFFFFFFF
+        rank = 64 - self.precision + 1 if rest == 0 else 65 - rest.bit_length()
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self) -> float:
+        """Estimated number of distinct values added, within a few percent"""
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0**-r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            return m * math.log(m / zeros)  # linear counting for small cardinalities
+        return estimate
+
+
+class Histogram:
+    """
+    Cumulative buckets of observed values, the way Prometheus exposes them.
+    """
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Add a value to its bucket"""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[float, int]]:
+        """`(upper bound, count)` pairs, the last bound is `inf`"""
+        result = []
+        total = 0
+        for bound, count in zip((*self.bounds, math.inf), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class InMemoryMetrics(LimiterMetrics):
+    """
+    Keeps the metrics in the process: decision counters and a key cardinality estimate per limit item,
+        and a latency histogram per storage operation.
+
+    Limit items with the same value (for example `5/minute` on two routes) share their counters.
+    """
+
+    def __init__(
+        self, buckets: Sequence[float] = DEFAULT_BUCKETS, precision: int = 10
+    ) -> None:
+        """InMemoryMetrics
+
+        Args:
+            buckets (Sequence[float]): upper bounds (seconds) of the storage latency histogram buckets
+            precision (int): precision of the key cardinality estimates, each limit item uses `2 ** precision` bytes
+        """
+        self.buckets = tuple(buckets)
+        self.precision = precision
+        self.decisions: Dict[Tuple[str, str], int] = defaultdict(int)
+        self.cardinality: Dict[str, Cardinality] = {}
+        self.latency: Dict[str, Histogram] = {}
+        self.adaptive_multiplier = 1.0
+
+    def decision(self, item: RateLimitItem, keys: Sequence[str], outcome: str) -> None:
+        label = str(item)
+        self.decisions[label, outcome] += 1
+        cardinality = self.cardinality.get(label)
+        if cardinality is None:
+            cardinality = self.cardinality[label] = Cardinality(self.precision)
+        cardinality.add(tuple(keys))
+
+    def storage_call(self, operation: str, seconds: float) -> None:
+        histogram = self.latency.get(operation)
+        if histogram is None:
+            histogram = self.latency[operation] = Histogram(self.buckets)
+        histogram.observe(seconds)
+
+    def multiplier(self, value: float) -> None:
+        self.adaptive_multiplier = value
+
+    def prometheus(self, prefix: str = "fastlimits") -> str:
+        """Render the metrics in the Prometheus text exposition format
+
+        Args:
+            prefix (str): prefix of the metric names
+
+        Returns:
+            str: the metrics, ready to be served from a `/metrics` endpoint
+        """
+        lines = [
+            f"# HELP {prefix}_decisions_total Limit decisions by limit item and outcome.",
+            f"# TYPE {prefix}_decisions_total counter",
+        ]
+        for (label, outcome), count in sorted(self.decisions.items()):
+            lines.append(
+                f'{prefix}_decisions_total{{limit="{_escape(label)}",outcome="{outcome}"}} {count}'
+            )
+        lines += [
+            f"# HELP {prefix}_keys Estimated number of distinct keys by limit item.",
+            f"# TYPE {prefix}_keys gauge",
+        ]
+        for label, cardinality in sorted(self.cardinality.items()):
+            lines.append(
+                f'{prefix}_keys{{limit="{_escape(label)}"}} {round(cardinality.estimate())}'
+            )
+        lines += [
+            f"# HELP {prefix}_storage_seconds Latency of the storage calls by operation.",
+            f"# TYPE {prefix}_storage_seconds histogram",
+        ]
+        for operation, histogram in sorted(self.latency.items()):
+            for bound, count in histogram.cumulative():
+                le = "+Inf" if math.isinf(bound) else repr(bound)
+                lines.append(
+                    f'{prefix}_storage_seconds_bucket{{operation="{operation}",le="{le}"}} {count}'
+                )
+            lines.append(
+                f'{prefix}_storage_seconds_sum{{operation="{operation}"}} {histogram.sum}'
+            )
+            lines.append(
+                f'{prefix}_storage_seconds_count{{operation="{operation}"}} {histogram.count}'
+            )
+        lines += [
+            f"# HELP {prefix}_adaptive_multiplier Current multiplier of the limit amounts.",
+            f"# TYPE {prefix}_adaptive_multiplier gauge",
+            f"{prefix}_adaptive_multiplier {self.adaptive_multiplier}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
@@ -1,19 +1,193 @@
-from typing import TYPE_CHECKING, Awaitable, Callable, Dict, List, Optional, Union
+import math
+import time
+import warnings
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+    cast,
+)
 
-from fastapi import Request, Response
+import anyio
+from fastapi import HTTPException, Request
+from limits import RateLimitItem, parse
 from limits.aio.strategies import RateLimiter
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.types import ASGIApp
+from starlette.responses import JSONResponse, Response
+from starlette.status import WS_1008_POLICY_VIOLATION
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from starlette.websockets import WebSocket
 
+from .adaptive import AdaptiveLimits
+from .batching import HitBatcher, HitQueue
+from .cache import ExceededCache
+from .circuit import CircuitBreaker
+from .concurrency import ConcurrencyBackend, MemoryConcurrency
+from .dependencies import AppliedLimit
+from .exceptions import (
+    ConcurrencyLimitExceeded,
+    RateLimiterUnavailable,
+    RateLimitExceeded,
+    StorageUnavailable,
+)
 from .functions import get_remote_address
-from .types import CallableMiddlewareKey
+from .keys import KeyCompactor, KeyTemplate, compile_key_builder
+from .lease import LeaseManager
+from .metrics import ALLOWED, DENIED, EXCLUDED, LimiterMetrics
+from .sketch import HeavyHitters
+from .strategies import (
+    WindowState,
+    batch_hit,
+    batch_refund,
+    batch_test,
+    supports_refund,
+)
+from .types import CallableMiddlewareKey, StrOrCallableKey
 from .utils import ensure_list
 
-if TYPE_CHECKING:
-    from .dependencies import BaseLimiterDependency
+T = TypeVar("T")
 
 
-class RateLimitingMiddleware(BaseHTTPMiddleware):
+class GlobalLimit:
+    """
+    A limit declared on `RateLimitingMiddleware`, it is checked for every request under `prefix` before the app is called,
+        so a rejected request doesn't go through routing, request parsing or any dependency.
+    """
+
+    def __init__(
+        self,
+        limit_value: Union[str, RateLimitItem],
+        prefix: str = "/",
+        keys: Optional[
+            Union[str, CallableMiddlewareKey, List[Union[str, CallableMiddlewareKey]]]
+        ] = None,
+        no_hit_status_codes: Optional[List[int]] = None,
+    ) -> None:
+        """GlobalLimit
+
+        Args:
+            limit_value (Union[str, RateLimitItem]): a string like "5/minute" or a `RateLimitItem` object
+            prefix (str): the path prefix the limit applies to, `"/"` for every path. `"/api"` matches `/api` and `/api/items` but not `/apis`
+            keys (Optional[Union[str, CallableMiddlewareKey, List[Union[str, CallableMiddlewareKey]]]]): static keys and key functions that get the request, appended to the middleware keys. all the paths under the prefix share the limit by default
+            no_hit_status_codes (Optional[List[int]]): the response statuses that won't be count as a hit on the limiter
+        """
+        self.item = parse(limit_value) if isinstance(limit_value, str) else limit_value
+        self.prefix = prefix.rstrip("/")
+        self.no_hit_status_codes = no_hit_status_codes if no_hit_status_codes else []
+        self.lease: Optional[float] = None
+        keys = ensure_list(keys)
+        self.key_template = KeyTemplate(["global", prefix, *keys])
+        self.build_key_values = compile_key_builder(
+            [k for k in keys if not isinstance(k, str)]
+        )
+
+    def matches(self, path: str) -> bool:
+        """Check if the limit applies to a request path"""
+        return (
+            not self.prefix or path == self.prefix or path.startswith(self.prefix + "/")
+        )
+
+    async def build_keys(self, request: Request) -> List[str]:
+        """Keys of the limit for a request, without the middleware keys"""
+        if self.key_template.static is not None:
+            return list(self.key_template.static)
+        return list(self.key_template.format(await self.build_key_values(request)))
+
+
+class WebSocketLimit(GlobalLimit):
+    """
+    A limit declared on `RateLimitingMiddleware` for the websocket connections under `prefix`.
+
+    A connection limit counts the connections (the handshakes) of a key, it's checked before the app is called and
+        the connection is closed right away when it's exceeded. a message limit counts the messages a client sends,
+        they are counted locally on each connection and hit in the storage in batches of up to `batch_size`
+        messages, when the connection is closed the limit is exceeded.
+
+    ```py
+    app.add_middleware(
+        RateLimitingMiddleware,
+        strategy=...,
+        websocket_limits=[
+            WebSocketLimit("10/minute", prefix="/ws"),
+            WebSocketLimit("100/second", prefix="/ws", messages=True),
+        ],
+    )
+    ```
+    """
+
+    def __init__(
+        self,
+        limit_value: Union[str, RateLimitItem],
+        prefix: str = "/",
+        keys: Optional[
+            Union[str, CallableMiddlewareKey, List[Union[str, CallableMiddlewareKey]]]
+        ] = None,
+        messages: bool = False,
+        batch_size: int = 10,
+        close_code: int = WS_1008_POLICY_VIOLATION,
+        no_hit_status_codes: Optional[List[int]] = None,
+    ) -> None:
+        """WebSocketLimit
+
+        Args:
+            limit_value (Union[str, RateLimitItem]): a string like "5/minute" or a `RateLimitItem` object
+            prefix (str): the path prefix the limit applies to, `"/"` for every path
+            keys (Optional[Union[str, CallableMiddlewareKey, List[Union[str, CallableMiddlewareKey]]]]): static keys and key functions that get the `WebSocket`, appended to the middleware keys
+            messages (bool): count the messages received on the connections instead of the connections
+            batch_size (int): maximum number of messages counted locally before they are hit in the storage, a client can go over the limit by up to this many messages per connection
+            close_code (int): the code the connection is closed with when the limit is exceeded
+            no_hit_status_codes (Optional[List[int]]): handshake statuses that won't be counted by a connection limit, `101` when the connection is accepted and `403` when it's rejected
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        super().__init__(limit_value, prefix, keys, no_hit_status_codes)
+        self.messages = messages
+        self.batch_size = batch_size
+        self.close_code = close_code
+        self.key_template = KeyTemplate(
+            [
+                "websocket",
+                "messages" if messages else "connections",
+                prefix,
+                *cast(List[StrOrCallableKey], ensure_list(keys)),
+            ]
+        )
+
+
+class MessageCounter:
+    """
+    The messages of a message limit received on a connection that are not in the storage yet.
+    """
+
+    __slots__ = ("limit", "keys", "pending", "budget")
+
+    def __init__(self, limit: WebSocketLimit, keys: List[str]) -> None:
+        self.limit = limit
+        self.keys = keys
+        self.pending = 0
+        #: messages that are counted locally before the next hit, the first message is always hit right away
+        self.budget = 1
+
+    def update(self, window: WindowState) -> None:
+        """Count the next messages locally, until the batch is full or the remaining hits of the window are used"""
+        self.pending = 0
+        if window.remaining is None:
+            self.budget = self.limit.batch_size
+        else:
+            self.budget = max(1, min(self.limit.batch_size, window.remaining))
+
+
+class RateLimitingMiddleware:
+    """
+    A pure ASGI middleware that exposes the limiter to the `BaseLimiterDependency` objects
+        injected into the routes and counts the hits once the response status is known.
+    """
+
     def __init__(
         self,
         app: ASGIApp,
@@ -21,32 +195,716 @@ class RateLimitingMiddleware(BaseHTTPMiddleware):
         keys: Optional[
             Union[CallableMiddlewareKey, List[CallableMiddlewareKey]]
         ] = None,
+        atomic: bool = False,
+        exceeded_cache: Optional[ExceededCache] = None,
+        headers_enabled: bool = False,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        metrics: Optional[LimiterMetrics] = None,
+        global_limits: Optional[List[GlobalLimit]] = None,
+        concurrency: Optional[ConcurrencyBackend] = None,
+        adaptive: Optional[AdaptiveLimits] = None,
+        hit_batcher: Optional[HitBatcher] = None,
+        heavy_hitters: Optional[HeavyHitters] = None,
+        key_compactor: Optional[KeyCompactor] = None,
+        websocket_limits: Optional[List[WebSocketLimit]] = None,
+        hit_queue: Optional[HitQueue] = None,
     ) -> None:
+        """RateLimitingMiddleware
+
+        Args:
+            app (ASGIApp): the wrapped ASGI application
+            strategy (RateLimiter): an async strategy from `limits.aio.strategies`
+            keys (Optional[Union[CallableMiddlewareKey, List[CallableMiddlewareKey]]]): key functions applied to every limit item, defaults to `get_remote_address`
+            atomic (bool): consume the hit while checking the limit, in a single storage call, instead of testing before the endpoint and hitting after it. hits of responses in `no_hit_status_codes` are refunded afterwards.
+            exceeded_cache (Optional[ExceededCache]): remember exceeded limit items until their window resets and reject them without calling the storage
+            headers_enabled (bool): add `X-RateLimit-Limit`, `X-RateLimit-Remaining` and `X-RateLimit-Reset` headers to the responses of limited routes
+            circuit_breaker (Optional[CircuitBreaker]): put a timeout on the storage calls and skip the limiter (or reject the requests) while the storage is unavailable
+            metrics (Optional[LimiterMetrics]): instrumentation hooks called with the outcome of every limit and the latency of every storage call
+            global_limits (Optional[List[GlobalLimit]]): limits checked in the middleware before the app is called, for every request under their prefix
+            concurrency (Optional[ConcurrencyBackend]): where the in flight requests of `limit_concurrency` are counted, defaults to `MemoryConcurrency`
+            adaptive (Optional[AdaptiveLimits]): scale the amount of every limit down while the process is saturated, see `AdaptiveLimits`
+            hit_batcher (Optional[HitBatcher]): merge the hits of concurrent requests and send them to the storage together, see `HitBatcher`
+            heavy_hitters (Optional[HeavyHitters]): count the keys of every checked limit to find the ones that send the most requests, see `HeavyHitters`
+            key_compactor (Optional[KeyCompactor]): replace the keys of every limit with a fixed length digest, see `KeyCompactor`
+            websocket_limits (Optional[List[WebSocketLimit]]): limits of the websocket connections and of their messages, see `WebSocketLimit`
+            hit_queue (Optional[HitQueue]): count the hits after the response in the background, the responses don't wait for the storage. see `HitQueue`
+        """
+        self.app = app
         self.strategy = strategy
         self.keys: list[CallableMiddlewareKey] = (
             ensure_list(keys) if keys else ensure_list(get_remote_address)
         )
-        super().__init__(app)
+        self.build_request_keys = compile_key_builder(self.keys)
+        self.atomic = atomic
+        if atomic and not supports_refund(strategy):
+            warnings.warn(
+                f"{type(strategy).__name__} with {type(strategy.storage).__name__} can't refund hits, "
+                "responses in 'no_hit_status_codes' will still be counted in atomic mode",
+                stacklevel=2,
+            )
+        self.exceeded_cache = exceeded_cache
+        self.leases = LeaseManager(strategy, storage_call=self._storage)
+        self.headers_enabled = headers_enabled
+        self.circuit_breaker = circuit_breaker
+        self.metrics = metrics
+        self.global_limits = global_limits or []
+        self.concurrency = (
+            concurrency if concurrency is not None else MemoryConcurrency()
+        )
+        self.adaptive = adaptive
+        self.hit_batcher = hit_batcher
+        self.heavy_hitters = heavy_hitters
+        self.key_compactor = key_compactor
+        self.websocket_limits = websocket_limits or []
+        self.hit_queue = hit_queue
+        if hit_queue is not None:
+            hit_queue.storage_call = self._storage
+        if adaptive is not None and metrics is not None:
+            adaptive.metrics = metrics
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            await self.lifespan(scope, receive, send)
+            return
+        if scope["type"] == "websocket" and self.websocket_limits:
+            await self.websocket(scope, receive, send)
+            return
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
 
-    async def dispatch(
-        self, request: Request, call_next: Callable[[Request], Awaitable[Response]]
-    ) -> Response:
         # just add the limit middleware to the request.state, the dependency on the 'APIRoute' takes care of the rest
-        request.state.limiter = self
-        response = await call_next(request)
+        state: Dict[str, Any] = scope.setdefault("state", {})
+        state["limiter"] = self
+        if self.adaptive is not None:
+            self.adaptive.start()
+            started = time.perf_counter()
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                if self.adaptive is not None:
+                    self.adaptive.observe_latency(time.perf_counter() - started)
+                await self.hit(state, message["status"], message.get("headers"))
+                if self.headers_enabled and "limit_window" in state:
+                    message["headers"] = [
+                        *message.get("headers", ()),
+                        *self.headers(*state["limit_window"]),
+                    ]
+            await send(message)
+
+        if self.global_limits:
+            try:
+                await self.check_global(scope)
+            except HTTPException as exc:
+                # rejected before routing, the response is sent right away
+                response = JSONResponse(
+                    {"detail": exc.detail},
+                    status_code=exc.status_code,
+                    headers=exc.headers,
+                )
+                await response(scope, receive, send_wrapper)
+                return
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if state.get("concurrency_slots"):
+                await self.release_slots(state)
+
+    async def lifespan(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Pass the lifespan of the app through, and call `close` once the app is shut down
+
+        Args:
+            scope (Scope): the ASGI scope of the lifespan
+            receive (Receive): the ASGI receive channel
+            send (Send): the ASGI send channel
+        """
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] in (
+                "lifespan.shutdown.complete",
+                "lifespan.shutdown.failed",
+            ):
+                await self.close()
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def close(self) -> None:
+        """Count the hits that are still waiting and give the unused leased hits back to the storage
+
+        Called when the app shuts down, through its lifespan. call it yourself if the app is served without lifespan events.
+        """
+        if self.hit_queue is not None:
+            await self.hit_queue.flush()
+        if self.hit_batcher is not None:
+            await self.hit_batcher.flush()
+        await self.leases.close()
+        if self.adaptive is not None:
+            await self.adaptive.close()
+
+    async def websocket(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Apply the websocket limits to a websocket connection
+
+        The connection limits are checked before the app is called and hit once the handshake is over.
+            the message limits are counted on every message received, see `count_messages`.
+
+        Args:
+            scope (Scope): the ASGI scope of the connection
+            receive (Receive): the ASGI receive channel
+            send (Send): the ASGI send channel
+        """
+        path = scope["path"]
+        matching = [limit for limit in self.websocket_limits if limit.matches(path)]
+        if not matching:
+            await self.app(scope, receive, send)
+            return
+
+        state: Dict[str, Any] = scope.setdefault("state", {})
+        state["limiter"] = self
+        websocket = WebSocket(scope, receive, send)
+        keys = await self.build_keys(websocket)  # type: ignore[arg-type]
+        connections: List[AppliedLimit] = []
+        counters: List[MessageCounter] = []
+        for limit in matching:
+            limit_keys = [*keys, *await limit.build_keys(websocket)]  # type: ignore[arg-type]
+            if self.key_compactor is not None:
+                limit_keys = self.key_compactor(limit_keys)
+            if limit.messages:
+                counters.append(MessageCounter(limit, limit_keys))
+            else:
+                connections.append(AppliedLimit(limit, limit_keys))
+        if connections:
+            state["websocket_limits"] = connections
+            try:
+                await self.check(state, "websocket_limits")
+            except HTTPException:
+                # rejected before the app is called, the handshake is refused
+                await send({"type": "websocket.close", "code": matching[0].close_code})
+                return
+
+        closed = False
+
+        async def send_wrapper(message: Message) -> None:
+            if closed:
+                return  # the connection was closed by the limiter
+            if "websocket_limits" in state:
+                if message["type"] == "websocket.accept":
+                    await self.hit(state, 101)
+                    del state["websocket_limits"]
+                elif message["type"] in (
+                    "websocket.close",
+                    "websocket.http.response.start",
+                ):
+                    await self.hit(state, message.get("status", 403))
+                    del state["websocket_limits"]
+            await send(message)
+
+        async def receive_wrapper() -> Message:
+            nonlocal closed
+            message = await receive()
+            if message["type"] != "websocket.receive" or closed:
+                return message
+            denied = await self.count_messages(counters)
+            if denied is None:
+                return message
+            closed = True
+            await send(
+                {
+                    "type": "websocket.close",
+                    "code": denied.limit.close_code,
+                    "reason": "Rate limit exceeded",
+                }
+            )
+            return {"type": "websocket.disconnect", "code": denied.limit.close_code}
+
+        try:
+            await self.app(
+                scope, receive_wrapper if counters else receive, send_wrapper
+            )
+        finally:
+            pending = [counter for counter in counters if counter.pending]
+            if pending:
+                with anyio.CancelScope(shield=True):
+                    await self.sync_messages(pending)
+
+    async def count_messages(
+        self, counters: List[MessageCounter]
+    ) -> Optional[MessageCounter]:
+        """Count a message received on a connection, the storage is only called when a counter runs out of its budget
+
+        Args:
+            counters (List[MessageCounter]): the message counters of the connection
+
+        Returns:
+            Optional[MessageCounter]: the counter whose limit is exceeded, if any
+        """
+        due = []
+        for counter in counters:
+            counter.pending += 1
+            if counter.pending >= counter.budget:
+                due.append(counter)
+        if not due:
+            return None
+        return await self.sync_messages(due)
+
+    async def sync_messages(
+        self, counters: List[MessageCounter]
+    ) -> Optional[MessageCounter]:
+        """Hit the pending messages of counters in the storage, with concurrent storage calls
+
+        Args:
+            counters (List[MessageCounter]): the message counters to hit
+
+        Returns:
+            Optional[MessageCounter]: the first counter whose limit is exceeded, if any
+        """
+        try:
+            windows = await self._storage(
+                "hit",
+                batch_hit,
+                self.strategy,
+                [
+                    (self._effective(counter.limit.item), counter.keys)
+                    for counter in counters
+                ],
+                [counter.pending for counter in counters],
+            )
+        except StorageUnavailable:
+            if self.circuit_breaker is None or self.circuit_breaker.fail_open:
+                windows = [WindowState(True)] * len(counters)
+            else:
+                return counters[0]
+        denied = None
+        for counter, window in zip(counters, windows):
+            counter.update(window)
+            if not window.allowed and denied is None:
+                denied = counter
+        if denied is not None and self.metrics is not None:
+            self.metrics.decision(denied.limit.item, denied.keys, DENIED)
+        return denied
+
+    async def acquire(self, state: Dict[str, Any], key: str, limit: int) -> None:
+        """Take a concurrency slot of a key for a request, it's released by `release_slots` once the request is over
+
+        Args:
+            state (Dict[str, Any]): the request state (`scope["state"]`)
+            key (str): the concurrency key
+            limit (int): number of slots of the key
+
+        Raises:
+            ConcurrencyLimitExceeded: when all the slots of the key are taken
+            RateLimiterUnavailable: if the backend is unavailable and the circuit breaker fails closed
+        """
+        if not self.concurrency.remote:
+            token = await self.concurrency.acquire(key, limit)
+        else:
+            try:
+                token = await self._storage(
+                    "acquire", self.concurrency.acquire, key, limit
+                )
+            except StorageUnavailable:
+                if self.circuit_breaker is None or self.circuit_breaker.fail_open:
+                    return
+                raise RateLimiterUnavailable(
+                    retry_after=self.circuit_breaker.retry_after
+                )
+        if token is None:
+            raise ConcurrencyLimitExceeded(limit)
+        state.setdefault("concurrency_slots", []).append((key, token))
+
+    async def release_slots(self, state: Dict[str, Any]) -> None:
+        """Give back the concurrency slots of a request, even if the request was cancelled
+
+        Args:
+            state (Dict[str, Any]): the request state (`scope["state"]`)
+        """
+        slots: List[Tuple[str, str]] = state.pop("concurrency_slots")
+        if not self.concurrency.remote:
+            for key, token in slots:
+                await self.concurrency.release(key, token)
+            return
+        with anyio.CancelScope(shield=True):
+            for key, token in slots:
+                try:
+                    await self._storage("release", self.concurrency.release, key, token)
+                except StorageUnavailable:
+                    pass  # the slot is freed when its lease expires
+
+    async def check_global(self, scope: Scope) -> None:
+        """Check the global limits that apply to the path of a request, see `check`
+
+        Args:
+            scope (Scope): the ASGI scope of the request, its `state` holds the limiter
+
+        Raises:
+            RateLimitExceeded: for the first global limit that is exceeded
+            RateLimiterUnavailable: if the storage is unavailable and the circuit breaker fails closed
+        """
+        path = scope["path"]
+        matching = [limit for limit in self.global_limits if limit.matches(path)]
+        if not matching:
+            return
+        request = Request(scope)
+        keys = await self.build_keys(request)
+        state = scope["state"]
+        applied = []
+        for limit in matching:
+            limit_keys = [*keys, *await limit.build_keys(request)]
+            if self.key_compactor is not None:
+                limit_keys = self.key_compactor(limit_keys)
+            applied.append(AppliedLimit(limit, limit_keys))
+        state["global_limits"] = applied
+        await self.check(state, "global_limits")
+
+    async def build_keys(self, request: Request) -> List[str]:
+        """Middleware level keys of a request, they are built once and shared by all the limits of the request
+
+        Args:
+            request (Request): request object from FastAPI
+
+        Returns:
+            List[str]: a list containing string keys from the middleware key functions
+        """
+        state = request.scope["state"]
+        keys: Optional[List[str]] = state.get("limit_middleware_keys")
+        if keys is None:
+            keys = state["limit_middleware_keys"] = await self.build_request_keys(
+                request
+            )
+        return keys
+
+    async def check(self, state: Dict[str, Any], name: str = "limits") -> None:
+        """Check all the limits that apply to a request with concurrent storage calls
+
+        In atomic mode the hits are consumed as well, if any limit is exceeded the others are refunded.
+            leased limits are always consumed from their local lease.
+
+        Args:
+            state (Dict[str, Any]): the request state (`scope["state"]`), the registered limits are cleared if a limit is exceeded
+            name (str): the key of the limits in the state, `"limits"` for the route limits and `"global_limits"` for the global limits
+
+        Raises:
+            RateLimitExceeded: for the first limit that is exceeded
+            RateLimiterUnavailable: if the storage is unavailable and the circuit breaker fails closed
+        """
+        limits: Optional[List[AppliedLimit]] = state.get(name)
+        if not limits:
+            return
+        if self.heavy_hitters is not None:
+            for limit in limits:
+                self.heavy_hitters.add(limit.dependency.item, limit.keys)
+        if self.exceeded_cache is not None:
+            for limit in limits:
+                item = self._effective(limit.dependency.item)
+                expires_at = self.exceeded_cache.get(item, limit.keys)
+                if expires_at is not None:
+                    limits.clear()
+                    if self.metrics is not None:
+                        self.metrics.decision(limit.dependency.item, limit.keys, DENIED)
+                    state["limit_window"] = (item, WindowState(False, 0, expires_at))
+                    raise RateLimitExceeded(
+                        limit=item,
+                        detail=f"Rate limit exceeded: {item}",
+                        reset_time=expires_at,
+                    )
+
+        windows = [WindowState(True)] * len(limits)
+        stored = [i for i, limit in enumerate(limits) if limit.dependency.lease is None]
+        consumed: List[AppliedLimit] = []  # given back if the storage fails halfway
+        try:
+            if stored:
+                pairs = [
+                    (self._effective(limits[i].dependency.item), limits[i].keys)
+                    for i in stored
+                ]
+                stored_windows = await self._storage(
+                    "hit" if self.atomic else "test",
+                    batch_hit if self.atomic else batch_test,
+                    self.strategy,
+                    pairs,
+                    [limits[i].cost for i in stored],
+                )
+                for i, window in zip(stored, stored_windows):
+                    windows[i] = window
+                    if window.allowed:
+                        consumed.append(limits[i])
+            for i, limit in enumerate(limits):
+                if limit.dependency.lease is not None:
+                    # a refill of the lease goes through the circuit breaker as well
+                    windows[i] = WindowState(
+                        await self.leases.consume(
+                            limit.dependency.item,
+                            limit.keys,
+                            limit.dependency.lease,
+                            limit.cost,
+                        )
+                    )
+                    if windows[i].allowed:
+                        consumed.append(limit)
+        except StorageUnavailable:
+            if consumed:
+                await self._release(consumed)
+            limits.clear()  # the limiter is skipped for this request
+            if self.circuit_breaker is None or self.circuit_breaker.fail_open:
+                return
+            raise RateLimiterUnavailable(retry_after=self.circuit_breaker.retry_after)
+        denied = next(
+            (i for i, window in enumerate(windows) if not window.allowed), None
+        )
+        if denied is None:
+            if self.headers_enabled:
+                state["limit_window"] = self._closest_window(
+                    [self._effective(limit.dependency.item) for limit in limits],
+                    windows,
+                )
+            return
+
+        await self._release(
+            [limit for limit, window in zip(limits, windows) if window.allowed]
+        )
+        keys = limits[denied].keys
+        item = self._effective(limits[denied].dependency.item)
+        window = windows[denied]
+        if self.metrics is not None:
+            self.metrics.decision(limits[denied].dependency.item, keys, DENIED)
+        limits.clear()  # a rejected request is not counted
+        if self.exceeded_cache is not None:
+            if window.reset_time is None:
+                try:
+                    stats = await self._storage(
+                        "window_stats", self.strategy.get_window_stats, item, *keys
+                    )
+                    window = window._replace(reset_time=stats.reset_time)
+                except StorageUnavailable:
+                    pass
+            if window.reset_time is not None:
+                self.exceeded_cache.add(item, keys, window.reset_time)
+        state["limit_window"] = (item, window._replace(remaining=0))
+        raise RateLimitExceeded(
+            limit=item,
+            detail=f"Rate limit exceeded: {item}",
+            reset_time=window.reset_time,
+        )
+
+    async def hit(
+        self,
+        state: Dict[str, Any],
+        status_code: int,
+        headers: Optional[List[Tuple[bytes, bytes]]] = None,
+    ) -> None:
+        """Count a hit for the limits that were checked during this request, if any
+
+        Hits that were already consumed by `check` (atomic mode or leased limits) are refunded if the status code is excluded,
+            and adjusted to the final cost of the limits whose cost depends on the response.
+
+        Args:
+            state (Dict[str, Any]): the request state (`scope["state"]`)
+            status_code (int): the response status code
+            headers (Optional[List[Tuple[bytes, bytes]]]): the raw response headers, for the cost functions that take the response
+        """
+        limits: List[AppliedLimit] = state.get("limits") or []
+        global_limits: Optional[List[AppliedLimit]] = state.get(
+            "global_limits", state.get("websocket_limits")
+        )
+        if global_limits:
+            limits = [*global_limits, *limits]
+        if not limits:
+            return
+        excluded = [
+            limit
+            for limit in limits
+            if status_code in limit.dependency.no_hit_status_codes
+        ]
+        if self.metrics is not None:
+            for limit in limits:
+                self.metrics.decision(
+                    limit.dependency.item,
+                    limit.keys,
+                    (
+                        EXCLUDED
+                        if status_code in limit.dependency.no_hit_status_codes
+                        else ALLOWED
+                    ),
+                )
+        if excluded:
+            await self._release(excluded)
+        counted = [
+            limit
+            for limit in limits
+            if status_code not in limit.dependency.no_hit_status_codes
+        ]
+        if any(limit.response_cost is not None for limit in counted):
+            counted = await self._response_costs(counted, status_code, headers or [])
+        if self.atomic:
+            return
+        hit = [limit for limit in counted if limit.dependency.lease is None]
+        if hit and self.hit_queue is not None:
+            await self.hit_queue.put(
+                self.strategy,
+                [(self._effective(limit.dependency.item), limit.keys) for limit in hit],
+                [limit.cost for limit in hit],
+            )
+        elif hit:
+            try:
+                windows = await self._storage(
+                    "hit",
+                    batch_hit if self.hit_batcher is None else self.hit_batcher.hit,
+                    self.strategy,
+                    [
+                        (self._effective(limit.dependency.item), limit.keys)
+                        for limit in hit
+                    ],
+                    [limit.cost for limit in hit],
+                )
+            except StorageUnavailable:
+                return  # the response is already on its way, the hit is lost
+            if self.headers_enabled:
+                # the check already read the window, only replace it with a hit that reports one too
+                known = [
+                    (self._effective(limit.dependency.item), window)
+                    for limit, window in zip(hit, windows)
+                    if window.remaining is not None
+                ]
+                if known:
+                    state["limit_window"] = self._closest_window(
+                        [item for item, _ in known], [window for _, window in known]
+                    )
+
+    async def _response_costs(
+        self,
+        limits: List[AppliedLimit],
+        status_code: int,
+        headers: List[Tuple[bytes, bytes]],
+    ) -> List[AppliedLimit]:
+        """Replace the cost of the limits that depend on the response with their final cost
+
+        The hits that were already consumed by `check` (atomic mode or leased limits) are adjusted to the final cost right away.
+        """
+        response = Response(status_code=status_code)
+        response.raw_headers = list(headers)
+        result = []
+        extra: List[AppliedLimit] = []
+        refunds: List[AppliedLimit] = []
+        for limit in limits:
+            if limit.response_cost is not None:
+                cost = await limit.response_cost(response)
+                if self.atomic or limit.dependency.lease is not None:
+                    if cost > limit.cost:
+                        extra.append(limit._replace(cost=cost - limit.cost))
+                    elif cost < limit.cost:
+                        refunds.append(limit._replace(cost=limit.cost - cost))
+                limit = limit._replace(cost=cost, response_cost=None)
+            result.append(limit)
+        if refunds:
+            await self._release(refunds)
+        for limit in extra:
+            if limit.dependency.lease is not None:
+                try:
+                    await self.leases.consume(
+                        limit.dependency.item,
+                        limit.keys,
+                        limit.dependency.lease,
+                        limit.cost,
+                    )
+                except StorageUnavailable:
+                    pass  # the response is already on its way, the hits are lost
+        stored = [limit for limit in extra if limit.dependency.lease is None]
+        if stored:
+            # the response is already allowed, the rest of the cost is counted even over the limit
+            try:
+                await self._storage(
+                    "hit",
+                    batch_hit,
+                    self.strategy,
+                    [
+                        (self._effective(limit.dependency.item), limit.keys)
+                        for limit in stored
+                    ],
+                    [limit.cost for limit in stored],
+                )
+            except StorageUnavailable:
+                pass
+        return result
+
+    def headers(
+        self, item: RateLimitItem, window: WindowState
+    ) -> List[Tuple[bytes, bytes]]:
+        """Rate limit headers of a response
+
+        Args:
+            item (RateLimitItem): the limit to report
+            window (WindowState): the state of its window, an unknown reset time is reported as a whole window from now
+
+        Returns:
+            List[Tuple[bytes, bytes]]: raw ASGI headers, only `X-RateLimit-Limit` when the window state is unknown
+        """
+        if window.remaining is None and window.reset_time is None:
+            # the strategy didn't report its window, reading it would cost another round trip
+            return [(b"x-ratelimit-limit", str(item.amount).encode())]
+        reset_time = (
+            window.reset_time
+            if window.reset_time is not None
+            else time.time() + item.get_expiry()
+        )
+        headers = [
+            (b"x-ratelimit-limit", str(item.amount).encode()),
+            (b"x-ratelimit-reset", str(math.ceil(reset_time)).encode()),
+        ]
+        if window.remaining is not None:
+            headers.append((b"x-ratelimit-remaining", str(window.remaining).encode()))
+        return headers
+
+    @staticmethod
+    def _closest_window(
+        items: List[RateLimitItem], windows: List[WindowState]
+    ) -> Tuple[RateLimitItem, WindowState]:
+        """The limit that is closest to being exceeded, the one with the least hits remaining"""
+        return min(
+            zip(items, windows),
+            key=lambda pair: (
+                pair[1].remaining if pair[1].remaining is not None else math.inf
+            ),
+        )
+
+    def _effective(self, item: RateLimitItem) -> RateLimitItem:
+        """The limit item that is checked, scaled by the adaptive multiplier if any"""
+        if self.adaptive is None:
+            return item
+        return self.adaptive.scale(item)
+
+    async def _release(self, limits: List[AppliedLimit]) -> None:
+        """Give back the hits of `limits` that were consumed by `check`"""
+        refunds = []
+        for limit in limits:
+            if limit.dependency.lease is not None:
+                self.leases.release(limit.dependency.item, limit.keys, limit.cost)
+            elif self.atomic:
+                refunds.append(limit)
+        if refunds:
+            try:
+                await self._storage(
+                    "refund",
+                    batch_refund,
+                    self.strategy,
+                    [(limit.dependency.item, limit.keys) for limit in refunds],
+                    [limit.cost for limit in refunds],
+                )
+            except StorageUnavailable:
+                pass
+
+    async def _storage(
+        self, operation: str, func: Callable[..., Awaitable[T]], *args: Any
+    ) -> T:
+        """Call the storage through the circuit breaker, if any, and time the call"""
+        if self.metrics is None:
+            if self.circuit_breaker is None:
+                return await func(*args)
+            return await self.circuit_breaker.call(func, *args)
+        start = time.perf_counter()
         try:
-            limit: "BaseLimiterDependency" = request.state.limit
-            limit_keys: list[str] = request.state.limit_keys
-        except AttributeError:
-            return response
-        if (
-            limit.no_hit_status_codes
-            and response.status_code in limit.no_hit_status_codes
-        ):
-            return response
-
-        await self.strategy.hit(
-            limit.item,
-            *limit_keys,
-        )
-        return response
+            if self.circuit_breaker is None:
+                return await func(*args)
+            return await self.circuit_breaker.call(func, *args)
+        finally:
+            self.metrics.storage_call(operation, time.perf_counter() - start)
@@ -0,0 +1,308 @@
+from array import array
+from typing import Dict, Hashable, List, NamedTuple, Optional, Sequence, Tuple
+
+from limits import RateLimitItem
+
+
+class CountMinSketch:
+    """
+    Approximate counters of any number of keys in `width * depth` integers.
+
+    Every key is counted in one cell of each row, its estimate is the smallest of its cells. an estimate is never
+        lower than the real count, and is higher by at most `2 / width` of the total count with a probability of
+        `1 - 2 ** -depth`.
+    """
+
+    __slots__ = ("width", "depth", "mask", "cells", "total")
+
+    def __init__(self, width: int = 2048, depth: int = 4) -> None:
+        """CountMinSketch
+
+        Args:
+            width (int): cells per row, a power of two
+            depth (int): number of rows
+        """
+        if width <= 0 or width & (width - 1):
+            raise ValueError("width must be a power of two")
+        if depth <= 0:
+            raise ValueError("depth must be a positive number")
+        self.width = width
+        self.depth = depth
+        self.mask = width - 1
+        self.cells = array("q", bytes(8 * width * depth))
+        self.total = 0
+
+    def add(self, key: Hashable, amount: int = 1) -> int:
+        """Count a key
+
+        Args:
+            key (Hashable): the key
+            amount (int): the number to add to its count
+
+        Returns:
+            int: the estimate of the key after the update
+        """
+        h = hash(key)
+        step = (h >> 16) | 1  # odd, so the rows use different cells
+        cells = self.cells
+        estimate = -1
+        offset = 0
+        for _ in range(self.depth):
+            index = offset + (h & self.mask)
+            value = cells[index] + amount
+            cells[index] = value
+            if estimate < 0 or value < estimate:
+                estimate = value
+            h += step
+            offset += self.width
+        self.total += amount
+        return estimate
+
+    def estimate(self, key: Hashable) -> int:
+        """The estimated count of a key, never lower than its real count"""
+        h = hash(key)
+        step = (h >> 16) | 1
+        estimate = -1
+        offset = 0
+        for _ in range(self.depth):
+            value = self.cells[offset + (h & self.mask)]
+            if estimate < 0 or value < estimate:
+                estimate = value
+            h += step
+            offset += self.width
+        return estimate
+
+    def clear(self) -> None:
+        """Reset all the counters"""
+        self.cells = array("q", bytes(8 * self.width * self.depth))
+        self.total = 0
+
+
+class _Bucket:
+    """The keys of a `SpaceSaving` summary that have the same count, in a list sorted by count"""
+
+    __slots__ = ("count", "keys", "prev", "next")
+
+    def __init__(self, count: int) -> None:
+        self.count = count
+        #: key to its maximum overestimation
+        self.keys: Dict[Hashable, int] = {}
+        self.prev: Optional["_Bucket"] = None
+        self.next: Optional["_Bucket"] = None
+
+
+class SpaceSaving:
+    """
+    The `capacity` most frequent keys of a stream, with the Space-Saving algorithm.
+
+    A new key replaces the key with the smallest count when the summary is full, and takes over its count, so the
+        count of a key can be overestimated by at most the count it took over (its error). the keys are kept in
+        buckets of equal counts (a stream summary), an update is O(1) and reuses the buckets instead of allocating
+        new ones.
+    """
+
+    __slots__ = ("capacity", "entries", "head", "_free")
+
+    def __init__(self, capacity: int = 20) -> None:
+        """SpaceSaving
+
+        Args:
+            capacity (int): number of keys to keep
+        """
+        if capacity <= 0:
+            raise ValueError("capacity must be a positive number")
+        self.capacity = capacity
+        self.entries: Dict[Hashable, _Bucket] = {}
+        self.head: Optional[_Bucket] = None  # the bucket with the smallest count
+        # emptied buckets, reused for the next new counts
+        self._free: List[_Bucket] = []
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, key: Hashable) -> None:
+        """Count one occurrence of a key"""
+        bucket = self.entries.get(key)
+        if bucket is not None:
+            if self._bump(bucket):
+                return
+            error = bucket.keys[key]
+            self._place(key, self._remove(key, bucket), bucket.count + 1, error)
+        elif len(self.entries) < self.capacity:
+            self._place(key, None, 1, 0)
+        else:
+            head = self.head
+            assert head is not None
+            evicted = next(iter(head.keys))
+            del self.entries[evicted]
+            if self._bump(head):
+                # the new key takes the place of the evicted one
+                del head.keys[evicted]
+                head.keys[key] = head.count - 1
+                self.entries[key] = head
+                return
+            self._place(key, self._remove(evicted, head), head.count + 1, head.count)
+
+    def top(self, n: Optional[int] = None) -> List[Tuple[Hashable, int, int]]:
+        """The most frequent keys
+
+        Args:
+            n (Optional[int]): number of keys to return, all of them by default
+
+        Returns:
+            List[Tuple[Hashable, int, int]]: `(key, count, error)` tuples, the most frequent first
+        """
+        result = sorted(
+            (
+                (key, bucket.count, bucket.keys[key])
+                for key, bucket in self.entries.items()
+            ),
+            key=lambda entry: entry[1],
+            reverse=True,
+        )
+        return result if n is None else result[:n]
+
+    def _bump(self, bucket: _Bucket) -> bool:
+        """Increment the count of a bucket with a single key in place, if no bucket has the next count already"""
+        if len(bucket.keys) != 1:
+            return False
+        following = bucket.next
+        if following is not None and following.count == bucket.count + 1:
+            return False
+        bucket.count += 1
+        return True
+
+    def _remove(self, key: Hashable, bucket: _Bucket) -> Optional[_Bucket]:
+        """Take a key out of its bucket, returns the bucket a higher count goes after"""
+        del bucket.keys[key]
+        if bucket.keys:
+            return bucket
+        prev, following = bucket.prev, bucket.next
+        if prev is not None:
+            prev.next = following
+        else:
+            self.head = following
+        if following is not None:
+            following.prev = prev
+        bucket.prev = bucket.next = None
+        self._free.append(bucket)
+        return prev
+
+    def _place(
+        self, key: Hashable, after: Optional[_Bucket], count: int, error: int
+    ) -> None:
+        """Put a key in the bucket of `count`, which is right after `after` (or first if `None`)"""
+        following = after.next if after is not None else self.head
+        if following is not None and following.count == count:
+            bucket = following
+        else:
+            if self._free:
+                bucket = self._free.pop()
+                bucket.count = count
+            else:
+                bucket = _Bucket(count)
+            bucket.prev = after
+            bucket.next = following
+            if after is not None:
+                after.next = bucket
+            else:
+                self.head = bucket
+            if following is not None:
+                following.prev = bucket
+        bucket.keys[key] = error
+        self.entries[key] = bucket
+
+
+class HeavyHitter(NamedTuple):
+    #: the storage key of the limit item and its keys, like `"LIMITER/127.0.0.1/get_items/5/1/minute"`
+    key: str
+    #: estimated number of requests, never lower than the real number
+    hits: int
+    #: `hits` can be overestimated by at most this much
+    error: int
+
+
+class HeavyHitters:
+    """
+    Finds the keys that send the most requests to each limit item, in fixed memory.
+
+    Every key is counted in a `CountMinSketch` and the most frequent ones are kept in a `SpaceSaving` summary,
+        per limit item. the reported count of a key is the smaller of the two estimates, both of them can only
+        overestimate it.
+
+    ```py
+    heavy_hitters = HeavyHitters(top_k=20)
+    app.add_middleware(RateLimitingMiddleware, strategy=..., heavy_hitters=heavy_hitters)
+    ...
+    heavy_hitters.snapshot()
+    ```
+    """
+
+    def __init__(self, top_k: int = 20, width: int = 2048, depth: int = 4) -> None:
+        """HeavyHitters
+
+        Args:
+            top_k (int): number of keys to keep for each limit item
+            width (int): cells per row of the count-min sketches, a power of two
+            depth (int): rows of the count-min sketches
+        """
+        self.top_k = top_k
+        self.width = width
+        self.depth = depth
+        self._items: Dict[RateLimitItem, Tuple[CountMinSketch, SpaceSaving]] = {}
+
+    def add(self, item: RateLimitItem, keys: Sequence[str]) -> None:
+        """Count a request of a limit item
+
+        Args:
+            item (RateLimitItem): the rate limit item
+            keys (Sequence[str]): keys of the limit item
+        """
+        tracker = self._items.get(item)
+        if tracker is None:
+            tracker = self._items[item] = (
+                CountMinSketch(self.width, self.depth),
+                SpaceSaving(self.top_k),
+            )
+        # a string caches its hash, the sketch and the summary hash the same key
+        key = item.key_for(*keys)
+        tracker[0].add(key)
+        tracker[1].add(key)
+
+    def top(self, item: RateLimitItem, n: Optional[int] = None) -> List[HeavyHitter]:
+        """The keys that sent the most requests to a limit item
+
+        Args:
+            item (RateLimitItem): the rate limit item
+            n (Optional[int]): number of keys to return, `top_k` by default
+
+        Returns:
+            List[HeavyHitter]: the most frequent keys first
+        """
+        tracker = self._items.get(item)
+        if tracker is None:
+            return []
+        sketch, summary = tracker
+        result = []
+        for key, count, error in summary.top(n):
+            estimate = min(count, sketch.estimate(key))
+            result.append(
+                HeavyHitter(key, estimate, min(error, estimate))  # type: ignore[arg-type]
+            )
+        result.sort(key=lambda hitter: hitter.hits, reverse=True)
+        return result
+
+    def snapshot(self, n: Optional[int] = None) -> Dict[str, List[HeavyHitter]]:
+        """The heavy hitters of every limit item
+
+        Args:
+            n (Optional[int]): number of keys to return for each limit item, `top_k` by default
+
+        Returns:
+            Dict[str, List[HeavyHitter]]: the heavy hitters by limit item, like `"5 per 1 minute"`
+        """
+        return {str(item): self.top(item, n) for item in list(self._items)}
+
+    def clear(self) -> None:
+        """Forget all the counts, for example at the start of every period to report"""
+        self._items.clear()
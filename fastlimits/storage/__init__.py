@@ -0,0 +1,13 @@
+from .memory import ShardedMemoryStorage
+from .sketch import SketchStorage
+
+try:
+    from .shared import SharedMemoryStorage
+except ImportError:  # pragma: no cover
+    pass  # `fcntl` is only available on unix
+
+__all__ = [
+    "ShardedMemoryStorage",
+    "SharedMemoryStorage",
+    "SketchStorage",
+]
@@ -0,0 +1,368 @@
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Deque, List, Optional, Set, Tuple, Type, Union
+
+from limits.aio.storage import MovingWindowSupport, Storage
+
+
+class CounterEntry:
+    """
+    The state of a single rate limit key: a fixed window counter or the timestamps of a moving window.
+    """
+
+    __slots__ = ("key", "count", "expires_at", "events", "slot")
+
+    def __init__(self, key: str, expires_at: float) -> None:
+        self.key = key
+        self.count = 0
+        self.expires_at = expires_at
+        #: moving window entries, oldest first
+        self.events: Optional[Deque[float]] = None
+        #: the timer wheel slot the entry is scheduled in
+        self.slot: Optional[Set["CounterEntry"]] = None
+
+
+class TimerWheel:
+    """
+    A hierarchical timer wheel, scheduling and expiring an entry are O(1).
+
+    Level `n` has `slots` slots of `resolution * slots ** n` seconds each. entries are scheduled in the lowest level
+        that covers their expiry and cascade down as the wheel turns. an entry is fired at the latest one
+        `resolution` after its expiry, the caller checks if it's really expired since its expiry might have moved.
+    """
+
+    __slots__ = ("resolution", "bits", "mask", "levels", "current")
+
+    def __init__(
+        self, now: float, resolution: float = 1.0, slots: int = 64, levels: int = 4
+    ) -> None:
+        """TimerWheel
+
+        Args:
+            now (float): the current time
+            resolution (float): seconds per slot of the first level
+            slots (int): slots per level, a power of two
+            levels (int): number of levels, entries further than `resolution * slots ** levels` seconds are rescheduled when they fire
+        """
+        if slots & (slots - 1):
+            raise ValueError("slots must be a power of two")
+        self.resolution = resolution
+        self.bits = slots.bit_length() - 1
+        self.mask = slots - 1
+        self.levels: List[List[Set[CounterEntry]]] = [
+            [set() for _ in range(slots)] for _ in range(levels)
+        ]
+        self.current = int(now / resolution)
+
+    def schedule(self, entry: CounterEntry) -> None:
+        """Schedule an entry to fire at its `expires_at`"""
+        tick = max(math.ceil(entry.expires_at / self.resolution), self.current + 1)
+        delta = tick - self.current
+        for level, slots in enumerate(self.levels):
+            if delta < 1 << (self.bits * (level + 1)) or level == len(self.levels) - 1:
+                if level == len(self.levels) - 1:
+                    # too far away, fire at the end of the range and schedule again
+                    tick = min(
+                        tick, self.current + (1 << (self.bits * (level + 1))) - 1
+                    )
+                entry.slot = slots[(tick >> (self.bits * level)) & self.mask]
+                entry.slot.add(entry)
+                return
+
+    def cancel(self, entry: CounterEntry) -> None:
+        """Remove a scheduled entry"""
+        if entry.slot is not None:
+            entry.slot.discard(entry)
+            entry.slot = None
+
+    def advance(self, now: float) -> List[CounterEntry]:
+        """Turn the wheel up to `now`
+
+        Returns:
+            List[CounterEntry]: the entries that are due
+        """
+        target = int(now / self.resolution)
+        due: List[CounterEntry] = []
+        if target <= self.current:
+            return due
+        if target - self.current >= 1 << (self.bits * len(self.levels)):
+            # the wheel wasn't turned for a whole range, every entry is a candidate
+            for slots in self.levels:
+                for slot in slots:
+                    due.extend(slot)
+                    slot.clear()
+            self.current = target
+            for entry in due:
+                entry.slot = None
+            return due
+
+        first = self.levels[0]
+        while self.current < target:
+            self.current += 1
+            index = self.current & self.mask
+            if index == 0:
+                due.extend(self._cascade())
+            due.extend(first[index])
+            first[index].clear()
+        for entry in due:
+            entry.slot = None
+        return due
+
+    def _cascade(self) -> List[CounterEntry]:
+        """Move the entries of the higher level slots that start at the current tick to the lower levels"""
+        due = []
+        for level in range(1, len(self.levels)):
+            index = (self.current >> (self.bits * level)) & self.mask
+            slot = self.levels[level][index]
+            entries = list(slot)
+            slot.clear()
+            for entry in entries:
+                if entry.expires_at <= self.current * self.resolution:
+                    # due at the current tick, its slot is already being fired
+                    due.append(entry)
+                else:
+                    self.schedule(entry)
+            if index != 0:
+                break
+        return due
+
+
+class Shard:
+    """
+    A part of the keys of a `ShardedMemoryStorage`, with its own lock, LRU order and timer wheel.
+    """
+
+    __slots__ = ("lock", "entries", "wheel", "max_entries")
+
+    def __init__(self, max_entries: int, now: float, resolution: float) -> None:
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, CounterEntry]" = OrderedDict()
+        self.wheel = TimerWheel(now, resolution)
+        self.max_entries = max_entries
+
+    def expire(self, now: float) -> None:
+        """Remove the expired entries that are due on the timer wheel"""
+        for entry in self.wheel.advance(now):
+            if entry.expires_at <= now:
+                del self.entries[entry.key]
+            else:
+                self.wheel.schedule(entry)
+
+    def get(self, key: str, now: float) -> Optional[CounterEntry]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= now:
+            self.remove(entry)
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def create(self, key: str, expires_at: float) -> CounterEntry:
+        entry = self.entries[key] = CounterEntry(key, expires_at)
+        self.wheel.schedule(entry)
+        while len(self.entries) > self.max_entries:
+            _, evicted = self.entries.popitem(last=False)  # the least recently used key
+            self.wheel.cancel(evicted)
+        return entry
+
+    def remove(self, entry: CounterEntry) -> None:
+        del self.entries[entry.key]
+        self.wheel.cancel(entry)
+
+
+class ShardedMemoryStorage(Storage, MovingWindowSupport):
+    """
+    An in-process storage for the fixed window and moving window strategies, with a bounded number of keys.
+
+    The keys are spread over `shards` by their hash, each shard has its own lock, least recently used order
+        and timer wheel, so the work done by each call only depends on its own shard. when a shard is full the least
+        recently used key is evicted, and expired keys are removed by the timer wheel even if they are never used again.
+
+    ```py
+    from fastlimits.storage import ShardedMemoryStorage
+    from limits.aio.strategies import FixedWindowRateLimiter
+
+    limiter = FixedWindowRateLimiter(storage=ShardedMemoryStorage(max_entries=1_000_000))
+    ```
+    """
+
+    STORAGE_SCHEME = ["async+fastlimits-memory"]
+
+    def __init__(
+        self,
+        uri: Optional[str] = None,
+        wrap_exceptions: bool = False,
+        shards: int = 16,
+        max_entries: int = 1_000_000,
+        resolution: float = 1.0,
+        **options: str,
+    ) -> None:
+        """ShardedMemoryStorage
+
+        Args:
+            uri (Optional[str]): unused, for `limits.storage.storage_from_string`
+            wrap_exceptions (bool): wrap the exceptions in `limits.errors.StorageError`
+            shards (int): number of shards
+            max_entries (int): maximum number of keys, across all the shards
+            resolution (float): seconds per slot of the timer wheels, expired keys are removed at most this late
+        """
+        shards = int(shards)
+        max_entries = int(max_entries)
+        if shards <= 0 or max_entries < shards:
+            raise ValueError("max_entries must be at least the number of shards")
+        now = time.time()
+        self.shards = [
+            Shard(max_entries // shards, now, float(resolution)) for _ in range(shards)
+        ]
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(
+        self,
+    ) -> Union[Type[Exception], Tuple[Type[Exception], ...]]:  # pragma: no cover
+        return ValueError
+
+    def __len__(self) -> int:
+        return sum(len(shard.entries) for shard in self.shards)
+
+    def _shard(self, key: str) -> Shard:
+        return self.shards[hash(key) % len(self.shards)]
+
+    def expires_at(self, key: str) -> Optional[float]:
+        """The time (seconds since the epoch) a key expires at, without awaiting
+
+        Args:
+            key (str): the rate limit key
+
+        Returns:
+            Optional[float]: `None` if the key doesn't exist
+        """
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.get(key, time.time())
+            return entry.expires_at if entry is not None else None
+
+    async def incr(
+        self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1
+    ) -> int:
+        """Increment the counter of a key, its window starts with the first hit
+
+        Args:
+            key (str): the rate limit key
+            expiry (int): seconds until the window of the key expires
+            elastic_expiry (bool): extend the window on every hit
+            amount (int): the number to increment by
+
+        Returns:
+            int: the counter after the increment
+        """
+        now = time.time()
+        shard = self._shard(key)
+        with shard.lock:
+            shard.expire(now)
+            entry = shard.get(key, now)
+            if entry is None:
+                entry = shard.create(key, now + expiry)
+            elif elastic_expiry:
+                # the wheel reschedules it when the old expiry fires
+                entry.expires_at = now + expiry
+            entry.count += amount
+            return entry.count
+
+    async def get(self, key: str) -> int:
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.get(key, time.time())
+            return entry.count if entry is not None else 0
+
+    async def get_expiry(self, key: str) -> int:
+        expires_at = self.expires_at(key)
+        return int(expires_at if expires_at is not None else time.time())
+
+    async def clear(self, key: str) -> None:
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.entries.get(key)
+            if entry is not None:
+                shard.remove(entry)
+
+    async def check(self) -> bool:
+        return True
+
+    async def reset(self) -> Optional[int]:
+        count = 0
+        now = time.time()
+        for shard in self.shards:
+            with shard.lock:
+                count += len(shard.entries)
+                shard.entries.clear()
+                shard.wheel = TimerWheel(now, shard.wheel.resolution)
+        return count
+
+    def _window(
+        self, shard: Shard, key: str, expiry: int, now: float
+    ) -> Optional[CounterEntry]:
+        entry = shard.get(key, now)
+        if entry is not None and entry.events is not None:
+            events = entry.events
+            while events and events[0] <= now - expiry:
+                events.popleft()
+        return entry
+
+    async def acquire_entry(
+        self, key: str, limit: int, expiry: int, amount: int = 1
+    ) -> bool:
+        """Add `amount` entries to the moving window of a key, if there is room for them
+
+        Args:
+            key (str): the rate limit key
+            limit (int): number of entries allowed in the window
+            expiry (int): length of the window in seconds
+            amount (int): number of entries to add
+
+        Returns:
+            bool: `False` if there was no room
+        """
+        if amount > limit:
+            return False
+        now = time.time()
+        shard = self._shard(key)
+        with shard.lock:
+            shard.expire(now)
+            entry = self._window(shard, key, expiry, now)
+            if entry is None:
+                entry = shard.create(key, now + expiry)
+            if entry.events is None:
+                entry.events = deque()
+            if len(entry.events) + amount > limit:
+                return False
+            entry.events.extend([now] * amount)
+            entry.count = len(entry.events)
+            entry.expires_at = now + expiry
+            return True
+
+    async def get_moving_window(
+        self, key: str, limit: int, expiry: int
+    ) -> Tuple[int, int]:
+        """The start of the moving window of a key and the number of entries in it"""
+        now = time.time()
+        shard = self._shard(key)
+        with shard.lock:
+            entry = self._window(shard, key, expiry, now)
+            if entry is None or not entry.events:
+                return int(now), 0
+            return int(entry.events[0]), len(entry.events)
+
+    async def release_entry(self, key: str, expiry: int, amount: int = 1) -> None:
+        """Remove the `amount` newest entries of the moving window of a key, see `fastlimits.strategies.refund`"""
+        shard = self._shard(key)
+        with shard.lock:
+            entry = shard.get(key, time.time())
+            if entry is None or not entry.events:
+                return
+            for _ in range(min(amount, len(entry.events))):
+                entry.events.pop()
+            entry.count = len(entry.events)
@@ -0,0 +1,269 @@
+import asyncio
+import errno
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Iterator, Optional, Tuple, Type, Union
+from urllib.parse import urlparse
+
+from limits.aio.storage import Storage
+
+_MAGIC = b"FLSHM001"
+_HEADER = struct.Struct("<8sQQ")  # magic, buckets, bucket size
+_HEADER_SIZE = 64
+_SLOT = struct.Struct("<16sqd")  # key digest, counter, expires at
+_EMPTY = bytes(16)
+
+
+class SharedMemoryStorage(Storage):
+    """
+    A storage for the fixed window strategies, shared by all the processes of a host through a memory mapped file.
+
+    The file holds a hash table of `max_entries` counters in buckets of `bucket_size` slots. each call locks only the
+        bucket of its key, with an `fcntl` record lock on its bytes, so the workers only wait for each other when
+        they use the same bucket. a key is stored as a 16 byte digest, when a bucket is full the slot that expires
+        first is reused.
+
+    ```py
+    from fastlimits.storage.shared import SharedMemoryStorage
+    from limits.aio.strategies import FixedWindowRateLimiter
+
+    limiter = FixedWindowRateLimiter(storage=SharedMemoryStorage("/dev/shm/myapp-limits"))
+    ```
+
+    Every worker that opens the same path shares the same counters. the moving window strategy is not supported,
+        its entries don't fit in fixed size slots.
+
+    `fcntl` has no asynchronous lock, a bucket locked by another process or thread is tried again after yielding to the
+        event loop instead of blocking it. only the constructor waits for the lock of the header, and `expires_at`
+        doesn't wait at all: it returns `None` when the bucket is locked.
+    """
+
+    STORAGE_SCHEME = ["async+fastlimits-shm"]
+
+    def __init__(
+        self,
+        uri: Optional[str] = None,
+        wrap_exceptions: bool = False,
+        path: Optional[str] = None,
+        max_entries: int = 1 << 16,
+        bucket_size: int = 8,
+        **options: str,
+    ) -> None:
+        """SharedMemoryStorage
+
+        Args:
+            uri (Optional[str]): `async+fastlimits-shm:///path/of/the/file`, for `limits.storage.storage_from_string`
+            wrap_exceptions (bool): wrap the exceptions in `limits.errors.StorageError`
+            path (Optional[str]): the file to map, created if it doesn't exist. required, the processes that open the
+                same file share the counters, so each application needs its own
+            max_entries (int): number of counters in the table, only used when the file is created
+            bucket_size (int): number of slots in a bucket, only used when the file is created
+        """
+        if path is None and uri:
+            path = urlparse(uri).path or None
+        if not path:
+            raise ValueError(
+                "SharedMemoryStorage needs the path of its file, for example '/dev/shm/myapp-limits'"
+            )
+        self.path = path
+        # record locks don't exclude the threads of a process
+        self._local = threading.Lock()
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        self.buckets, self.bucket_size = self._init_file(
+            max(1, int(max_entries) // int(bucket_size)), int(bucket_size)
+        )
+        self._bucket_bytes = self.bucket_size * _SLOT.size
+        self._map = mmap.mmap(
+            self._fd, _HEADER_SIZE + self.buckets * self._bucket_bytes
+        )
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    def _init_file(self, buckets: int, bucket_size: int) -> Tuple[int, int]:
+        """Create the table if the file is empty, otherwise read its layout"""
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, _HEADER_SIZE, 0)
+        try:
+            header = os.pread(self._fd, _HEADER.size, 0)
+            if len(header) < _HEADER.size:
+                os.ftruncate(
+                    self._fd, _HEADER_SIZE + buckets * bucket_size * _SLOT.size
+                )
+                os.pwrite(self._fd, _HEADER.pack(_MAGIC, buckets, bucket_size), 0)
+                return buckets, bucket_size
+            magic, buckets, bucket_size = _HEADER.unpack(header)
+            if magic != _MAGIC:
+                raise ValueError(f"{self.path} is not a fastlimits shared memory table")
+            return buckets, bucket_size
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, _HEADER_SIZE, 0)
+
+    @property
+    def base_exceptions(
+        self,
+    ) -> Union[Type[Exception], Tuple[Type[Exception], ...]]:  # pragma: no cover
+        return (ValueError, OSError)
+
+    def close(self) -> None:
+        """Unmap the file, the counters stay in it for the other processes"""
+        self._map.close()
+        os.close(self._fd)
+
+    def _locate(self, key: str) -> Tuple[bytes, int]:
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        bucket = int.from_bytes(digest[:8], "little") % self.buckets
+        return digest, _HEADER_SIZE + bucket * self._bucket_bytes
+
+    def _lock(self, offset: int, length: int) -> "_RangeLock":
+        return _RangeLock(self, offset, length)
+
+    def _slots(self, offset: int) -> Iterator[Tuple[int, bytes, int, float]]:
+        for i in range(self.bucket_size):
+            position = offset + i * _SLOT.size
+            yield (position, *_SLOT.unpack_from(self._map, position))
+
+    def _find(
+        self, digest: bytes, offset: int, now: float
+    ) -> Optional[Tuple[int, int, float]]:
+        """The position, counter and expiry of a key that hasn't expired"""
+        for position, slot_digest, count, expires_at in self._slots(offset):
+            if slot_digest == digest:
+                return (position, count, expires_at) if expires_at > now else None
+        return None
+
+    def expires_at(self, key: str) -> Optional[float]:
+        """The time (seconds since the epoch) a key expires at
+
+        Args:
+            key (str): the rate limit key
+
+        Returns:
+            Optional[float]: `None` if the key doesn't exist, or if its bucket is locked
+        """
+        digest, offset = self._locate(key)
+        lock = self._lock(offset, self._bucket_bytes)
+        if not lock.acquire():
+            return None
+        try:
+            found = self._find(digest, offset, time.time())
+        finally:
+            lock.release()
+        return found[2] if found is not None else None
+
+    async def incr(
+        self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1
+    ) -> int:
+        """Increment the counter of a key, its window starts with the first hit
+
+        Args:
+            key (str): the rate limit key
+            expiry (int): seconds until the window of the key expires
+            elastic_expiry (bool): extend the window on every hit
+            amount (int): the number to increment by
+
+        Returns:
+            int: the counter after the increment
+        """
+        now = time.time()
+        digest, offset = self._locate(key)
+        async with self._lock(offset, self._bucket_bytes):
+            target = None
+            oldest = None
+            for position, slot_digest, count, expires_at in self._slots(offset):
+                if slot_digest == digest:
+                    if expires_at > now:
+                        count += amount
+                        if elastic_expiry:
+                            expires_at = now + expiry
+                        _SLOT.pack_into(self._map, position, digest, count, expires_at)
+                        return count
+                    target = position
+                    break
+                if target is None and (slot_digest == _EMPTY or expires_at <= now):
+                    target = position
+                if oldest is None or expires_at < oldest[1]:
+                    oldest = (position, expires_at)
+            if target is None:
+                # the bucket is full, reuse the slot that expires first
+                target = oldest[0]  # type: ignore[index]
+            _SLOT.pack_into(self._map, target, digest, amount, now + expiry)
+            return amount
+
+    async def get(self, key: str) -> int:
+        digest, offset = self._locate(key)
+        async with self._lock(offset, self._bucket_bytes):
+            found = self._find(digest, offset, time.time())
+        return found[1] if found is not None else 0
+
+    async def get_expiry(self, key: str) -> int:
+        digest, offset = self._locate(key)
+        now = time.time()
+        async with self._lock(offset, self._bucket_bytes):
+            found = self._find(digest, offset, now)
+        return int(found[2] if found is not None else now)
+
+    async def clear(self, key: str) -> None:
+        digest, offset = self._locate(key)
+        async with self._lock(offset, self._bucket_bytes):
+            for position, slot_digest, _, _ in self._slots(offset):
+                if slot_digest == digest:
+                    _SLOT.pack_into(self._map, position, _EMPTY, 0, 0.0)
+
+    async def check(self) -> bool:
+        return not self._map.closed
+
+    async def reset(self) -> Optional[int]:
+        size = self.buckets * self._bucket_bytes
+        async with self._lock(_HEADER_SIZE, size):
+            count = 0
+            for bucket in range(self.buckets):
+                for _, slot_digest, _, _ in self._slots(
+                    _HEADER_SIZE + bucket * self._bucket_bytes
+                ):
+                    count += slot_digest != _EMPTY
+            self._map[_HEADER_SIZE : _HEADER_SIZE + size] = bytes(size)
+        return count
+
+
+class _RangeLock:
+    """Locks a byte range of the file for the other processes, and the process lock for the other threads"""
+
+    __slots__ = ("storage", "offset", "length")
+
+    def __init__(self, storage: SharedMemoryStorage, offset: int, length: int) -> None:
+        self.storage = storage
+        self.offset = offset
+        self.length = length
+
+    def acquire(self) -> bool:
+        """Try to take both locks without waiting, `False` if one of them is held"""
+        if not self.storage._local.acquire(blocking=False):
+            return False
+        try:
+            fcntl.lockf(
+                self.storage._fd,
+                fcntl.LOCK_EX | fcntl.LOCK_NB,
+                self.length,
+                self.offset,
+            )
+        except OSError as e:
+            self.storage._local.release()
+            if e.errno in (errno.EACCES, errno.EAGAIN):
+                return False
+            raise
+        return True
+
+    def release(self) -> None:
+        fcntl.lockf(self.storage._fd, fcntl.LOCK_UN, self.length, self.offset)
+        self.storage._local.release()
+
+    async def __aenter__(self) -> None:
+        # the locks are never held across an `await`, so the other coroutines of the loop can't wait for this one
+        while not self.acquire():
+            await asyncio.sleep(0)
+
+    async def __aexit__(self, *args: object) -> None:
+        self.release()
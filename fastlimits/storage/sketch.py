@@ -0,0 +1,156 @@
+import time
+from typing import Dict, Optional, Tuple, Type, Union
+
+from limits.aio.storage import Storage
+
+from ..sketch import CountMinSketch
+
+
+class SketchWindow:
+    """The counters of every key for the current window of one expiry"""
+
+    __slots__ = ("start", "sketch")
+
+    def __init__(self, start: float, sketch: CountMinSketch) -> None:
+        self.start = start
+        self.sketch = sketch
+
+
+class SketchStorage(Storage):
+    """
+    Approximate fixed window counters in a fixed amount of memory, whatever the number of keys.
+
+    The counters of all the keys of the same expiry are kept in a single `CountMinSketch`, and the windows are aligned
+        on multiples of the expiry, so all the keys share the same window. when the window is over its sketch is
+        cleared and reused for the next one. a counter is never lower than the real number of hits of its key, and
+        is higher by at most `2 / width` of all the hits of the window with a probability of `1 - 2 ** -depth`.
+
+    Each expiry takes `8 * width * depth` bytes, 2 MiB with the defaults. to be used with `SketchWindowRateLimiter`:
+
+    ```py
+    from fastlimits.storage import SketchStorage
+    from fastlimits.strategies import SketchWindowRateLimiter
+
+    limiter = SketchWindowRateLimiter(storage=SketchStorage(width=1 << 16, depth=4))
+    ```
+
+    Hits can't be refunded and a single key can't be cleared, taking them out of the sketch could make the counters
+        of other keys lower than their real number of hits.
+    """
+
+    STORAGE_SCHEME = ["async+fastlimits-sketch"]
+
+    def __init__(
+        self,
+        uri: Optional[str] = None,
+        wrap_exceptions: bool = False,
+        width: int = 1 << 16,
+        depth: int = 4,
+        **options: str,
+    ) -> None:
+        """SketchStorage
+
+        Args:
+            uri (Optional[str]): unused, for `limits.storage.storage_from_string`
+            wrap_exceptions (bool): wrap the exceptions in `limits.errors.StorageError`
+            width (int): cells per row of the sketches, a power of two
+            depth (int): rows of the sketches
+        """
+        self.width = int(width)
+        self.depth = int(depth)
+        CountMinSketch(self.width, self.depth)  # validate the dimensions early
+        self._windows: Dict[int, SketchWindow] = {}
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(
+        self,
+    ) -> Union[Type[Exception], Tuple[Type[Exception], ...]]:  # pragma: no cover
+        return ValueError
+
+    def window(self, expiry: int, now: Optional[float] = None) -> SketchWindow:
+        """The current window of an expiry, the sketch of the previous one is cleared when it's over
+
+        Args:
+            expiry (int): seconds per window
+            now (Optional[float]): the current time, `time.time()` by default
+
+        Returns:
+            SketchWindow:
+        """
+        if now is None:
+            now = time.time()
+        start = now - now % expiry
+        window = self._windows.get(expiry)
+        if window is None:
+            window = self._windows[expiry] = SketchWindow(
+                start, CountMinSketch(self.width, self.depth)
+            )
+        elif window.start != start:
+            window.sketch.clear()
+            window.start = start
+        return window
+
+    def add(self, key: str, expiry: int, amount: int = 1) -> int:
+        """Count hits of a key in the current window, without awaiting
+
+        Args:
+            key (str): the rate limit key
+            expiry (int): seconds per window
+            amount (int): the number of hits
+
+        Returns:
+            int: the estimated number of hits of the key after the update
+        """
+        return self.window(expiry).sketch.add(key, amount)
+
+    def estimate(self, key: str, expiry: int) -> int:
+        """The estimated number of hits of a key in the current window, never lower than the real number"""
+        return self.window(expiry).sketch.estimate(key)
+
+    def reset_time(self, expiry: int) -> float:
+        """The time (seconds since the epoch) the current window of an expiry ends at"""
+        return self.window(expiry).start + expiry
+
+    async def incr(
+        self, key: str, expiry: int, elastic_expiry: bool = False, amount: int = 1
+    ) -> int:
+        """Count hits of a key in the current window
+
+        Args:
+            key (str): the rate limit key
+            expiry (int): seconds per window
+            elastic_expiry (bool): not supported, the windows are aligned
+            amount (int): the number of hits, negative amounts are ignored
+
+        Returns:
+            int: the estimated number of hits of the key
+        """
+        if amount < 0:
+            return self.estimate(key, expiry)
+        return self.add(key, expiry, amount)
+
+    async def get(self, key: str) -> int:
+        """The largest estimate of a key over the windows of all the expiries, the expiry of a key is not stored"""
+        return max(
+            (self.estimate(key, expiry) for expiry in list(self._windows)), default=0
+        )
+
+    async def get_expiry(self, key: str) -> int:
+        now = time.time()
+        return int(
+            min(
+                (self.reset_time(expiry) for expiry in list(self._windows)),
+                default=now,
+            )
+        )
+
+    async def clear(self, key: str) -> None:
+        """Not supported, the counters of a key are shared with other keys"""
+
+    async def check(self) -> bool:
+        return True
+
+    async def reset(self) -> Optional[int]:
+        self._windows.clear()
+        return None
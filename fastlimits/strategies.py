@@ -0,0 +1,354 @@
+import asyncio
+import time
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    cast,
+)
+
+from limits import RateLimitItem
+from limits.aio.storage import MemoryStorage, MovingWindowSupport, RedisStorage
+from limits.aio.strategies import (
+    FixedWindowElasticExpiryRateLimiter,
+    FixedWindowRateLimiter,
+    MovingWindowRateLimiter,
+    RateLimiter,
+)
+from limits.util import WindowStats
+
+if TYPE_CHECKING:
+    from .storage.sketch import SketchStorage
+
+LimitAndKeys = Tuple[RateLimitItem, Sequence[str]]
+
+
+class WindowState(NamedTuple):
+    """
+    The outcome of testing or hitting a limit, along with what the same storage call revealed about its window.
+    """
+
+    allowed: bool
+    #: hits left in the window after this request, `None` if unknown
+    remaining: Optional[int] = None
+    #: time (seconds since the epoch) the window resets at, `None` if unknown
+    reset_time: Optional[float] = None
+
+
+class SketchWindowRateLimiter(RateLimiter):
+    """
+    An approximate fixed window strategy on `SketchStorage`, its memory doesn't grow with the number of keys.
+
+    The windows are aligned on multiples of their expiry instead of starting with the first hit of each key. the
+        number of hits of a key can be over-estimated, never under-estimated, so a client can be limited a bit early
+        when the window is busy but never late. see `SketchStorage` for the bound of the error.
+    """
+
+    def __init__(self, storage: "SketchStorage") -> None:
+        from .storage.sketch import SketchStorage
+
+        if not isinstance(storage, SketchStorage):
+            raise NotImplementedError(
+                "SketchWindowRateLimiter is not implemented for storage of type %s"
+                % storage.__class__
+            )
+        super().__init__(storage)
+        self.sketches = storage
+
+    async def hit(self, item: RateLimitItem, *identifiers: str, cost: int = 1) -> bool:
+        """Consume the rate limit
+
+        Args:
+            item (RateLimitItem): the rate limit item
+            identifiers (str): keys of the limit item
+            cost (int): the cost of the hit
+
+        Returns:
+            bool: `False` if the limit is exceeded, the hit is counted either way
+        """
+        count = self.sketches.add(item.key_for(*identifiers), item.get_expiry(), cost)
+        return count <= item.amount
+
+    async def test(self, item: RateLimitItem, *identifiers: str, cost: int = 1) -> bool:
+        """Check if the rate limit can be consumed
+
+        Args:
+            item (RateLimitItem): the rate limit item
+            identifiers (str): keys of the limit item
+            cost (int): the expected cost of the hit
+
+        Returns:
+            bool:
+        """
+        count = self.sketches.estimate(item.key_for(*identifiers), item.get_expiry())
+        return count <= item.amount - cost
+
+    async def get_window_stats(
+        self, item: RateLimitItem, *identifiers: str
+    ) -> WindowStats:
+        """Query the reset time and remaining amount for the limit
+
+        Args:
+            item (RateLimitItem): the rate limit item
+            identifiers (str): keys of the limit item
+
+        Returns:
+            WindowStats: the remaining amount can be under-estimated, never over-estimated
+        """
+        expiry = item.get_expiry()
+        count = self.sketches.estimate(item.key_for(*identifiers), expiry)
+        return WindowStats(
+            int(self.sketches.reset_time(expiry)), max(0, item.amount - count)
+        )
+
+
+def _in_process(storage: Any) -> bool:
+    """The storages that keep their counters in this process, they are read again without a round trip"""
+    # `ShardedMemoryStorage` and `SharedMemoryStorage` have `expires_at`
+    return isinstance(storage, MemoryStorage) or callable(
+        getattr(storage, "expires_at", None)
+    )
+
+
+def _memory_expiry(storage: Any, key: str) -> Optional[float]:
+    # the expiry of an in process counter is known without another call
+    if isinstance(storage, MemoryStorage):
+        return storage.expirations.get(key)
+    expires_at = getattr(storage, "expires_at", None)
+    if callable(expires_at):
+        # `ShardedMemoryStorage` and `SharedMemoryStorage`
+        return cast(Optional[float], expires_at(key))
+    return None
+
+
+async def check_window(
+    strategy: RateLimiter, item: RateLimitItem, *identifiers: str, cost: int = 1
+) -> WindowState:
+    """Same as `strategy.test`, but returns the state of the window that was read to decide
+
+    The state is only available for the strategies shipped with `limits` and `SketchWindowRateLimiter`, other strategies only report if the hit is allowed.
+
+    Args:
+        strategy (RateLimiter): the strategy to test the limit with
+        item (RateLimitItem): the rate limit item
+        identifiers (str): keys of the limit item
+        cost (int): the expected cost of the hit
+
+    Returns:
+        WindowState:
+    """
+    key = item.key_for(*identifiers)
+    if isinstance(strategy, SketchWindowRateLimiter):
+        expiry = item.get_expiry()
+        count = strategy.sketches.estimate(key, expiry)
+        allowed = count <= item.amount - cost
+        return WindowState(
+            allowed,
+            max(0, item.amount - count - (cost if allowed else 0)),
+            strategy.sketches.reset_time(expiry),
+        )
+    if type(strategy) is MovingWindowRateLimiter:
+        start, count = await cast(
+            MovingWindowSupport, strategy.storage
+        ).get_moving_window(key, item.amount, item.get_expiry())
+        allowed = count <= item.amount - cost
+        return WindowState(
+            allowed,
+            max(0, item.amount - count - (cost if allowed else 0)),
+            start + item.get_expiry(),
+        )
+    if type(strategy) in (FixedWindowRateLimiter, FixedWindowElasticExpiryRateLimiter):
+        count = await strategy.storage.get(key)
+        allowed = count <= item.amount - cost
+        return WindowState(
+            allowed,
+            max(0, item.amount - count - (cost if allowed else 0)),
+            _memory_expiry(strategy.storage, key),
+        )
+    return WindowState(await strategy.test(item, *identifiers, cost=cost))
+
+
+async def hit_window(
+    strategy: RateLimiter, item: RateLimitItem, *identifiers: str, cost: int = 1
+) -> WindowState:
+    """Same as `strategy.hit`, but returns the state of the window that was updated
+
+    The state is only available for the fixed window strategies shipped with `limits`, `SketchWindowRateLimiter` and
+        the moving window strategy on an in process storage, other strategies only report if the hit is allowed.
+
+    Args:
+        strategy (RateLimiter): the strategy to hit the limit with
+        item (RateLimitItem): the rate limit item
+        identifiers (str): keys of the limit item
+        cost (int): the cost of the hit
+
+    Returns:
+        WindowState:
+    """
+    if isinstance(strategy, SketchWindowRateLimiter):
+        expiry = item.get_expiry()
+        count = strategy.sketches.add(item.key_for(*identifiers), expiry, cost)
+        return WindowState(
+            count <= item.amount,
+            max(0, item.amount - count),
+            strategy.sketches.reset_time(expiry),
+        )
+    if type(strategy) in (FixedWindowRateLimiter, FixedWindowElasticExpiryRateLimiter):
+        key = item.key_for(*identifiers)
+        elastic = type(strategy) is FixedWindowElasticExpiryRateLimiter
+        count = await strategy.storage.incr(
+            key, item.get_expiry(), elastic_expiry=elastic, amount=cost
+        )
+        if elastic or count == cost:  # the window started (again) with this hit
+            reset_time: Optional[float] = time.time() + item.get_expiry()
+        else:
+            reset_time = _memory_expiry(strategy.storage, key)
+        return WindowState(
+            count <= item.amount, max(0, item.amount - count), reset_time
+        )
+    if type(strategy) is MovingWindowRateLimiter and _in_process(strategy.storage):
+        allowed = await strategy.hit(item, *identifiers, cost=cost)
+        start, count = await cast(
+            MovingWindowSupport, strategy.storage
+        ).get_moving_window(item.key_for(*identifiers), item.amount, item.get_expiry())
+        return WindowState(
+            allowed, max(0, item.amount - count), start + item.get_expiry()
+        )
+    return WindowState(await strategy.hit(item, *identifiers, cost=cost))
+
+
+async def batch_test(
+    strategy: RateLimiter,
+    limits: Sequence[LimitAndKeys],
+    costs: Optional[Sequence[int]] = None,
+) -> List[WindowState]:
+    """Test several limits at once, one storage call per limit
+
+    The calls are issued concurrently, so a request waits for the slowest of them instead of all of them in a row.
+        each call is still its own round trip to the storage.
+
+    Args:
+        strategy (RateLimiter): the strategy to test the limits with
+        limits (Sequence[LimitAndKeys]): pairs of rate limit item and its keys
+        costs (Optional[Sequence[int]]): the cost of each limit, 1 for all of them by default
+
+    Returns:
+        List[WindowState]: the result of `check_window` for each limit, in order
+    """
+    if costs is None:
+        costs = [1] * len(limits)
+    if len(limits) == 1:
+        item, keys = limits[0]
+        return [await check_window(strategy, item, *keys, cost=costs[0])]
+    return list(
+        await asyncio.gather(
+            *(
+                check_window(strategy, item, *keys, cost=cost)
+                for (item, keys), cost in zip(limits, costs)
+            )
+        )
+    )
+
+
+async def batch_hit(
+    strategy: RateLimiter,
+    limits: Sequence[LimitAndKeys],
+    costs: Optional[Sequence[int]] = None,
+) -> List[WindowState]:
+    """Hit several limits at once, one storage call per limit
+
+    The calls are issued concurrently, so a request waits for the slowest of them instead of all of them in a row.
+        each call is still its own round trip to the storage.
+
+    Args:
+        strategy (RateLimiter): the strategy to hit the limits with
+        limits (Sequence[LimitAndKeys]): pairs of rate limit item and its keys
+        costs (Optional[Sequence[int]]): the cost of each limit, 1 for all of them by default
+
+    Returns:
+        List[WindowState]: the result of `hit_window` for each limit, in order
+    """
+    if costs is None:
+        costs = [1] * len(limits)
+    if len(limits) == 1:
+        item, keys = limits[0]
+        return [await hit_window(strategy, item, *keys, cost=costs[0])]
+    return list(
+        await asyncio.gather(
+            *(
+                hit_window(strategy, item, *keys, cost=cost)
+                for (item, keys), cost in zip(limits, costs)
+            )
+        )
+    )
+
+
+async def batch_refund(
+    strategy: RateLimiter,
+    limits: Sequence[LimitAndKeys],
+    costs: Optional[Sequence[int]] = None,
+) -> None:
+    """Refund the hits of several limits at once, one hit of each by default, see `refund`"""
+    if costs is None:
+        costs = [1] * len(limits)
+    await asyncio.gather(
+        *(
+            refund(strategy, item, *keys, cost=cost)
+            for (item, keys), cost in zip(limits, costs)
+        )
+    )
+
+
+def supports_refund(strategy: RateLimiter) -> bool:
+    """Check if hits consumed with `strategy` can be given back with `refund`"""
+    if isinstance(strategy, FixedWindowRateLimiter):
+        return True
+    if isinstance(strategy, MovingWindowRateLimiter):
+        storage = strategy.storage
+        return hasattr(storage, "release_entry") or isinstance(
+            storage, (MemoryStorage, RedisStorage)
+        )
+    return False
+
+
+async def refund(
+    strategy: RateLimiter, item: RateLimitItem, *identifiers: str, cost: int = 1
+) -> None:
+    """Give back `cost` hits that were consumed with `strategy.hit`
+
+    Fixed window counters are decremented, down to 0. nothing is given back when the window expired
+        in between, a new window would start below 0. Moving window entries are removed newest first,
+        which is supported by `MemoryStorage`, `RedisStorage` and any storage that implements
+        a `release_entry(key, expiry, amount)` coroutine. for other strategies this is a no-op, including
+        `SketchWindowRateLimiter`.
+
+    Args:
+        strategy (RateLimiter): the strategy the hits were consumed with
+        item (RateLimitItem): the rate limit item
+        identifiers (str): keys of the limit item
+        cost (int): number of hits to give back
+    """
+    key = item.key_for(*identifiers)
+    if isinstance(strategy, FixedWindowRateLimiter):
+        count = await strategy.storage.get(key)
+        if count > 0:
+            await strategy.storage.incr(
+                key, item.get_expiry(), elastic_expiry=False, amount=-min(cost, count)
+            )
+        return
+    if not isinstance(strategy, MovingWindowRateLimiter):
+        return
+
+    storage: Any = strategy.storage
+    if hasattr(storage, "release_entry"):
+        await storage.release_entry(key, item.get_expiry(), amount=cost)
+    elif isinstance(storage, MemoryStorage):
+        # entries are inserted at the head of the list, the newest ones come first
+        entries = cast(List[Any], storage.events.get(key, []))
+        del entries[:cost]
+    elif isinstance(storage, RedisStorage):
+        await storage.storage.lpop(storage.prefixed_key(key), cost)
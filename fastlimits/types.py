@@ -14,3 +14,5 @@ CallableMiddlewareKey: TypeAlias = Callable[[Request], Union[str, Awaitable[str]
 StrOrCallableKey: TypeAlias = Union[str, Callable[..., Union[str, Awaitable[str]]]]
 
 CallableFilter: TypeAlias = Callable[..., Union[bool, Awaitable[bool]]]
+
+CallableCost: TypeAlias = Callable[..., Union[int, Awaitable[int]]]
@@ -1,6 +1,20 @@
+import functools
 import inspect
 import types
-from typing import Any, Callable, Generator, List, Optional, Tuple, Type, TypeVar, Union
+import weakref
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
 
 from fastapi.routing import APIRoute
 from limits import RateLimitItem
@@ -24,15 +38,98 @@ def get_api_routes(router: SupportsRoutes) -> Generator[APIRoute, None, None]:
     yield from (r for r in router.routes if isinstance(r, APIRoute))
 
 
+class RouteIndex:
+    """
+    An endpoint to `APIRoute` index of a router.
+
+    Routes are usually appended to a router, so only the routes added since the last lookup are indexed.
+        the index is rebuilt when the route list is replaced or shrinks, or when an indexed route moved. a missing
+        endpoint is answered by the index without a rebuild, so a route replaced in place with the same number of
+        routes is only indexed once the route list changes.
+    """
+
+    __slots__ = ("routes", "size", "positions")
+
+    def __init__(self) -> None:
+        self.routes: Optional[Sequence[Any]] = None
+        self.size = 0
+        self.positions: Dict[Callable[..., Any], int] = {}
+
+    def find(
+        self, routes: Sequence[Any], func: Callable[..., Any]
+    ) -> Optional[APIRoute]:
+        """Find the first `APIRoute` of `func` in `routes`
+
+        Args:
+            routes (Sequence[Any]): the routes of the router this index belongs to
+            func (Callable[..., Any]): the endpoint function
+
+        Returns:
+            Optional[APIRoute]: the route, `None` if the function is not an endpoint of the router
+        """
+        if routes is not self.routes or len(routes) < self.size:
+            self._reset()
+            self.routes = routes
+        self._index(routes)
+        if func not in self.positions:
+            return None
+        route = self._lookup(routes, func)
+        if route is None:
+            # the routes were reordered in place, rebuild the index
+            self._reset()
+            self._index(routes)
+            route = self._lookup(routes, func)
+        return route
+
+    def _reset(self) -> None:
+        self.size = 0
+        self.positions.clear()
+
+    def _index(self, routes: Sequence[Any]) -> None:
+        for i in range(self.size, len(routes)):
+            route = routes[i]
+            if isinstance(route, APIRoute):
+                self.positions.setdefault(route.endpoint, i)
+        self.size = len(routes)
+
+    def _lookup(
+        self, routes: Sequence[Any], func: Callable[..., Any]
+    ) -> Optional[APIRoute]:
+        i = self.positions.get(func)
+        if i is None:
+            return None
+        route = routes[i]
+        if isinstance(route, APIRoute) and route.endpoint is func:
+            return route
+        return None
+
+
+_route_indexes: "weakref.WeakKeyDictionary[Any, RouteIndex]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
 def find_api_route(
     router: SupportsRoutes, func: Callable[..., Any]
 ) -> Optional[APIRoute]:
-    """Find the APIRoute object from the APIRouter.routes or FastAPI.routes"""
-    for r in get_api_routes(router):
-        if getattr(r, "endpoint", None) == func:
-            return r
-
+    """Find the APIRoute object from the APIRouter.routes or FastAPI.routes
 
+    The endpoints of each router are indexed once, so finding the routes of N endpoints is O(N) instead of O(N²).
+    """
+    try:
+        index = _route_indexes.get(router)
+        if index is None:
+            index = _route_indexes[router] = RouteIndex()
+        return index.find(router.routes, func)
+    except TypeError:
+        # the router can't be weakly referenced or the endpoint can't be hashed
+        for r in get_api_routes(router):
+            if getattr(r, "endpoint", None) == func:
+                return r
+        return None
+
+
+@functools.lru_cache(maxsize=None)
 def create_response_model(
     model: Type[ModelT],
     parsed_limit: RateLimitItem,
@@ -40,6 +137,8 @@ def create_response_model(
 ) -> Type[ModelT]:
     """
     Returns a copy of the model with the default value updated and placeholders filled.G
+
+    The copies are cached, routes with the same limit share the same model.
     """
     _model = model
     if show_limit_in_response_model:
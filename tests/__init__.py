@@ -1,4 +1,4 @@
-from typing import List, Tuple
+from typing import Any, List, Tuple
 
 from fastapi import Depends, FastAPI, Header
 from fastapi.routing import APIRoute
@@ -9,7 +9,19 @@ from fastlimits import RateLimitingMiddleware, limit
 from fastlimits.utils import get_api_routes
 
 
-def build_app() -> Tuple[FastAPI, List[APIRoute]]:
+class CountingStorage(MemoryStorage):
+    """A `MemoryStorage` that counts its `incr` calls"""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.incr_calls = 0
+
+    async def incr(self, *args: Any, **kwargs: Any) -> int:
+        self.incr_calls += 1
+        return await super().incr(*args, **kwargs)
+
+
+def build_app(**middleware_options: Any) -> Tuple[FastAPI, List[APIRoute]]:
     app = FastAPI()
 
     limiter = FixedWindowRateLimiter(storage=MemoryStorage())
@@ -17,6 +29,7 @@ def build_app() -> Tuple[FastAPI, List[APIRoute]]:
     app.add_middleware(
         RateLimitingMiddleware,
         strategy=limiter,
+        **middleware_options,
     )
 
     @limit(app, "5/minute")
@@ -0,0 +1,76 @@
+from fastapi import FastAPI
+from limits import parse
+from limits.aio.storage import MemoryStorage
+from limits.aio.strategies import FixedWindowRateLimiter
+from starlette.testclient import TestClient
+
+from fastlimits import RateLimitingMiddleware, limit
+from fastlimits.adaptive import AdaptiveLimits
+from fastlimits.metrics import InMemoryMetrics
+
+
+def test_adaptive_aimd():
+    changes = []
+    adaptive = AdaptiveLimits(
+        target_lag=0.05,
+        target_latency=0.2,
+        decrease=0.5,
+        increase=0.25,
+        min_multiplier=0.2,
+        on_change=lambda old, new: changes.append(new),
+    )
+    assert adaptive.update(0.1) == 0.5  # the loop is lagging
+    adaptive.observe_latency(0.5)
+    adaptive.observe_latency(0.3)
+    assert adaptive.update(0.0) == 0.25  # the responses are slow
+    assert adaptive.update(0.1) == 0.2
+    assert adaptive.update(0.0) == 0.45  # latencies are reset on every sample
+    assert adaptive.update(0.0) == 0.7
+    assert adaptive.update(0.0) == 0.95
+    assert adaptive.update(0.0) == 1.0
+    assert adaptive.update(0.0) == 1.0
+    assert changes == [0.5, 0.25, 0.2, 0.45, 0.7, 0.95, 1.0]
+
+
+def test_adaptive_scale():
+    adaptive = AdaptiveLimits()
+    item = parse("10/minute")
+    assert adaptive.scale(item) is item
+    adaptive.multiplier = 0.35
+    scaled = adaptive.scale(item)
+    assert scaled.amount == 3
+    assert scaled.get_expiry() == 60
+    assert scaled.key_for("a", "b") == item.key_for("a", "b")
+    assert adaptive.scale(item) is scaled
+
+
+def test_adaptive_middleware():
+    adaptive = AdaptiveLimits(interval=60)
+    metrics = InMemoryMetrics()
+    app = FastAPI()
+    app.add_middleware(
+        RateLimitingMiddleware,
+        strategy=FixedWindowRateLimiter(MemoryStorage()),
+        adaptive=adaptive,
+        metrics=metrics,
+        headers_enabled=True,
+    )
+
+    @limit(app, "5/minute")
+    @app.get("/")
+    async def _get():
+        return
+
+    with TestClient(app) as client:
+        adaptive.multiplier = 0.4
+        assert client.get("/").headers["x-ratelimit-limit"] == "2"
+        assert client.get("/").status_code == 200
+        assert client.get("/").status_code == 429
+        adaptive.update(0.0)  # recovers up to 0.45, still 2
+        assert client.get("/").status_code == 429
+        adaptive.multiplier = 1.0
+        assert [client.get("/").status_code for _ in range(4)] == [200] * 3 + [429]
+    assert metrics.adaptive_multiplier == 0.45
+    assert 'fastlimits_decisions_total{limit="5 per 1 minute",outcome="denied"} 3' in (
+        metrics.prometheus()
+    )
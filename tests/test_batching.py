@@ -0,0 +1,153 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from limits import parse
+from limits.aio.strategies import FixedWindowRateLimiter
+from starlette.testclient import TestClient
+
+from fastlimits import RateLimitingMiddleware, limit
+from fastlimits.batching import HitBatcher, HitQueue
+
+from . import CountingStorage
+
+
+def test_batcher_merges_hits():
+    async def run():
+        storage = CountingStorage()
+        strategy = FixedWindowRateLimiter(storage)
+        batcher = HitBatcher()
+        item = parse("100/minute")
+        windows = await asyncio.gather(
+            *(batcher.hit(strategy, [(item, ["a"]), (item, ["b"])]) for _ in range(30)),
+            batcher.hit(strategy, [(item, ["a"])], [10]),
+        )
+        assert storage.incr_calls == 2
+        assert await storage.get(item.key_for("a")) == 40
+        assert await storage.get(item.key_for("b")) == 30
+        assert windows[0][0].remaining == 60
+        assert windows[-1] == [windows[0][0]]
+
+        await batcher.hit(strategy, [(item, ["a"])])  # a new batch
+        assert storage.incr_calls == 3
+
+    asyncio.run(run())
+
+
+def test_batcher_window():
+    async def run():
+        storage = CountingStorage()
+        strategy = FixedWindowRateLimiter(storage)
+        batcher = HitBatcher(window=0.05, max_pending=2)
+        item = parse("100/minute")
+
+        async def later(keys):
+            await asyncio.sleep(0.01)
+            return await batcher.hit(strategy, [(item, keys)])
+
+        await asyncio.gather(later(["a"]), batcher.hit(strategy, [(item, ["a"])]))
+        assert storage.incr_calls == 1
+        await asyncio.gather(*(batcher.hit(strategy, [(item, [k])]) for k in "abc"))
+        assert storage.incr_calls == 4  # flushed once two keys were pending
+
+    asyncio.run(run())
+
+
+def test_batcher_middleware():
+    async def run():
+        storage = CountingStorage()
+        app = FastAPI()
+        app.add_middleware(
+            RateLimitingMiddleware,
+            strategy=FixedWindowRateLimiter(storage),
+            hit_batcher=HitBatcher(window=0.01),
+        )
+
+        @limit(app, "50/minute", keys="shared", override_default_keys=True)
+        @app.get("/")
+        async def _get():
+            return
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://t") as c:
+            responses = await asyncio.gather(*(c.get("/") for _ in range(20)))
+            assert all(r.status_code == 200 for r in responses)
+            assert storage.incr_calls < 20
+            assert (
+                await storage.get(parse("50/minute").key_for("127.0.0.1", "shared"))
+                == 20
+            )
+
+    asyncio.run(run())
+
+
+def test_queue_merges_hits():
+    async def run():
+        storage = CountingStorage()
+        strategy = FixedWindowRateLimiter(storage)
+        queue = HitQueue()
+        item = parse("100/minute")
+        for _ in range(10):
+            await queue.put(strategy, [(item, ["a"]), (item, ["b"])], [1, 2])
+        assert storage.incr_calls == 0  # nothing is sent by the requests
+        assert len(queue) == 2
+        await queue.flush()
+        assert len(queue) == 0
+        assert storage.incr_calls == 2
+        assert await storage.get(item.key_for("a")) == 10
+        assert await storage.get(item.key_for("b")) == 20
+
+    asyncio.run(run())
+
+
+def test_queue_overflow():
+    async def run():
+        storage = CountingStorage()
+        strategy = FixedWindowRateLimiter(storage)
+        item = parse("100/minute")
+
+        queue = HitQueue(max_size=1)
+        await queue.put(strategy, [(item, ["a"]), (item, ["b"])])
+        # the hit that doesn't fit is sent right away
+        assert storage.incr_calls == 1
+        assert await storage.get(item.key_for("b")) == 1
+        await queue.flush()
+        assert await storage.get(item.key_for("a")) == 1
+
+        queue = HitQueue(max_size=1, overflow="drop")
+        await queue.put(strategy, [(item, ["a"]), (item, ["c"])], [1, 5])
+        await queue.flush()
+        assert queue.dropped == 5
+        assert await storage.get(item.key_for("a")) == 2
+        assert await storage.get(item.key_for("c")) == 0
+
+        with pytest.raises(ValueError):
+            HitQueue(overflow="block")
+
+    asyncio.run(run())
+
+
+def test_queue_middleware_lifespan():
+    storage = CountingStorage()
+    queue = HitQueue()
+    app = FastAPI()
+    app.add_middleware(
+        RateLimitingMiddleware,
+        strategy=FixedWindowRateLimiter(storage),
+        hit_queue=queue,
+    )
+
+    @limit(app, "3/minute")
+    @app.get("/")
+    async def _get():
+        return
+
+    with TestClient(app) as client:
+        assert [client.get("/").status_code for _ in range(4)] == [200, 200, 200, 429]
+    # whatever was still queued is sent on shutdown
+    assert len(queue) == 0
+    assert storage.incr_calls <= 3
+    assert (
+        asyncio.run(storage.get(parse("3/minute").key_for("testclient", "_get"))) == 3
+    )
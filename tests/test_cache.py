@@ -0,0 +1,54 @@
+import time
+
+from limits import parse
+from starlette.testclient import TestClient
+
+from fastlimits.cache import ExceededCache
+
+from . import build_app
+
+
+def test_exceeded_cache_expiry():
+    cache = ExceededCache()
+    item = parse("5/minute")
+    assert cache.get(item, ["a"]) is None
+    cache.add(item, ["a"], time.time() + 0.1)
+    assert cache.get(item, ["a"]) is not None
+    assert cache.get(item, ["b"]) is None
+    time.sleep(0.1)
+    assert cache.get(item, ["a"]) is None
+    assert len(cache) == 0
+
+
+def test_exceeded_cache_ttl():
+    cache = ExceededCache(ttl=0)
+    cache.add(parse("5/minute"), ["a"], time.time() + 60)
+    assert len(cache) == 0
+
+
+def test_exceeded_cache_maxsize():
+    cache = ExceededCache(maxsize=2)
+    item = parse("5/minute")
+    reset = time.time() + 60
+    cache.add(item, ["a"], reset)
+    cache.add(item, ["b"], reset)
+    cache.get(item, ["a"])
+    cache.add(item, ["c"], reset)  # "b" is the least recently used
+    assert len(cache) == 2
+    assert cache.get(item, ["a"]) is not None
+    assert cache.get(item, ["b"]) is None
+    assert cache.get(item, ["c"]) is not None
+
+
+def test_exceeded_cache_middleware():
+    cache = ExceededCache()
+    app, routes = build_app(exceeded_cache=cache)
+    with TestClient(app) as client:
+        for _ in range(5):
+            assert client.get("/").status_code == 200
+        assert client.get("/").status_code == 429
+        assert len(cache) == 1
+
+        limiter = app.middleware_stack.app
+        limiter.strategy.storage.storage.clear()  # the storage is not asked again until the window resets
+        assert client.get("/").status_code == 429
@@ -0,0 +1,156 @@
+import asyncio
+from time import sleep
+
+import pytest
+from fastapi import FastAPI
+from limits.aio.storage import MemoryStorage
+from limits.aio.strategies import FixedWindowRateLimiter
+from starlette.testclient import TestClient
+
+from fastlimits import RateLimitingMiddleware, limit
+from fastlimits.circuit import CircuitBreaker, CircuitState
+from fastlimits.exceptions import StorageUnavailable
+
+
+class SlowStorage(MemoryStorage):
+    def __init__(self) -> None:
+        super().__init__()
+        self.delay = 0.0
+
+    async def get(self, *args, **kwargs):
+        await asyncio.sleep(self.delay)
+        return await super().get(*args, **kwargs)
+
+    async def incr(self, *args, **kwargs):
+        await asyncio.sleep(self.delay)
+        return await super().incr(*args, **kwargs)
+
+
+def build_slow_app(breaker: CircuitBreaker):
+    app = FastAPI()
+    storage = SlowStorage()
+    app.add_middleware(
+        RateLimitingMiddleware,
+        strategy=FixedWindowRateLimiter(storage=storage),
+        circuit_breaker=breaker,
+    )
+
+    @limit(app, "2/minute")
+    @app.get("/")
+    async def _get():
+        return
+
+    return app, storage
+
+
+def test_circuit_breaker_states():
+    async def fail():
+        raise ConnectionError("down")
+
+    async def ok():
+        return 1
+
+    async def run():
+        changes = []
+        breaker = CircuitBreaker(
+            failure_threshold=2,
+            recovery_time=0.05,
+            on_state_change=lambda old, new: changes.append((old, new)),
+        )
+        for _ in range(2):
+            with pytest.raises(StorageUnavailable):
+                await breaker.call(fail)
+        assert breaker.state is CircuitState.OPEN
+        with pytest.raises(StorageUnavailable):
+            await breaker.call(ok)  # not called while open
+
+        await asyncio.sleep(0.06)
+        with pytest.raises(StorageUnavailable):
+            await breaker.call(fail)  # the probe fails
+        assert breaker.state is CircuitState.OPEN
+
+        await asyncio.sleep(0.06)
+        assert await breaker.call(ok) == 1
+        assert breaker.state is CircuitState.CLOSED
+        assert changes == [
+            (CircuitState.CLOSED, CircuitState.OPEN),
+            (CircuitState.OPEN, CircuitState.HALF_OPEN),
+            (CircuitState.HALF_OPEN, CircuitState.OPEN),
+            (CircuitState.OPEN, CircuitState.HALF_OPEN),
+            (CircuitState.HALF_OPEN, CircuitState.CLOSED),
+        ]
+
+    asyncio.run(run())
+
+
+def test_circuit_breaker_timeout():
+    async def run():
+        breaker = CircuitBreaker(timeout=0.01)
+        with pytest.raises(StorageUnavailable):
+            await breaker.call(asyncio.sleep, 1)
+        assert breaker.failures == 1
+
+    asyncio.run(run())
+
+
+def test_circuit_breaker_fail_open():
+    breaker = CircuitBreaker(timeout=0.01, failure_threshold=2, recovery_time=0.1)
+    app, storage = build_slow_app(breaker)
+    with TestClient(app) as client:
+        storage.delay = 0.1
+        for _ in range(5):
+            assert client.get("/").status_code == 200
+        assert breaker.state is CircuitState.OPEN
+
+        storage.delay = 0
+        sleep(0.1)
+        assert client.get("/").status_code == 200  # the probe closes the circuit
+        assert breaker.state is CircuitState.CLOSED
+        assert client.get("/").status_code == 200
+        assert client.get("/").status_code == 429
+
+
+def test_circuit_breaker_fail_closed():
+    breaker = CircuitBreaker(
+        timeout=0.01, failure_threshold=1, recovery_time=10, fail_open=False
+    )
+    app, storage = build_slow_app(breaker)
+    with TestClient(app) as client:
+        storage.delay = 0.1
+        response = client.get("/")
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "10"
+        storage.delay = 0
+        assert client.get("/").status_code == 503  # still open
+
+
+class BrokenStorage(MemoryStorage):
+    async def incr(self, *args, **kwargs):
+        raise ConnectionError("down")
+
+    async def get(self, *args, **kwargs):
+        raise ConnectionError("down")
+
+
+def test_circuit_breaker_leased_limit():
+    for fail_open, status_code in ((True, 200), (False, 503)):
+        app = FastAPI()
+        app.add_middleware(
+            RateLimitingMiddleware,
+            strategy=FixedWindowRateLimiter(storage=BrokenStorage()),
+            circuit_breaker=CircuitBreaker(fail_open=fail_open),
+        )
+
+        @limit(app, "100/minute", lease=0.1)
+        @app.get("/leased")
+        async def _leased():
+            return
+
+        @limit(app, "100/minute")
+        @app.get("/stored")
+        async def _stored():
+            return
+
+        with TestClient(app) as client:
+            assert client.get("/leased").status_code == status_code
+            assert client.get("/stored").status_code == status_code
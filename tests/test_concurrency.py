@@ -0,0 +1,156 @@
+import asyncio
+
+import httpx
+from fastapi import FastAPI, HTTPException
+from limits.aio.storage import MemoryStorage
+from limits.aio.strategies import FixedWindowRateLimiter
+
+from fastlimits import RateLimitingMiddleware, limit, limit_concurrency
+from fastlimits.concurrency import MemoryConcurrency, RedisConcurrency
+
+
+class FakeScript:
+    """Runs the acquire script of `RedisConcurrency` on the sorted sets of `FakeRedis`"""
+
+    def __init__(self, redis):
+        self.redis = redis
+
+    async def execute(self, keys, args):
+        limit, ttl, token = args
+        now = self.redis.time
+        members = self.redis.zsets.setdefault(keys[0], {})
+        for member, expires_at in list(members.items()):
+            if expires_at <= now:
+                del members[member]
+        if len(members) >= limit:
+            return 0
+        members[token] = now + ttl
+        return 1
+
+
+class FakeRedis:
+    def __init__(self):
+        self.time = 1000.0  # the clock of the server
+        self.zsets = {}
+
+    def register_script(self, script):
+        assert "ZREMRANGEBYSCORE" in script
+        return FakeScript(self)
+
+    async def zrem(self, key, members):
+        for member in members:
+            self.zsets.get(key, {}).pop(member, None)
+
+
+class FakeRedisStorage:
+    def __init__(self):
+        self.storage = FakeRedis()
+
+    def prefixed_key(self, key):
+        return f"LIMITS:{key}"
+
+
+def build_concurrency_app(backend=None):
+    backend = backend if backend is not None else MemoryConcurrency()
+    app = FastAPI()
+    app.add_middleware(
+        RateLimitingMiddleware,
+        strategy=FixedWindowRateLimiter(MemoryStorage()),
+        concurrency=backend,
+    )
+    release = asyncio.Event()
+
+    @limit_concurrency(app, 2)
+    @limit(app, "100/minute")
+    @app.get("/slow")
+    async def _slow():
+        await release.wait()
+
+    @limit_concurrency(app, 1)
+    @app.get("/fail")
+    async def _fail():
+        raise HTTPException(500)
+
+    return app, backend, release
+
+
+def test_concurrency_limit():
+    async def run():
+        app, backend, release = build_concurrency_app()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://t") as c:
+            pending = [asyncio.ensure_future(c.get("/slow")) for _ in range(2)]
+            await asyncio.sleep(0.05)
+            assert len(backend) == 1
+            third = await c.get("/slow")
+            assert third.status_code == 429
+            assert third.headers["retry-after"] == "1"
+            release.set()
+            assert [r.status_code for r in await asyncio.gather(*pending)] == [200, 200]
+            assert len(backend) == 0
+            assert (await c.get("/slow")).status_code == 200
+
+    asyncio.run(run())
+
+
+def test_concurrency_released_on_error():
+    async def run():
+        app, backend, _ = build_concurrency_app()
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(transport=transport, base_url="http://t") as c:
+            for _ in range(3):
+                assert (await c.get("/fail")).status_code == 500
+        assert len(backend) == 0
+
+    asyncio.run(run())
+
+
+def test_redis_concurrency_release():
+    async def run():
+        storage = FakeRedisStorage()
+        backend = RedisConcurrency(storage, ttl=30)
+        first = await backend.acquire("key", 2)
+        second = await backend.acquire("key", 2)
+        assert first is not None and second is not None and first != second
+        assert await backend.acquire("key", 2) is None
+        # each key has its own slots
+        assert await backend.acquire("other", 2) is not None
+
+        await backend.release("key", first)
+        # the released slot is reused
+        assert await backend.acquire("key", 2) is not None
+        assert await backend.acquire("key", 2) is None
+        assert len(storage.storage.zsets["LIMITS:CONCURRENCY/key"]) == 2
+
+    asyncio.run(run())
+
+
+def test_redis_concurrency_expires():
+    async def run():
+        storage = FakeRedisStorage()
+        backend = RedisConcurrency(storage, ttl=30)
+        # never released, its worker crashed
+        assert await backend.acquire("key", 1) is not None
+        storage.storage.time += 29
+        assert await backend.acquire("key", 1) is None
+        storage.storage.time += 1
+        assert await backend.acquire("key", 1) is not None  # freed after the ttl
+
+    asyncio.run(run())
+
+
+def test_redis_concurrency_middleware():
+    async def run():
+        storage = FakeRedisStorage()
+        app, _, release = build_concurrency_app(RedisConcurrency(storage))
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://t") as c:
+            pending = [asyncio.ensure_future(c.get("/slow")) for _ in range(2)]
+            await asyncio.sleep(0.05)
+            assert (await c.get("/slow")).status_code == 429
+            release.set()
+            assert [r.status_code for r in await asyncio.gather(*pending)] == [200, 200]
+            assert not any(storage.storage.zsets.values())  # the slots are released
+            assert (await c.get("/slow")).status_code == 200
+
+    asyncio.run(run())
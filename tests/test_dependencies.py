@@ -1,9 +1,17 @@
 import inspect
-from typing import List, Optional
+import subprocess
+import sys
+from typing import Iterator, List, Optional
 
+import pytest
+from fastapi import Depends, FastAPI, Header
 from fastapi.dependencies.models import Dependant
+from fastapi.testclient import TestClient
+from limits.aio.storage import MemoryStorage
+from limits.aio.strategies import FixedWindowRateLimiter
+from pydantic import BaseModel
 
-from fastlimits import dependencies
+from fastlimits import RateLimitingMiddleware, dependencies, limit_route
 
 from . import build_app
 
@@ -23,10 +31,10 @@ def test_dependency_injector():
         # check if dependency was injected
         assert dep is not None
 
-        # check if keys_resovlers and filters_resovler sub dependencies were injected too
+        # only the key functions are injected, filters are resolved lazily
         sub_deps = [sub_dep.name for sub_dep in dep.dependencies]
-        assert "keys" in sub_deps
-        assert "filters" in sub_deps
+        assert ("keys" in sub_deps) == (route.endpoint.__name__ == "_other_second_get")
+        assert "filters" not in sub_deps
 
 
 def test_dependency_keys_inject():
@@ -39,21 +47,32 @@ def test_dependency_keys_inject():
             if sd.name == "keys":
                 key_resolver = sd
 
+        # static keys are compiled into the dependency, only key functions are injected
+        if route.endpoint.__name__ != "_other_second_get":
+            assert key_resolver is None
+            continue
         assert key_resolver is not None
-
         sig = inspect.signature(key_resolver.call)
+        assert ["some_dependency_function"] == list(
+            p.name for p in sig.parameters.values()
+        )
+
+
+def test_dependency_key_template():
+    app, routes = build_app()
+    for route in routes:
+        dep = get_limit_dependency(route.dependant.dependencies)
+        assert dep is not None
+        template = dep.call.key_template
         name = route.endpoint.__name__
         if name == "_get":
-            keys = ["_get"]
+            assert template.format() == ("_get",)
         elif name == "_post":
-            keys = ["_post", "some_key"]
+            assert template.format() == ("_post/some_key",)
         elif name == "_other_get":
-            keys = ["some_key"]
+            assert template.format() == ("some_key",)
         elif name == "_other_second_get":
-            keys = ["some_key", "some_dependency_function"]
-        else:
-            continue
-        assert keys == list(p.name for p in sig.parameters.values())
+            assert template.format(["value"]) == ["some_key", "value"]
 
 
 def test_dependency_filters_inject():
@@ -61,19 +80,154 @@ def test_dependency_filters_inject():
     for route in routes:
         dep = get_limit_dependency(route.dependant.dependencies)
         assert dep is not None
-        filters_resolver = None
-        for sd in dep.dependencies:
-            if sd.name == "filters":
-                filters_resolver = sd
+        lazy_filters = dep.call.filters
 
-        assert filters_resolver is not None
-
-        sig = inspect.signature(filters_resolver.call)
         name = route.endpoint.__name__
         if name == "_other_get":
             filters = ["some_filter_function", "some_funky_dependency"]
         elif name == "_other_second_get":
             filters = ["some_filter_function"]
         else:
-            filters = []
-        assert filters == list(p.name for p in sig.parameters.values())
+            assert lazy_filters is None
+            continue
+        assert filters == [f.__name__ for f, *_ in lazy_filters.filters]
+
+
+def test_filters_short_circuit():
+    calls = []
+
+    def expensive_dependency() -> str:
+        calls.append("expensive_dependency")
+        return "value"
+
+    def reject() -> bool:
+        calls.append("reject")
+        return False
+
+    def expensive_filter(value: str = Depends(expensive_dependency)) -> bool:
+        calls.append("expensive_filter")
+        return True
+
+    app = FastAPI()
+    app.add_middleware(
+        RateLimitingMiddleware,
+        strategy=FixedWindowRateLimiter(storage=MemoryStorage()),
+    )
+
+    @limit_route(app, "1/minute", filters=[reject, expensive_filter])
+    @app.get("/")
+    async def _get():
+        return
+
+    with TestClient(app) as client:
+        for _ in range(3):
+            assert client.get("/").status_code == 200
+    assert calls == ["reject"] * 3
+
+
+def test_filters_validation():
+    def needs_header(x_token: str = Header()) -> bool:
+        return x_token == "secret"
+
+    app = FastAPI()
+    app.add_middleware(
+        RateLimitingMiddleware,
+        strategy=FixedWindowRateLimiter(storage=MemoryStorage()),
+    )
+
+    @limit_route(app, "1/minute", filters=needs_header)
+    @app.get("/")
+    async def _get():
+        return
+
+    with TestClient(app) as client:
+        assert client.get("/").status_code == 422
+        assert client.get("/", headers={"x-token": "secret"}).status_code == 200
+        assert client.get("/", headers={"x-token": "secret"}).status_code == 429
+        assert client.get("/", headers={"x-token": "other"}).status_code == 200
+
+
+def test_filters_shared_dependency():
+    calls = []
+
+    def current_user() -> str:
+        calls.append("current_user")
+        return "admin"
+
+    def not_admin(user: str = Depends(current_user)) -> bool:
+        return user != "admin"
+
+    app = FastAPI()
+    app.add_middleware(
+        RateLimitingMiddleware,
+        strategy=FixedWindowRateLimiter(storage=MemoryStorage()),
+    )
+
+    @limit_route(app, "1/minute", filters=not_admin)
+    @app.get("/")
+    async def _get(user: str = Depends(current_user)):
+        return user
+
+    with TestClient(app) as client:
+        for _ in range(3):
+            assert client.get("/").json() == "admin"
+    # resolved once per request, for both the filter and the endpoint
+    assert calls == ["current_user"] * 3
+
+
+def test_filters_body_params():
+    class Item(BaseModel):
+        name: str
+
+    def reads_body(item: Item) -> bool:
+        return item.name == "free"
+
+    app = FastAPI()
+
+    @app.post("/")
+    async def _post(item: Item):
+        return
+
+    with pytest.raises(ValueError, match="body parameters"):
+        limit_route(app, "1/minute", filters=reads_body)(_post)
+
+
+def test_filters_yield_dependency():
+    events = []
+
+    def session() -> Iterator[str]:
+        events.append("open")
+        yield "session"
+        events.append("close")
+
+    def has_session(db: str = Depends(session)) -> bool:
+        events.append("filter")
+        return db == "session"
+
+    app = FastAPI()
+    app.add_middleware(
+        RateLimitingMiddleware,
+        strategy=FixedWindowRateLimiter(storage=MemoryStorage()),
+    )
+
+    @limit_route(app, "1/minute", filters=has_session)
+    @limit_route(app, "5/minute", filters=has_session)
+    @app.get("/")
+    async def _get():
+        events.append("endpoint")
+        return
+
+    with TestClient(app) as client:
+        assert client.get("/").status_code == 200
+    # the dependency is resolved once and closed after the endpoint, not when the filter returns
+    assert events == ["open", "filter", "filter", "endpoint", "close"]
+
+
+def test_filters_without_private_fastapi_helpers():
+    # `_normalize_errors` is private to FastAPI, it may be gone in a future release
+    code = (
+        "import fastapi._compat; del fastapi._compat._normalize_errors; "
+        "from fastlimits import filters; "
+        "assert filters._normalize_errors([{'loc': ()}]) == [{'loc': ()}]"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
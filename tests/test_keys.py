@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI, Request
+from limits.aio.storage import MemoryStorage
+from limits.aio.strategies import FixedWindowRateLimiter
+from starlette.testclient import TestClient
+
+from fastlimits import GlobalLimit, RateLimitingMiddleware, keys, limit
+
+
+def sync_key(request: Request) -> str:
+    return "sync"
+
+
+async def async_key(request: Request) -> str:
+    return "async"
+
+
+class AsyncCallableKey:
+    async def __call__(self, request: Request) -> str:
+        return "callable"
+
+
+def test_compile_key_builder():
+    request = Request({"type": "http"})
+    build = keys.compile_key_builder([sync_key, async_key, AsyncCallableKey()])
+    assert asyncio.run(build(request)) == ["sync", "async", "callable"]
+    build = keys.compile_key_builder([sync_key, sync_key])
+    assert asyncio.run(build(request)) == ["sync", "sync"]
+
+
+def test_key_template():
+    template = keys.KeyTemplate(["a", "b", sync_key, "c", async_key])
+    assert template.parts == ("a/b", None, "c", None)
+    assert template.static is None
+    assert template.format(["x", "y"]) == ["a/b", "x", "c", "y"]
+
+    template = keys.KeyTemplate(["a", "b"])
+    assert template.format() == ("a/b",)
+
+
+def test_key_compactor():
+    mapping = {}
+    compactor = keys.KeyCompactor(on_compact=mapping.__setitem__)
+    compacted = compactor(["endpoint", "127.0.0.1", "user/42"])
+    assert len(compacted) == 1
+    assert compacted[0].startswith("k:") and len(compacted[0]) == 18
+    assert mapping == {compacted[0]: ("endpoint", "127.0.0.1", "user/42")}
+    assert compactor(["endpoint", "127.0.0.1", "user/42"]) == compacted
+    # the boundaries of the keys are part of the digest
+    assert compactor(["endpoint", "127.0.0.1/user", "42"]) != compacted
+    assert keys.KeyCompactor(namespace="v2")(["endpoint"])[0].startswith("v2:")
+    with pytest.raises(ValueError):
+        keys.KeyCompactor(digest_size=4)
+
+
+def test_key_compactor_middleware():
+    mapping = {}
+    storage = MemoryStorage()
+    app = FastAPI()
+    app.add_middleware(
+        RateLimitingMiddleware,
+        strategy=FixedWindowRateLimiter(storage),
+        key_compactor=keys.KeyCompactor(on_compact=mapping.__setitem__),
+        global_limits=[GlobalLimit("10/minute")],
+    )
+
+    @limit(app, "2/minute", keys="some_key")
+    @app.get("/")
+    async def _get():
+        return
+
+    @limit(app, "2/minute", key_compactor=keys.KeyCompactor(namespace="other"))
+    @app.get("/other")
+    async def _other():
+        return
+
+    with TestClient(app) as client:
+        assert [client.get("/").status_code for _ in range(3)] == [200, 200, 429]
+        assert client.get("/other").status_code == 200
+    assert sorted(mapping.values()) == [
+        ("testclient", "_get/some_key"),
+        ("testclient", "global//"),
+    ]
+    assert sorted(key.split(":")[0] for key in storage.storage) == [
+        "LIMITER/k",
+        "LIMITER/k",
+        "LIMITER/other",
+    ]
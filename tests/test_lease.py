@@ -0,0 +1,109 @@
+import asyncio
+
+from limits import parse
+from limits.aio.storage import MemoryStorage
+from limits.aio.strategies import FixedWindowRateLimiter
+from starlette.testclient import TestClient
+
+from fastlimits import limit
+from fastlimits.lease import LeaseManager
+
+from . import CountingStorage, build_app
+
+
+def test_lease_consume():
+    async def run():
+        storage = CountingStorage()
+        strategy = FixedWindowRateLimiter(storage=storage)
+        leases = LeaseManager(strategy)
+        item = parse("100/minute")
+        for _ in range(100):
+            assert await leases.consume(item, ["key"], 0.1)
+        assert not await leases.consume(item, ["key"], 0.1)
+        assert storage.incr_calls < 20  # 10 blocks of 10 hits
+        assert await storage.get(item.key_for("key")) >= 100
+
+    asyncio.run(run())
+
+
+def test_lease_concurrent_consume():
+    async def run():
+        strategy = FixedWindowRateLimiter(storage=MemoryStorage())
+        leases = LeaseManager(strategy)
+        item = parse("1000/minute")
+        allowed = await asyncio.gather(
+            *(leases.consume(item, ["key"], 0.01) for _ in range(50))
+        )
+        # the callers that share a refill lease more blocks instead of being limited
+        assert all(allowed)
+        assert 50 <= await strategy.storage.get(item.key_for("key")) <= 60
+
+        item = parse("25/minute")
+        allowed = await asyncio.gather(
+            *(leases.consume(item, ["key"], 0.2) for _ in range(50))
+        )
+        assert allowed.count(True) == 25  # only the storage denies the hits
+
+    asyncio.run(run())
+
+
+def test_lease_close_returns_unused():
+    async def run():
+        strategy = FixedWindowRateLimiter(storage=MemoryStorage())
+        leases = LeaseManager(strategy, low_water=0)
+        item = parse("100/minute")
+        assert await leases.consume(item, ["key"], 0.5)
+        assert await strategy.storage.get(item.key_for("key")) == 50
+        await leases.close()
+        assert await strategy.storage.get(item.key_for("key")) == 1
+
+    asyncio.run(run())
+
+
+def test_lease_route():
+    app, routes = build_app()
+
+    @limit(app, "4/minute", lease=0.5)
+    @app.get("/leased")
+    async def _leased():
+        return
+
+    with TestClient(app) as client:
+        for _ in range(4):
+            assert client.get("/leased").status_code == 200
+        assert client.get("/leased").status_code == 429
+
+
+def test_lease_storage_call():
+    async def run():
+        operations = []
+
+        async def storage_call(operation, func, *args):
+            operations.append(operation)
+            return await func(*args)
+
+        strategy = FixedWindowRateLimiter(storage=MemoryStorage())
+        leases = LeaseManager(strategy, storage_call=storage_call)
+        item = parse("100/minute")
+        assert await leases.consume(item, ["key"], 0.1)
+        assert operations == ["hit", "window_stats"]
+
+    asyncio.run(run())
+
+
+def test_lease_sweep_expired():
+    async def run():
+        strategy = FixedWindowRateLimiter(storage=MemoryStorage())
+        leases = LeaseManager(strategy, ttl=0.05, low_water=0)
+        item = parse("100/minute")
+        for i in range(10):
+            assert await leases.consume(item, [str(i)], 0.1)
+        assert len(leases) == 10
+        await asyncio.sleep(0.06)
+        assert await leases.consume(item, ["other"], 0.1)
+        assert len(leases) == 1
+        await leases.close()
+        # the unused hits of the expired leases were given back
+        assert await strategy.storage.get(item.key_for("0")) == 1
+
+    asyncio.run(run())
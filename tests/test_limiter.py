@@ -1,7 +1,20 @@
-from time import sleep
+from time import sleep, time
 
+from fastapi import BackgroundTasks, Depends, FastAPI, Header, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from limits.aio.storage import MemoryStorage, MovingWindowSupport, Storage
+from limits.aio.strategies import FixedWindowRateLimiter, MovingWindowRateLimiter
 from starlette.testclient import TestClient
 
+from fastlimits import (
+    GlobalLimit,
+    RateLimitingMiddleware,
+    limit,
+    limit_route,
+    limit_routes,
+)
+from fastlimits.metrics import LimiterMetrics
+
 from . import build_app
 
 
@@ -72,3 +85,392 @@ def test_limits_shared_key():
             client.get("/other", headers={"x-some-header": "some-header"}).status_code
             == 429
         )
+
+
+def test_limits_streaming_response():
+    app, routes = build_app()
+
+    @limit(app, "2/minute")
+    @app.get("/stream")
+    async def _stream():
+        async def chunks():
+            for chunk in (b"a", b"b", b"c"):
+                yield chunk
+
+        return StreamingResponse(chunks())
+
+    with TestClient(app) as client:
+        response = client.get("/stream")
+        assert response.status_code == 200
+        assert response.content == b"abc"
+        assert client.get("/stream").status_code == 200
+        assert client.get("/stream").status_code == 429
+
+
+def test_limits_background_tasks():
+    app, routes = build_app()
+    done = []
+
+    @limit(app, "1/minute")
+    @app.get("/background")
+    async def _background(background_tasks: BackgroundTasks):
+        background_tasks.add_task(done.append, True)
+
+    with TestClient(app) as client:
+        assert client.get("/background").status_code == 200
+        assert done == [True]
+        assert client.get("/background").status_code == 429
+        assert done == [True]
+
+
+def test_limit_atomic():
+    app, routes = build_app(atomic=True)
+    with TestClient(app) as client:
+        for _ in range(5):
+            assert client.get("/").status_code == 200
+        assert client.get("/").status_code == 429
+
+
+def test_limit_atomic_no_hit_status_codes():
+    app, routes = build_app(atomic=True)
+
+    @limit(app, "2/minute", no_hit_status_codes=[404])
+    @app.get("/missing")
+    async def _missing():
+        raise HTTPException(status_code=404)
+
+    @limit(app, "2/minute", no_hit_status_codes=[404])
+    @app.get("/found")
+    async def _found():
+        return
+
+    with TestClient(app) as client:
+        for _ in range(5):
+            assert client.get("/missing").status_code == 404  # refunded every time
+        assert client.get("/found").status_code == 200
+        assert client.get("/found").status_code == 200
+        assert client.get("/found").status_code == 429
+
+
+def test_limits_multiple():
+    app, routes = build_app()
+
+    @limit(app, "2/second")
+    @limit(app, "3/minute")
+    @app.get("/multiple")
+    async def _multiple():
+        return
+
+    with TestClient(app) as client:
+        assert client.get("/multiple").status_code == 200
+        assert client.get("/multiple").status_code == 200
+        response = client.get("/multiple")
+        assert response.status_code == 429
+        assert response.json() == {"detail": "Rate limit exceeded: 2 per 1 second"}
+        sleep(1)
+        assert client.get("/multiple").status_code == 200
+        response = client.get("/multiple")  # both limits were hit by every request
+        assert response.status_code == 429
+        assert response.json() == {"detail": "Rate limit exceeded: 3 per 1 minute"}
+
+
+def test_limits_multiple_atomic():
+    app, routes = build_app(atomic=True)
+
+    @limit(app, "1/minute", keys="first", override_default_keys=True)
+    @limit(app, "5/minute", keys="second", override_default_keys=True)
+    @app.get("/multiple")
+    async def _multiple():
+        return
+
+    @limit(app, "5/minute", keys="second", override_default_keys=True)
+    @app.get("/multiple/second")
+    async def _second():
+        return
+
+    with TestClient(app) as client:
+        assert client.get("/multiple").status_code == 200
+        assert client.get("/multiple").status_code == 429  # "second" is refunded
+        for _ in range(4):
+            assert client.get("/multiple/second").status_code == 200
+        assert client.get("/multiple/second").status_code == 429
+
+
+def test_limit_retry_after():
+    app, routes = build_app()
+    with TestClient(app) as client:
+        for _ in range(5):
+            assert "retry-after" not in client.get("/").headers
+        response = client.get("/")
+        assert response.status_code == 429
+        assert 0 < int(response.headers["retry-after"]) <= 60
+        assert "x-ratelimit-limit" not in response.headers
+
+
+def test_limit_headers():
+    app, routes = build_app(headers_enabled=True)
+    with TestClient(app) as client:
+        for remaining in (4, 3, 2, 1, 0):
+            response = client.get("/")
+            assert response.status_code == 200
+            assert response.headers["x-ratelimit-limit"] == "5"
+            assert response.headers["x-ratelimit-remaining"] == str(remaining)
+            assert 0 < int(response.headers["x-ratelimit-reset"]) - time() <= 61
+        response = client.get("/")
+        assert response.status_code == 429
+        assert response.headers["x-ratelimit-remaining"] == "0"
+        assert response.headers["x-ratelimit-reset"]
+        assert response.headers["retry-after"]
+
+
+def test_limit_headers_atomic():
+    app, routes = build_app(headers_enabled=True, atomic=True)
+    with TestClient(app) as client:
+        response = client.get("/")
+        assert response.headers["x-ratelimit-remaining"] == "4"
+
+
+def test_limit_headers_moving_window():
+    for atomic in (False, True):
+        app = FastAPI()
+        app.add_middleware(
+            RateLimitingMiddleware,
+            strategy=MovingWindowRateLimiter(MemoryStorage()),
+            headers_enabled=True,
+            atomic=atomic,
+        )
+
+        @limit(app, "2/minute")
+        @app.get("/")
+        async def _get():
+            return
+
+        with TestClient(app) as client:
+            for remaining in (1, 0):
+                response = client.get("/")
+                assert response.status_code == 200
+                assert response.headers["x-ratelimit-remaining"] == str(remaining)
+                assert 0 < int(response.headers["x-ratelimit-reset"]) - time() <= 61
+            assert client.get("/").status_code == 429
+
+
+class RemoteMovingWindow(Storage, MovingWindowSupport):
+    """A moving window storage that isn't in process, like Redis"""
+
+    STORAGE_SCHEME = ["async+test-remote"]
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.memory = MemoryStorage()
+
+    @property
+    def base_exceptions(self):
+        return ValueError
+
+    async def incr(self, *args, **kwargs):
+        return await self.memory.incr(*args, **kwargs)
+
+    async def get(self, key):
+        return await self.memory.get(key)
+
+    async def get_expiry(self, key):
+        return await self.memory.get_expiry(key)
+
+    async def check(self):
+        return True
+
+    async def reset(self):
+        return await self.memory.reset()
+
+    async def clear(self, key):
+        await self.memory.clear(key)
+
+    async def acquire_entry(self, *args, **kwargs):
+        return await self.memory.acquire_entry(*args, **kwargs)
+
+    async def get_moving_window(self, *args, **kwargs):
+        return await self.memory.get_moving_window(*args, **kwargs)
+
+
+class StorageCalls(LimiterMetrics):
+    def __init__(self) -> None:
+        self.calls = []
+
+    def decision(self, item, keys, outcome) -> None:
+        pass
+
+    def storage_call(self, operation, seconds) -> None:
+        self.calls.append(operation)
+
+
+def test_limit_headers_remote_moving_window():
+    metrics = StorageCalls()
+    app = FastAPI()
+    app.add_middleware(
+        RateLimitingMiddleware,
+        strategy=MovingWindowRateLimiter(RemoteMovingWindow()),
+        headers_enabled=True,
+        atomic=True,
+        metrics=metrics,
+    )
+
+    @limit(app, "2/minute")
+    @app.get("/")
+    async def _get():
+        return
+
+    with TestClient(app) as client:
+        for _ in range(2):
+            response = client.get("/")
+            assert response.status_code == 200
+            # the hit doesn't report the window, it's not read with another call
+            assert response.headers["x-ratelimit-limit"] == "2"
+            assert "x-ratelimit-remaining" not in response.headers
+            assert "x-ratelimit-reset" not in response.headers
+    assert metrics.calls == ["hit", "hit"]
+
+
+def test_limit_route():
+    app, routes = build_app()
+
+    @limit_route(app, "1/minute")
+    @app.get("/explicit")
+    async def _explicit():
+        return
+
+    with TestClient(app) as client:
+        assert client.get("/explicit").status_code == 200
+        assert client.get("/explicit").status_code == 429
+
+
+def test_limit_routes():
+    group = FastAPI()
+    group.add_middleware(
+        RateLimitingMiddleware, strategy=FixedWindowRateLimiter(MemoryStorage())
+    )
+
+    @group.get("/first")
+    async def _first():
+        return
+
+    @group.get("/second")
+    async def _second():
+        return
+
+    limit_routes(group, "1/minute", keys="group", override_default_keys=True)
+    limit(group, "5/minute")
+
+    with TestClient(group) as client:
+        assert client.get("/first").status_code == 200
+        assert client.get("/second").status_code == 429
+
+
+def test_global_limits():
+    calls = []
+
+    def dependency():
+        calls.append(1)
+
+    app, routes = build_app(
+        global_limits=[
+            GlobalLimit("2/minute", prefix="/api"),
+            GlobalLimit("100/minute"),
+        ],
+        headers_enabled=True,
+    )
+
+    @app.get("/api/items", dependencies=[Depends(dependency)])
+    async def _items():
+        return
+
+    with TestClient(app) as client:
+        assert client.get("/api/items").status_code == 200
+        assert client.get("/api/missing").status_code == 404  # before routing
+        response = client.get("/api/items")
+        assert response.status_code == 429
+        assert response.json() == {"detail": "Rate limit exceeded: 2 per 1 minute"}
+        assert response.headers["retry-after"]
+        assert response.headers["x-ratelimit-remaining"] == "0"
+        # the dependencies of a rejected request are not resolved
+        assert len(calls) == 1
+        assert client.get("/apis").status_code == 404  # not under the prefix
+        assert client.get("/").status_code == 200
+
+
+def test_limit_tiers():
+    app = FastAPI()
+    app.add_middleware(
+        RateLimitingMiddleware, strategy=FixedWindowRateLimiter(MemoryStorage())
+    )
+    checked = []
+
+    def is_admin(x_role: str = Header("user")) -> bool:
+        checked.append("is_admin")
+        return x_role == "admin"
+
+    def is_member(x_role: str = Header("user")) -> bool:
+        checked.append("is_member")
+        return x_role == "member"
+
+    @limit_route(
+        app, "1/minute", tiers=[(is_admin, "3/minute"), (is_member, "2/minute")]
+    )
+    @app.get("/")
+    async def _get():
+        return
+
+    def get(role):
+        return TestClient(app).get("/", headers={"x-role": role}).status_code
+
+    assert [get("admin") for _ in range(4)] == [200, 200, 200, 429]
+    assert checked == ["is_admin"] * 4  # the first matching tier stops the search
+    assert [get("member") for _ in range(3)] == [200, 200, 429]
+    assert [get("user") for _ in range(2)] == [200, 429]
+
+
+def test_limit_cost():
+    app = FastAPI()
+    app.add_middleware(
+        RateLimitingMiddleware, strategy=FixedWindowRateLimiter(MemoryStorage())
+    )
+
+    @limit_route(app, "10/minute", cost=4)
+    @app.get("/export")
+    async def _export():
+        return
+
+    @limit_route(app, "10/minute", cost=lambda request: int(request.query_params["n"]))
+    @app.get("/items")
+    async def _items():
+        return
+
+    with TestClient(app) as client:
+        assert [client.get("/export").status_code for _ in range(3)] == [200, 200, 429]
+        assert client.get("/items", params={"n": 6}).status_code == 200
+        assert client.get("/items", params={"n": 5}).status_code == 429
+        assert client.get("/items", params={"n": 4}).status_code == 200
+        assert client.get("/items", params={"n": 1}).status_code == 429
+
+
+def test_limit_response_cost():
+    for atomic in (False, True):
+        app = FastAPI()
+        app.add_middleware(
+            RateLimitingMiddleware,
+            strategy=FixedWindowRateLimiter(MemoryStorage()),
+            atomic=atomic,
+        )
+
+        async def rows(request, response) -> int:
+            return int(response.headers.get("x-rows", 1))
+
+        @limit_route(app, "10/minute", cost=rows)
+        @app.get("/")
+        async def _get(n: int, response: Response):
+            response.headers["x-rows"] = str(n)
+
+        with TestClient(app) as client:
+            assert client.get("/", params={"n": 0}).status_code == 200
+            assert client.get("/", params={"n": 9}).status_code == 200
+            assert client.get("/", params={"n": 3}).status_code == 200  # 1 hit left
+            assert client.get("/", params={"n": 1}).status_code == 429
@@ -0,0 +1,58 @@
+from fastapi import HTTPException
+from starlette.testclient import TestClient
+
+from fastlimits import limit
+from fastlimits.metrics import Cardinality, Histogram, InMemoryMetrics
+
+from . import build_app
+
+
+def test_cardinality():
+    cardinality = Cardinality()
+    assert cardinality.estimate() == 0
+    for i in range(10_000):
+        cardinality.add(("key", str(i)))
+        cardinality.add(("key", str(i)))  # duplicates are not counted
+    assert 9_000 < cardinality.estimate() < 11_000
+
+
+def test_histogram():
+    histogram = Histogram((0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value)
+    assert histogram.cumulative() == [(0.1, 1), (1, 3), (float("inf"), 4)]
+    assert histogram.count == 4
+
+
+def test_metrics_decisions():
+    metrics = InMemoryMetrics()
+    app, routes = build_app(metrics=metrics)
+
+    @limit(app, "2/minute", no_hit_status_codes=[404])
+    @app.get("/metered/{found}")
+    async def _metered(found: bool):
+        if not found:
+            raise HTTPException(404)
+
+    with TestClient(app) as client:
+        assert client.get("/metered/false").status_code == 404
+        assert client.get("/metered/true").status_code == 200
+        assert client.get("/metered/true").status_code == 200
+        assert client.get("/metered/true").status_code == 429
+
+    assert metrics.decisions == {
+        ("2 per 1 minute", "excluded"): 1,
+        ("2 per 1 minute", "allowed"): 2,
+        ("2 per 1 minute", "denied"): 1,
+    }
+    assert round(metrics.cardinality["2 per 1 minute"].estimate()) == 1
+    assert metrics.latency["test"].count == 4
+    assert metrics.latency["hit"].count == 2
+
+    text = metrics.prometheus()
+    assert (
+        'fastlimits_decisions_total{limit="2 per 1 minute",outcome="denied"} 1' in text
+    )
+    assert 'fastlimits_keys{limit="2 per 1 minute"} 1' in text
+    assert 'fastlimits_storage_seconds_bucket{operation="hit",le="+Inf"} 2' in text
+    assert 'fastlimits_storage_seconds_count{operation="test"} 4' in text
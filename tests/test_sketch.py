@@ -0,0 +1,94 @@
+import random
+from collections import Counter
+
+from fastapi import FastAPI
+from limits import parse
+from limits.aio.storage import MemoryStorage
+from limits.aio.strategies import FixedWindowRateLimiter
+from starlette.testclient import TestClient
+
+from fastlimits import RateLimitingMiddleware, limit
+from fastlimits.sketch import CountMinSketch, HeavyHitters, SpaceSaving
+
+
+def test_count_min_sketch():
+    sketch = CountMinSketch(width=256, depth=4)
+    rng = random.Random(1)
+    stream = [f"key-{rng.randrange(2000)}" for _ in range(20000)]
+    for key in stream:
+        sketch.add(key)
+    counts = Counter(stream)
+    for key, count in counts.items():
+        estimate = sketch.estimate(key)
+        assert estimate >= count  # never under counts
+    errors = [sketch.estimate(key) - count for key, count in counts.items()]
+    assert sorted(errors)[int(len(errors) * 0.9)] <= 2 * len(stream) / 256
+    assert sketch.estimate("missing") >= 0
+    assert sketch.total == len(stream)
+
+
+def test_space_saving():
+    summary = SpaceSaving(capacity=50)
+    rng = random.Random(2)
+    stream = ["a"] * 500 + ["b"] * 300 + ["c"] * 200
+    stream += [f"noise-{rng.randrange(1000)}" for _ in range(1000)]
+    rng.shuffle(stream)
+    for key in stream:
+        summary.add(key)
+    assert len(summary) == 50
+    top = summary.top(3)
+    assert [key for key, _, _ in top] == ["a", "b", "c"]
+    for key, count, error in top:
+        assert count - error <= stream.count(key) <= count
+
+    # the buckets stay sorted and cover every key
+    bucket, seen, last = summary.head, 0, 0
+    while bucket is not None:
+        assert bucket.count > last and bucket.keys
+        last, seen, bucket = bucket.count, seen + len(bucket.keys), bucket.next
+    assert seen == 50
+
+
+def test_space_saving_reuses_buckets():
+    summary = SpaceSaving(capacity=10)
+    rng = random.Random(3)
+    buckets = set()
+    for _ in range(5000):
+        summary.add(f"key-{rng.randrange(100)}")
+        buckets.update(id(bucket) for bucket in summary.entries.values())
+    # the emptied buckets are reused, there are never more than one per key
+    assert len(buckets) <= 10
+    bucket, seen, last = summary.head, 0, 0
+    while bucket is not None:
+        assert bucket.count > last and bucket.keys
+        last, seen, bucket = bucket.count, seen + len(bucket.keys), bucket.next
+    assert seen == 10
+
+
+def test_heavy_hitters_middleware():
+    heavy_hitters = HeavyHitters(top_k=3)
+    app = FastAPI()
+    app.add_middleware(
+        RateLimitingMiddleware,
+        strategy=FixedWindowRateLimiter(MemoryStorage()),
+        keys=lambda request: request.headers["x-client"],
+        heavy_hitters=heavy_hitters,
+    )
+
+    @limit(app, "3/minute")
+    @app.get("/")
+    async def _get():
+        return
+
+    with TestClient(app) as client:
+        for client_id, requests in (("a", 10), ("b", 5), ("c", 1), ("d", 2)):
+            for _ in range(requests):
+                client.get("/", headers={"x-client": client_id})
+
+    item = parse("3/minute")
+    top = heavy_hitters.top(item)
+    assert [(hitter.key, hitter.hits) for hitter in top[:2]] == [
+        (item.key_for("a", "_get"), 10),
+        (item.key_for("b", "_get"), 5),
+    ]
+    assert list(heavy_hitters.snapshot(1)) == ["3 per 1 minute"]
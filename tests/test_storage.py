@@ -0,0 +1,219 @@
+import asyncio
+import fcntl
+import multiprocessing
+import subprocess
+import sys
+import time
+
+import pytest
+from limits import parse
+from limits.aio.strategies import FixedWindowRateLimiter, MovingWindowRateLimiter
+from limits.storage import storage_from_string
+from starlette.testclient import TestClient
+
+from fastlimits.storage import ShardedMemoryStorage, SharedMemoryStorage
+from fastlimits.storage.memory import CounterEntry, TimerWheel
+from fastlimits.strategies import refund
+
+from . import build_app
+
+
+def test_sharded_memory_fixed_window():
+    async def run():
+        storage = ShardedMemoryStorage()
+        strategy = FixedWindowRateLimiter(storage)
+        item = parse("3/minute")
+        for _ in range(3):
+            assert await strategy.hit(item, "key")
+        assert not await strategy.hit(item, "key")
+        assert await strategy.hit(item, "other")
+        stats = await strategy.get_window_stats(item, "key")
+        assert stats.remaining == 0
+        assert 0 < stats.reset_time - time.time() <= 60
+        await storage.clear(item.key_for("key"))
+        assert await strategy.test(item, "key")
+
+    asyncio.run(run())
+
+
+def test_sharded_memory_moving_window():
+    async def run():
+        storage = ShardedMemoryStorage()
+        strategy = MovingWindowRateLimiter(storage)
+        item = parse("3/minute")
+        for _ in range(3):
+            assert await strategy.hit(item, "key")
+        assert not await strategy.hit(item, "key")
+        await refund(strategy, item, "key")
+        assert await strategy.hit(item, "key")
+        assert (await strategy.get_window_stats(item, "key")).remaining == 0
+
+    asyncio.run(run())
+
+
+def test_sharded_memory_expiry():
+    async def run():
+        # few shards, so the 100 new keys below reach all of them whatever the hash seed
+        storage = ShardedMemoryStorage(shards=4, resolution=0.1)
+        for i in range(100):
+            await storage.incr(f"key/{i}", 1)
+        assert len(storage) == 100
+        await asyncio.sleep(1.2)
+        await storage.incr("another", 1)  # turns the wheel of its shard
+        assert await storage.get("key/0") == 0
+        for i in range(100):
+            await storage.incr(f"new/{i}", 1)  # every shard is turned
+        assert len(storage) == 101
+
+    asyncio.run(run())
+
+
+def test_sharded_memory_max_entries():
+    async def run():
+        storage = ShardedMemoryStorage(shards=4, max_entries=40)
+        for i in range(1000):
+            await storage.incr(f"key/{i}", 60)
+        assert len(storage) <= 40
+        assert sum(
+            len(slot)
+            for shard in storage.shards
+            for level in shard.wheel.levels
+            for slot in level
+        ) == len(storage)
+        assert await storage.get("key/999") == 1
+
+    asyncio.run(run())
+
+
+def test_timer_wheel_cascade():
+    wheel = TimerWheel(now=0, resolution=1, slots=4, levels=3)
+    entries = [CounterEntry(str(t), t) for t in (1, 3, 5, 17, 40, 100)]
+    for entry in entries:
+        wheel.schedule(entry)
+    fired = {}
+    for now in range(0, 130):
+        for entry in wheel.advance(now):
+            if entry.expires_at <= now:
+                fired[entry.key] = now
+            else:
+                wheel.schedule(entry)
+    assert fired == {"1": 1, "3": 3, "5": 5, "17": 17, "40": 40, "100": 100}
+
+
+def test_sharded_memory_from_string():
+    storage = storage_from_string("async+fastlimits-memory://", shards=2)
+    assert isinstance(storage, ShardedMemoryStorage)
+    assert len(storage.shards) == 2
+
+
+def test_sharded_memory_middleware():
+    app, routes = build_app()
+    app.user_middleware[0].kwargs["strategy"] = FixedWindowRateLimiter(
+        ShardedMemoryStorage()
+    )
+    with TestClient(app) as client:
+        for _ in range(5):
+            assert client.get("/").status_code == 200
+        assert client.get("/").status_code == 429
+
+
+def _hit_shared(path, item_string, hits):
+    async def run():
+        strategy = FixedWindowRateLimiter(SharedMemoryStorage(path=path))
+        item = parse(item_string)
+        return sum([await strategy.hit(item, "key") for _ in range(hits)])
+
+    return asyncio.run(run())
+
+
+def test_shared_memory_processes(tmp_path):
+    path = str(tmp_path / "limits")
+    SharedMemoryStorage(path=path, max_entries=1024)
+    with multiprocessing.get_context("fork").Pool(4) as pool:
+        allowed = pool.starmap(_hit_shared, [(path, "1000/minute", 400)] * 4)
+    assert sum(allowed) == 1000  # exact across the processes
+
+    async def run():
+        storage = SharedMemoryStorage(path=path)
+        assert storage.buckets == 128
+        assert await storage.get(parse("1000/minute").key_for("key")) == 1600
+
+    asyncio.run(run())
+
+
+def _hold_shared_lock(path, locked, release):
+    with open(path, "r+b") as f:
+        fcntl.lockf(f, fcntl.LOCK_EX)
+        locked.set()
+        release.wait(10)
+
+
+def test_shared_memory_lock_doesnt_block(tmp_path):
+    path = str(tmp_path / "limits")
+    storage = SharedMemoryStorage(path=path, max_entries=16)
+    context = multiprocessing.get_context("fork")
+    locked, release = context.Event(), context.Event()
+    holder = context.Process(target=_hold_shared_lock, args=(path, locked, release))
+    holder.start()
+    assert locked.wait(10)
+
+    async def run():
+        incr = asyncio.ensure_future(storage.incr("key", 60))
+        # the loop keeps running while another process holds the lock
+        for _ in range(100):
+            await asyncio.sleep(0)
+        assert not incr.done()
+        assert storage.expires_at("key") is None
+        release.set()
+        assert await asyncio.wait_for(incr, 10) == 1
+
+    try:
+        asyncio.run(run())
+    finally:
+        release.set()
+        holder.join()
+
+
+def test_shared_memory_fixed_window(tmp_path):
+    async def run():
+        storage = storage_from_string(
+            f"async+fastlimits-shm://{tmp_path / 'limits'}", max_entries=16
+        )
+        assert isinstance(storage, SharedMemoryStorage)
+        strategy = FixedWindowRateLimiter(storage)
+        item = parse("2/second")
+        assert await strategy.hit(item, "key")
+        assert await strategy.hit(item, "key")
+        await refund(strategy, item, "key")
+        assert await strategy.hit(item, "key")
+        assert not await strategy.hit(item, "key")
+        assert 0 < storage.expires_at(item.key_for("key")) - time.time() <= 1
+        await asyncio.sleep(1)
+        assert await strategy.hit(item, "key")
+
+        # more keys than slots, the ones that expire first are reused
+        for i in range(100):
+            await storage.incr(f"many/{i}", 60)
+        assert await storage.get("many/99") == 1
+        assert await storage.reset() == 16
+        assert await storage.get("many/99") == 0
+
+    asyncio.run(run())
+
+
+def test_shared_memory_requires_path():
+    # a default file would share the counters of unrelated applications
+    with pytest.raises(ValueError):
+        SharedMemoryStorage()
+    with pytest.raises(ValueError):
+        storage_from_string("async+fastlimits-shm://")
+
+
+def test_import_without_fcntl():
+    # `fcntl` is only available on unix, the other storages don't need it
+    code = (
+        "import sys; sys.modules['fcntl'] = None; "
+        "import fastlimits, fastlimits.strategies, fastlimits.storage as storage; "
+        "assert not hasattr(storage, 'SharedMemoryStorage')"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from limits import parse
+from limits.aio.storage import MemoryStorage
+from limits.aio.strategies import FixedWindowRateLimiter, MovingWindowRateLimiter
+from limits.storage import storage_from_string
+from starlette.testclient import TestClient
+
+from fastlimits import RateLimitingMiddleware, limit, strategies
+from fastlimits.storage import SketchStorage
+
+
+def test_refund_fixed_window():
+    async def run():
+        strategy = FixedWindowRateLimiter(storage=MemoryStorage())
+        item = parse("2/minute")
+        assert await strategy.hit(item, "key")
+        assert await strategy.hit(item, "key")
+        assert not await strategy.test(item, "key")
+        await strategies.refund(strategy, item, "key")
+        assert await strategy.test(item, "key")
+
+    asyncio.run(run())
+
+
+def test_refund_expired_fixed_window():
+    async def run():
+        strategy = FixedWindowRateLimiter(storage=MemoryStorage())
+        item = parse("2/second")
+        assert await strategy.hit(item, "key")
+        assert await strategy.hit(item, "key")
+        await asyncio.sleep(1.1)
+        # the window expired, the refund must not start the next one below 0
+        await strategies.refund(strategy, item, "key")
+        assert await strategy.storage.get(item.key_for("key")) == 0
+        assert await strategy.hit(item, "key")
+        assert await strategy.hit(item, "key")
+        assert not await strategy.hit(item, "key")
+
+    asyncio.run(run())
+
+
+def test_refund_moving_window():
+    async def run():
+        strategy = MovingWindowRateLimiter(storage=MemoryStorage())
+        item = parse("2/minute")
+        assert await strategy.hit(item, "key")
+        assert await strategy.hit(item, "key")
+        assert not await strategy.hit(item, "key")
+        await strategies.refund(strategy, item, "key")
+        assert await strategy.hit(item, "key")
+
+    asyncio.run(run())
+
+
+def test_sketch_window():
+    async def run():
+        storage = SketchStorage(width=1024, depth=4)
+        strategy = strategies.SketchWindowRateLimiter(storage)
+        item = parse("3/day")
+        for _ in range(3):
+            assert await strategy.hit(item, "key")
+        assert not await strategy.test(item, "key")
+        assert not await strategy.hit(item, "key")
+        assert await strategy.test(item, "other")
+
+        stats = await strategy.get_window_stats(item, "key")
+        assert stats.remaining == 0
+        assert stats.reset_time % 86400 == 0
+
+        state = await strategies.check_window(strategy, item, "other", cost=2)
+        assert state == (True, 1, storage.reset_time(86400))
+        state = await strategies.hit_window(strategy, item, "other", cost=2)
+        assert state == (True, 1, storage.reset_time(86400))
+
+        assert not strategies.supports_refund(strategy)
+        await strategies.refund(strategy, item, "key")
+        assert not await strategy.test(item, "key")
+
+    asyncio.run(run())
+
+
+def test_sketch_window_never_under_counts():
+    async def run():
+        storage = SketchStorage(width=256, depth=4)
+        strategy = strategies.SketchWindowRateLimiter(storage)
+        item = parse("5/day")
+        for i in range(5_000):
+            await strategy.hit(item, str(i))
+        for i in range(5):
+            await strategy.hit(item, "busy")
+        assert not await strategy.test(item, "busy")
+        # 5000 keys in 256 cells, most of the other keys are over-counted as well
+        window = storage.window(item.get_expiry())
+        for i in range(0, 5_000, 97):
+            assert window.sketch.estimate(item.key_for(str(i))) >= 1
+
+    asyncio.run(run())
+
+
+def test_sketch_window_rotation():
+    storage = SketchStorage(width=1024, depth=2)
+    storage.window(60, now=120.0).sketch.add("key", 3)
+    assert storage.window(60, now=179.0).sketch.estimate("key") == 3
+    assert storage.window(60, now=180.0).sketch.estimate("key") == 0
+    assert storage.window(60, now=180.0).start == 180.0
+
+
+def test_sketch_storage():
+    storage = storage_from_string("async+fastlimits-sketch://", width=512)
+    assert isinstance(storage, SketchStorage)
+    assert storage.width == 512
+    with pytest.raises(ValueError):
+        SketchStorage(width=1000)
+    with pytest.raises(NotImplementedError):
+        strategies.SketchWindowRateLimiter(MemoryStorage())
+
+
+def test_sketch_window_middleware():
+    app = FastAPI()
+    app.add_middleware(
+        RateLimitingMiddleware,
+        strategy=strategies.SketchWindowRateLimiter(SketchStorage()),
+        headers_enabled=True,
+    )
+
+    @limit(app, "2/day")
+    @app.get("/")
+    async def _get():
+        return
+
+    with TestClient(app) as client:
+        response = client.get("/")
+        assert response.status_code == 200
+        assert response.headers["x-ratelimit-remaining"] == "1"
+        assert client.get("/").status_code == 200
+        assert client.get("/").status_code == 429
@@ -33,3 +33,49 @@ def test_ensure_list():
     assert [] == utils.ensure_list(None)
     assert [1, 2, 3] == utils.ensure_list([1, 2, 3])
     assert ["somestr"] == utils.ensure_list("somestr")
+
+
+def test_find_api_route_index():
+    app = FastAPI()
+
+    @app.get("/")
+    async def _get(): ...
+
+    assert utils.find_api_route(app, _get).endpoint is _get
+
+    @app.post("/")
+    async def _post(): ...
+
+    assert utils.find_api_route(app, _post).endpoint is _post  # added after indexing
+    assert utils.find_api_route(app, test_ensure_list) is None
+
+    app.router.routes.reverse()  # changed in place
+    assert utils.find_api_route(app, _get).endpoint is _get
+    app.router.routes.clear()
+    assert utils.find_api_route(app, _get) is None
+
+
+def test_find_api_route_index_miss(monkeypatch):
+    app = FastAPI()
+
+    @app.get("/")
+    async def _get(): ...
+
+    resets = []
+    monkeypatch.setattr(utils.RouteIndex, "_reset", lambda self: resets.append(1))
+    index = utils.RouteIndex()
+    assert index.find(app.routes, _get).endpoint is _get
+    resets.clear()
+    for _ in range(3):
+        # misses don't rebuild the index while the routes are unchanged
+        assert index.find(app.routes, test_ensure_list) is None
+    assert not resets
+
+    @app.post("/")
+    async def _post(): ...
+
+    assert index.find(app.routes, _post).endpoint is _post
+    assert not resets
+    app.router.routes = list(app.router.routes)
+    assert index.find(app.routes, _post).endpoint is _post
+    assert len(resets) == 1
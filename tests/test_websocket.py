@@ -0,0 +1,102 @@
+import pytest
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from limits.aio.storage import MemoryStorage
+from limits.aio.strategies import FixedWindowRateLimiter
+from starlette.testclient import TestClient
+
+from fastlimits import RateLimitingMiddleware, WebSocketLimit
+from fastlimits.metrics import LimiterMetrics
+
+
+class StorageCalls(LimiterMetrics):
+    def __init__(self) -> None:
+        self.calls = []
+
+    def decision(self, item, keys, outcome) -> None:
+        pass
+
+    def storage_call(self, operation, seconds) -> None:
+        self.calls.append(operation)
+
+
+def build_app(*websocket_limits: WebSocketLimit, **options):
+    storage = MemoryStorage()
+    app = FastAPI()
+    app.add_middleware(
+        RateLimitingMiddleware,
+        strategy=FixedWindowRateLimiter(storage),
+        websocket_limits=list(websocket_limits),
+        **options,
+    )
+
+    @app.websocket("/ws")
+    async def _echo(websocket: WebSocket):
+        await websocket.accept()
+        try:
+            while True:
+                await websocket.send_text(await websocket.receive_text())
+        except WebSocketDisconnect:
+            pass
+
+    @app.get("/")
+    async def _get():
+        return
+
+    return app, storage
+
+
+def test_websocket_connection_limit():
+    app, storage = build_app(WebSocketLimit("2/minute", prefix="/ws"))
+    with TestClient(app) as client:
+        for _ in range(2):
+            with client.websocket_connect("/ws") as websocket:
+                websocket.send_text("hello")
+                assert websocket.receive_text() == "hello"
+        with pytest.raises(WebSocketDisconnect) as exc:
+            with client.websocket_connect("/ws"):
+                pass
+        assert exc.value.code == 1008
+        # http requests are not limited
+        assert client.get("/").status_code == 200
+    assert list(storage.storage.values()) == [2]
+
+
+def test_websocket_message_limit():
+    metrics = StorageCalls()
+    app, storage = build_app(
+        WebSocketLimit("5/minute", messages=True, batch_size=2), metrics=metrics
+    )
+    with TestClient(app) as client:
+        with client.websocket_connect("/ws") as websocket:
+            for i in range(5):
+                websocket.send_text(str(i))
+                assert websocket.receive_text() == str(i)
+            websocket.send_text("over the limit")
+            with pytest.raises(WebSocketDisconnect) as exc:
+                websocket.receive_text()
+            assert exc.value.code == 1008
+    # the messages are hit in batches, not one by one
+    assert metrics.calls == ["hit"] * 4
+
+
+def test_websocket_message_limit_flush():
+    app, storage = build_app(
+        WebSocketLimit("100/minute", prefix="/ws", messages=True, batch_size=10)
+    )
+    with TestClient(app) as client:
+        with client.websocket_connect("/ws") as websocket:
+            for i in range(3):
+                websocket.send_text(str(i))
+                assert websocket.receive_text() == str(i)
+    # the messages counted locally are hit when the connection is closed
+    assert list(storage.storage.values()) == [3]
+
+
+def test_websocket_limit_prefix():
+    app, storage = build_app(WebSocketLimit("1/minute", prefix="/other"))
+    with TestClient(app) as client:
+        for _ in range(2):
+            with client.websocket_connect("/ws") as websocket:
+                websocket.send_text("hello")
+                assert websocket.receive_text() == "hello"
+    assert not storage.storage